@@ -24,6 +24,7 @@ from util.cart import serialize_orders_and_lines
 from util.cart import merge_orders
 from util.cart import error_responses
 from util.cart import warning_responses
+from util.cart import legacy_api
 from util.provider import ConfigProvider
 
 cart_steps = {'pending': 'PENDING', 'submitted': 'SUBMITTED', 'resubmitted': "RESUBMITTED"}
@@ -285,7 +286,8 @@ class CartMixin(object):
         """ Client used to create legacy cart """
         customer_id = kwargs['customer_id']
         payload = kwargs.get('payload', {})
-        token = provider.get_value('jwt.token_basic')
+        legacy = legacy_api.values
+        token = legacy.token_basic
         order = kwargs['order']
 
         headers = {
@@ -293,7 +295,7 @@ class CartMixin(object):
             "Authorization": token
         }
        
-        base = provider.get_value('service.thirstie_legacy.base_url')
+        base = legacy.base_url
         version = 'v0'
         cart_url = '{}/{}/payments/user/{}/carts/'.format(base, version, customer_id)
 
@@ -358,8 +360,9 @@ class CartMixin(object):
     def next_order(self, **kw):
         order = kw['order']
         payload = kw['payload']
-        token = provider.get_value('jwt.token_basic')
-        base = provider.get_value('service.thirstie_legacy.base_url')
+        legacy = legacy_api.values
+        token = legacy.token_basic
+        base = legacy.base_url
         version = 'v0'
         headers = {
             "Content-Type": "application/json",
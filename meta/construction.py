@@ -1,15 +1,124 @@
+import os
+import threading
 
 
 # TODO: A class cannot extend another class when using this as meta.
 class Singleton(type):
     """
     As the metaclass of a class, it turns it into a singleton.
+
+    Instances are built once, under a lock, and looked up without it
+    afterwards. reset() drops them (calling their on_reset() method, when
+    they have one), so the next call builds a new one.
     """
 
     _instances = {}
+    # Reentrant: building a singleton commonly builds others.
+    _lock = threading.RLock()
+
+    def __call__(cls, *args, **kwargs):
+        try:
+            return cls._instances[cls]
+        except KeyError:
+            pass
+
+        with Singleton._lock:
+            if cls not in cls._instances:
+                cls._instances[cls] = super(Singleton, cls).__call__(*args, **kwargs)
+
+            return cls._instances[cls]
+
+    def instances(cls) -> list:
+        """
+        The instances of the class built so far.
+        """
+        instance = cls._instances.get(cls, None)
+        return [] if instance is None else [instance]
+
+    def reset(cls) -> list:
+        """
+        Drop the instances of the class, returning them.
+        """
+        with Singleton._lock:
+            instance = cls._instances.pop(cls, None)
+
+        return Singleton._on_reset([] if instance is None else [instance])
+
+    @staticmethod
+    def reset_all() -> list:
+        """
+        Drop the instances of every singleton class, returning them.
+        """
+        with Singleton._lock:
+            instances = []
+            for value in Singleton._instances.values():
+                instances.extend(value.values() if type(value) is _Keyed else [value])
+            Singleton._instances.clear()
+
+        return Singleton._on_reset(instances)
+
+    @staticmethod
+    def _on_reset(instances: list) -> list:
+        for instance in instances:
+            on_reset = getattr(instance, 'on_reset', None)
+            if callable(on_reset):
+                on_reset()
+
+        return instances
+
+
+class _Keyed(dict):
+    """ The instances of a KeyedSingleton class, by key """
+
+
+class KeyedSingleton(Singleton):
+    """
+    As the metaclass of a class, it builds one instance per key: the value of
+    the class' singleton_key(*args, **kwargs) method, or the arguments
+    themselves when it has none.
+    """
 
     def __call__(cls, *args, **kwargs):
-        if cls not in cls._instances:
-            cls._instances[cls] = super(Singleton, cls).__call__(*args, **kwargs)
+        key = cls._key(args, kwargs)
+        try:
+            return cls._instances[cls][key]
+        except KeyError:
+            pass
+
+        with Singleton._lock:
+            instances = cls._instances.setdefault(cls, _Keyed())
+            if key not in instances:
+                instances[key] = super(Singleton, cls).__call__(*args, **kwargs)
+
+            return instances[key]
+
+    def instances(cls) -> dict:
+        """
+        The instances of the class built so far, by key.
+        """
+        return dict(cls._instances.get(cls, {}))
+
+    def reset(cls, *args, **kwargs) -> list:
+        """
+        Drop the instance the arguments map to or, without any, every instance of the class.
+        """
+        with Singleton._lock:
+            if args or kwargs:
+                instance = cls._instances.get(cls, {}).pop(cls._key(args, kwargs), None)
+                instances = [] if instance is None else [instance]
+            else:
+                instances = list(cls._instances.pop(cls, {}).values())
+
+        return Singleton._on_reset(instances)
+
+    def _key(cls, args: tuple, kwargs: dict):
+        singleton_key = getattr(cls, 'singleton_key', None)
+        if singleton_key is not None:
+            return singleton_key(*args, **kwargs)
+
+        return args, tuple(sorted(kwargs.items()))
+
 
-        return cls._instances[cls]
+if hasattr(os, 'register_at_fork'):
+    # A lock held by another thread when forking would stay held in the child.
+    os.register_at_fork(after_in_child=lambda: setattr(Singleton, '_lock', threading.RLock()))
@@ -1,6 +1,8 @@
+import threading
+import time
 import unittest
 
-from meta.construction import Singleton
+from meta.construction import KeyedSingleton, Singleton
 
 
 class SingletonTest(unittest.TestCase):
@@ -29,3 +31,84 @@ class SingletonTest(unittest.TestCase):
         singleton_b = TestSingletonChild()
         # Then...
         self.assertIs(singleton_a, singleton_b)
+
+    def test_concurrent_first_calls_build_one_instance(self):
+        # Given...
+        class SlowSingleton(metaclass=Singleton):
+            built = 0
+
+            def __init__(self):
+                time.sleep(0.01)
+                SlowSingleton.built += 1
+
+        instances = []
+        threads = [threading.Thread(target=lambda: instances.append(SlowSingleton())) for _ in range(8)]
+        # When...
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # Then...
+        self.assertEqual(1, SlowSingleton.built)
+        self.assertEqual(1, len({id(instance) for instance in instances}))
+        SlowSingleton.reset()
+
+    def test_reset(self):
+        # Given...
+        class TestSingleton(metaclass=Singleton):
+            reset_calls = 0
+
+            def on_reset(self):
+                TestSingleton.reset_calls += 1
+
+        singleton_a = TestSingleton()
+        # When...
+        instances = TestSingleton.instances()
+        dropped = TestSingleton.reset()
+        singleton_b = TestSingleton()
+        # Then...
+        self.assertEqual([singleton_a], instances)
+        self.assertEqual([singleton_a], dropped)
+        self.assertEqual(1, TestSingleton.reset_calls)
+        self.assertIsNot(singleton_a, singleton_b)
+        TestSingleton.reset()
+        self.assertEqual([], TestSingleton.instances())
+
+
+class KeyedSingletonTest(unittest.TestCase):
+
+    maxDiff = None
+
+    def test_one_instance_per_key(self):
+        # Given...
+        class Root(metaclass=KeyedSingleton):
+
+            def __init__(self, path=None):
+                self.path = path
+
+            @classmethod
+            def singleton_key(cls, path=None):
+                return path or 'default'
+
+        # When...
+        first, second = Root('a.yaml'), Root(path='b.yaml')
+        # Then...
+        self.assertIs(first, Root(path='a.yaml'))
+        self.assertIs(Root(), Root(None))
+        self.assertEqual(['a.yaml', 'b.yaml', 'default'], sorted(Root.instances()))
+        self.assertEqual([first], Root.reset('a.yaml'))
+        self.assertIsNot(first, Root('a.yaml'))
+        self.assertEqual(3, len(Root.reset()))
+        self.assertEqual({}, Root.instances())
+
+    def test_default_key_is_the_arguments(self):
+        # Given...
+        class Client(metaclass=KeyedSingleton):
+
+            def __init__(self, host, port=0):
+                self.host, self.port = host, port
+
+        # When/Then...
+        self.assertIs(Client('db', port=1), Client('db', port=1))
+        self.assertIsNot(Client('db', port=1), Client('db', port=2))
+        Client.reset()
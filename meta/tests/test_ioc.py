@@ -1,12 +1,25 @@
+import sys
 import unittest
 
-from meta.ioc import Importer
+from meta.ioc import Importer, UndefinedError
+
+
+class Outer():
+
+    class Inner():
+        pass
 
 
 class ImporterTest(unittest.TestCase):
 
     maxDiff = None
 
+    def setUp(self):
+        self._profile = Importer.profile
+
+    def tearDown(self):
+        Importer.profile = self._profile
+
     def test_get_class(self):
         importer = Importer()
         self.assertEqual(Importer, importer.get_class('meta.ioc.Importer'))
@@ -17,3 +30,46 @@ class ImporterTest(unittest.TestCase):
             importer.get_class('meta.ioc.Undefined')
         self.assertEqual("'Undefined'",
                          str(context.exception))
+
+    def test_get_class_nested(self):
+        # When...
+        inner = Importer.get_class(f'{__name__}.Outer.Inner')
+        # Then...
+        self.assertIs(Outer.Inner, inner)
+        with self.assertRaises(UndefinedError) as context:
+            Importer.get_class(f'{__name__}.Outer.Missing')
+        self.assertEqual("'Missing'", str(context.exception))
+
+    def test_get_class_missing_module(self):
+        # When/Then...
+        with self.assertRaises(ModuleNotFoundError) as context:
+            Importer.get_class('meta.nope.Thing')
+        self.assertEqual('meta.nope', context.exception.name)
+
+    def test_resolved_classes_are_shared(self):
+        # Given...
+        Importer.get_class('meta.construction.Singleton')
+        # When...
+        cached = Importer._resolved['meta.construction.Singleton']
+        # Then...
+        self.assertIs(cached, Importer().get_class('meta.construction.Singleton'))
+
+    def test_preload(self):
+        # When...
+        resolved = Importer.preload(['meta.ioc.Importer', 'json.JSONDecoder', 'meta.ioc.Importer',
+                                     'collections.OrderedDict'])
+        # Then...
+        self.assertEqual(['meta.ioc.Importer', 'json.JSONDecoder', 'collections.OrderedDict'], list(resolved))
+        self.assertIs(Importer, resolved['meta.ioc.Importer'])
+        with self.assertRaises(UndefinedError):
+            Importer.preload(['meta.ioc.Undefined'])
+
+    def test_import_times(self):
+        # Given...
+        Importer.profile = True
+        sys.modules.pop('xml.dom.minidom', None)
+        # When...
+        Importer.get_class('xml.dom.minidom.parseString')
+        # Then...
+        self.assertIn('xml.dom.minidom', Importer.import_times)
+        self.assertIn(('xml.dom.minidom', Importer.import_times['xml.dom.minidom']), Importer.slowest_imports(100))
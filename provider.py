@@ -2,11 +2,22 @@
 Configuration Provider
 @author dmitry
 """
-import yaml, os
+import logging, os, threading
+from collections import namedtuple
+from functools import lru_cache
+from itertools import chain
+from meta.construction import KeyedSingleton
 from meta.ioc import Importer
-from util.loader import Loader
+from util import snapshot
+from util.loader import IncludeGraph, LazyLoader, Loader
+from tools.dicttools import dictquery
+from tools.lazy import LazyNode, materialize
+from tools.persistent import assoc_in, freeze
+from util.watcher import FileWatcher
 from service.provider import ServiceProvider
 
+logger = logging.getLogger(__name__)
+
 
 class ConfigProvider(ServiceProvider):
     """ Basic configuration provider """
@@ -15,36 +26,318 @@ class ConfigProvider(ServiceProvider):
         self.importer = Importer()
         self.service_classes = {}
         self.app_conf = {}
-        self.app_conf_path = kwargs.get('app_conf') or os.environ.get('APP_CONFIG_PATH', '../config.yaml')
+        self.app_conf_path = self.app_conf_path_of(kwargs)
         self.service_conf_path = os.environ.get('SERVICE_CONFIG_PATH', '../configs/service_conf.yaml')
+        self.snapshot_path = kwargs.get('snapshot') or os.environ.get('CONFIG_SNAPSHOT_PATH')
+        self.reload_listeners = []
+        self._write_lock = threading.RLock()
+        self._watcher = None
+        self._indexed = False
+        self.lazy_conf = bool(kwargs.get('lazy') or os.environ.get('CONFIG_LAZY'))
+
+        reload_interval = kwargs.get('reload') or os.environ.get('CONFIG_RELOAD_INTERVAL')
+        self._includes = self._include_graph() if reload_interval else None
+
+        loaded = self._load()
+        self.conf_files = loaded['files']
+        self.include_graph = loaded['graph']
+        self.conf(loaded['service_conf'], loaded['settings'])
+
+        if reload_interval:
+            self.watch(float(reload_interval))
+
+    @staticmethod
+    def app_conf_path_of(kwargs: dict) -> str:
+        return kwargs.get('app_conf') or os.environ.get('APP_CONFIG_PATH', '../config.yaml')
+
+    def _load(self) -> dict:
+        """
+        Parse both configuration roots, going through the on-disk snapshot when one is configured.
+
+        In lazy mode the snapshot is not used: top-level sections of the app
+        configuration and !include targets are only built on first access.
+        """
+        if self.lazy_conf:
+            includes = self._includes or IncludeGraph()
+            service_conf = includes.load(self.service_conf_path, Loader)
+            settings = includes.load(self.app_conf_path, LazyLoader)
+            return {'files': includes.files, 'graph': dict(includes.edges),
+                    'service_conf': service_conf, 'settings': settings}
+
+        if not self.snapshot_path:
+            return snapshot.parse(self.service_conf_path, self.app_conf_path, self._includes)
+
+        loaded = snapshot.load(self.snapshot_path, self.service_conf_path, self.app_conf_path)
+        if loaded is None:
+            loaded = snapshot.parse(self.service_conf_path, self.app_conf_path, self._includes)
+            try:
+                snapshot.dump(self.snapshot_path, loaded)
+            except OSError as e:
+                logger.warning('Could not write the config snapshot %s: %s', self.snapshot_path, e)
+
+        return loaded
+
+    def watch(self, interval: float = 1.0) -> FileWatcher:
+        """
+        Reload in a background thread whenever a configuration file, or a file it includes, changes.
+        """
+        with self._write_lock:
+            if self._includes is None:
+                self._includes = self._include_graph()
+            if self._watcher is None:
+                self._watcher = FileWatcher(self.conf_files, self.reload, interval)
+                self._watcher.start()
+
+        return self._watcher
+
+    def _include_graph(self) -> IncludeGraph:
+        includes = IncludeGraph(retain=True)
+        includes.listeners.append(self._included)
+        return includes
+
+    def _included(self, path: str):
+        # Lazy sections reach their includes on first access, long after the load.
+        self.conf_files = self._includes.files
+        if self._watcher is not None:
+            self._watcher.watch(self.conf_files)
+
+    def stop_watching(self):
+        with self._write_lock:
+            if self._watcher is not None:
+                self._watcher.stop()
+                self._watcher = None
+
+    def on_reset(self):
+        self.stop_watching()
+        super().on_reset()
+
+    def prefork(self, freeze_gc: bool = True):
+        """
+        Build the whole configuration and its indexes before forking, lazy
+        sections included, so children share them instead of each building its own.
+        """
+        with self._write_lock:
+            if not self._indexed:
+                materialize(self.settings)
+                self._build_index()
+
+        super().prefork(freeze_gc)
+
+    def after_fork(self):
+        super().after_fork()
+        # Only the forking thread survives: the parent's watcher is gone, and so
+        # is whoever may have held the write lock.
+        self._write_lock = threading.RLock()
+        if self._includes is not None:
+            self._includes.after_fork()
+        if self._watcher is not None:
+            interval, self._watcher = self._watcher.interval, None
+            self.watch(interval)
+
+    def add_reload_listener(self, listener: callable):
+        """
+        Call listener(provider, services, files) after every reload, with the
+        names of the services that changed and the files that triggered it.
+        Exceptions raised by listeners are logged, and do not stop the others.
+        """
+        self.reload_listeners.append(listener)
 
-        with open(self.service_conf_path, 'r') as fp:
-            self.service_conf = yaml.load(fp.read(), Loader)
+    def reload(self, files: list = None) -> set:
+        """
+        Re-parse what changed among files (all configuration files by default),
+        swap it in and return the names of the services affected.
+        """
+        with self._write_lock:
+            if self._includes is None:
+                self._includes = self._include_graph()
+
+            stale = self._includes.invalidate(files if files is not None else self.conf_files)
+            roots = {}
+            app_loader = LazyLoader if self.lazy_conf else Loader
+            for name, path, loader in (('service_conf', self.service_conf_path, Loader),
+                                       ('settings', self.app_conf_path, app_loader)):
+                if os.path.abspath(path) in stale or os.path.abspath(path) not in self._includes.edges:
+                    roots[name] = self._includes.load(path, loader)
+            self._includes.prune([self.service_conf_path, self.app_conf_path])
+
+            if not roots:
+                return set()
+
+            service_conf, app_conf = self.service_conf, self.app_conf
+            self.conf(roots.get('service_conf', service_conf), roots.get('settings', app_conf))
+            self.conf_files = self._includes.files
+            self.include_graph = {path: list(included) for path, included in self._includes.edges.items()}
+
+            services = self.changed_services(service_conf, app_conf)
+            self.invalidate(services)
+
+            if self._watcher is not None:
+                self._watcher.watch(self.conf_files)
+
+        # The new configuration is in: a failing listener must not get it reloaded again.
+        for listener in list(self.reload_listeners):
+            try:
+                listener(self, services, files)
+            except Exception:
+                logger.exception('Reload listener %r failed', listener)
+
+        return services
+
+    @property
+    def settings(self) -> dict:
+        """
+        The current version of the app configuration.
+
+        Versions are frozen and never change: set_value() and reload() publish
+        new ones, sharing every subtree they did not touch. Hold on to one to
+        read several values consistently, without locking.
+        """
+        return self.app_conf
+
+    def conf(self, service_conf: dict, app_conf: dict = None):
+        # Everything is built before anything is swapped in, so readers never
+        # see the new settings with the indexes of the old ones.
+        app_conf = self.environment.apply(freeze(app_conf if app_conf is not None else {}))
+        dependencies = self._dependency_graph(service_conf)
+        indexes = ({}, {}, {}) if self.lazy_conf else self._index(app_conf)
 
-        with open(self.app_conf_path, 'r') as fp:
-            self.settings = yaml.load(fp.read(), Loader)
+        self._section_index, self._path_index, self._key_index = indexes
+        self._indexed = not self.lazy_conf
+        self._publish(service_conf, dependencies, app_conf)
 
-        self.app_conf = self.settings
+    def refresh_env(self) -> set:
+        """
+        Take a new snapshot of the environment and apply its overrides to the
+        current settings, forgetting the services affected and returning their
+        names. Overrides that were removed are not reverted.
+        """
+        with self._write_lock:
+            variables, app_conf = self.environment.variables, self.app_conf
+            self.environment.refresh()
+            self.conf(self.service_conf, app_conf)
+
+            services = self.changed_services(self.service_conf, app_conf, variables)
+            self.invalidate(services)
+            return services
 
     def value(self, key):
-        return self.locate_value(self.settings, key)[0]
+        if not self._indexed:
+            # Searching by key name needs the whole tree.
+            with self._write_lock:
+                if not self._indexed:
+                    materialize(self.settings)
+                    self._build_index()
+
+        return self._key_index.get(key, ())[0]
+
+    def query(self, query) -> list:
+        """
+        The values matching a path query (service.*.host, **.port, ...), see tools.dicttools.PathQuery.
+        """
+        if self.lazy_conf and not self._indexed:
+            with self._write_lock:
+                if not self._indexed:
+                    materialize(self.settings)
+                    self._build_index()
+
+        return [value for _, value in dictquery(self.settings, query, want_path=False)]
 
     def set_value(self, path, value):
         parts = path.split('.')
-        last_level = self.app_conf
 
-        for i in range(0, len(parts) - 1):
-            if parts[i] not in last_level:
-                last_level[parts[i]] = {}
-            last_level = last_level[parts[i]]
-        last_level[parts.pop()] = value
+        with self._write_lock:
+            replaced = self.app_conf
+            for part in parts:
+                replaced = replaced.get(part) if isinstance(replaced, dict) else None
+                if type(replaced) is LazyNode:
+                    replaced = replaced.resolve()
+
+            self.app_conf = assoc_in(self.app_conf, parts, value)
+            self._reindex(parts, replaced)
 
     def get_value(self, path, default=None):
+        try:
+            return self._path_index[path]
+        except KeyError:
+            pass
+
         try:
             return self._get_conf(path)
         except Exception as e:
             return default
 
+    def get_values(self, paths, defaults: dict = None):
+        """
+        Resolve several paths against one version of the settings, in a single
+        walk over their shared prefixes.
+
+        paths maps field names to dotted paths; a plain list of paths is named
+        after the paths with dots replaced by underscores. Returns an immutable
+        record with one attribute per field, holding what get_value() would,
+        defaults being looked up by field name.
+        """
+        return self._resolve_values(self._compile_values(paths, defaults), self.app_conf)
+
+    def view(self, paths, defaults: dict = None) -> 'ConfigView':
+        """
+        Bind get_values() for the given paths, compiled once and only resolved
+        again when a new version of the settings is published.
+        """
+        return ConfigView(self, self._compile_values(paths, defaults))
+
+    def _compile_values(self, paths, defaults: dict = None) -> tuple:
+        if isinstance(paths, dict):
+            fields, paths = tuple(paths), tuple(paths.values())
+        else:
+            paths = tuple(paths)
+            fields = tuple(path.replace('.', '_') for path in paths)
+
+        defaults = tuple((defaults or {}).get(field) for field in fields)
+
+        # Trie nodes are [children, fields ending here, fields ending here or below].
+        trie = [{}, [], []]
+        for index, path in enumerate(paths):
+            trunk, branches = self._compile_conf_path(path)
+            node = trie
+            for part in (trunk,) + branches:
+                node[2].append(index)
+                node = node[0].setdefault(part, [{}, [], []])
+            node[1].append(index)
+            node[2].append(index)
+
+        return _record_type(fields), trie, defaults
+
+    def _resolve_values(self, plan: tuple, settings: dict):
+        record_type, trie, defaults = plan
+        values = list(defaults)
+        stack = [(settings, trie[0])]
+
+        while stack:
+            conf, children = stack.pop()
+            for part, (grandchildren, ending, below) in children.items():
+                if not isinstance(conf, dict):
+                    # Like _get_conf(), paths going beyond a leaf resolve to that leaf.
+                    for index in below:
+                        values[index] = conf
+                    continue
+
+                try:
+                    node = conf[part]
+                    if type(node) is LazyNode:
+                        node = node.resolve()
+                        dict.__setitem__(conf, part, node)
+                    if self.lazy_conf and ending and type(node) in (dict, list):
+                        materialize(node)
+                except Exception as e:
+                    continue
+
+                for index in ending:
+                    values[index] = node
+                if grandchildren:
+                    stack.append((node, grandchildren))
+
+        return record_type._make(values)
+
     def locate_value(self, search_dict, field):
         """
         Takes a dict with nested lists and dicts,
@@ -71,3 +364,158 @@ class ConfigProvider(ServiceProvider):
                             fields_found.append(another_result)
 
         return fields_found
+
+    def _build_index(self):
+        """
+        Index the settings once so that value() and get_value() are plain dict hits.
+
+        The key index maps every key name to the values locate_value() would find
+        for it, in the same order, and is kept per top-level section so set_value()
+        only has to re-index the section it touched. The path index maps every
+        dotted path made of dict keys to its node.
+        """
+        self._section_index, self._path_index, self._key_index = self._index(self.settings)
+        self._indexed = True
+
+    def _index(self, settings: dict) -> tuple:
+        """
+        The section, path and key indexes of a version of the settings.
+        """
+        section_index = {}
+        path_index = {}
+
+        for section, value in settings.items():
+            section_index[section] = self._index_section(section, value)
+            if isinstance(section, str) and '.' not in section:
+                path_index.update(self._iter_paths(section, value))
+
+        key_index = {}
+        for section_keys in section_index.values():
+            for key, values in section_keys.items():
+                key_index.setdefault(key, []).extend(values)
+
+        return section_index, path_index, key_index
+
+    def _reindex(self, parts: list, replaced=None):
+        if not self._indexed:
+            return
+
+        section = parts[0]
+        prefix = '.'.join(parts)
+
+        for path, node in self._iter_paths(prefix, replaced):
+            self._path_index.pop(path, None)
+
+        # Intermediate levels may have just been created by set_value().
+        node = self.settings
+        for i, part in enumerate(parts, 1):
+            if not isinstance(node, dict):
+                break
+            node = node[part]
+            self._path_index['.'.join(parts[:i])] = node
+        else:
+            self._path_index.update(self._iter_paths(prefix, node))
+
+        stale_keys = set(self._section_index.get(section, ()))
+        self._section_index[section] = self._index_section(section, self.settings[section])
+        stale_keys.update(self._section_index[section])
+
+        # Sections are concatenated in settings order so value() keeps returning
+        # the same first match as locate_value().
+        for key in stale_keys:
+            values = []
+            for name in self.settings:
+                values.extend(self._section_index.get(name, {}).get(key, ()))
+            if values:
+                self._key_index[key] = values
+            else:
+                self._key_index.pop(key, None)
+
+    @staticmethod
+    def _index_section(section, value) -> dict:
+        """
+        Collect the key index of one top-level section, mirroring locate_value():
+        entries are visited depth first and a matching key's value is not searched
+        again for that same key.
+        """
+        index = {}
+        stack = [(iter(((section, value),)), frozenset())]
+
+        while stack:
+            entries, ancestors = stack[-1]
+            try:
+                key, child = next(entries)
+            except StopIteration:
+                stack.pop()
+                continue
+
+            if key not in ancestors:
+                index.setdefault(key, []).append(child)
+
+            if isinstance(child, dict):
+                stack.append((iter(child.items()), ancestors | {key}))
+            elif isinstance(child, list):
+                items = (item.items() for item in child if isinstance(item, dict))
+                stack.append((chain.from_iterable(items), ancestors | {key}))
+
+        return index
+
+    @staticmethod
+    def _iter_paths(prefix: str, value):
+        """
+        Yield the dotted paths _get_conf() can reach below, and including, prefix.
+        """
+        if not isinstance(prefix, str):
+            return
+
+        stack = [(prefix, value)]
+        while stack:
+            path, node = stack.pop()
+            yield path, node
+
+            if isinstance(node, dict):
+                stack.extend((f'{path}.{key}', child) for key, child in node.items()
+                             if isinstance(key, str) and '.' not in key)
+
+
+class KeyedConfigProvider(ConfigProvider, metaclass=KeyedSingleton):
+    """ Configuration provider with one instance per app configuration file """
+
+    @classmethod
+    def singleton_key(cls, *args, **kwargs) -> str:
+        return os.path.abspath(cls.app_conf_path_of(kwargs))
+
+
+class ConfigView():
+    """
+    A fixed set of configuration values, from ConfigProvider.view(). Attributes
+    read through the record of the current settings version.
+    """
+
+    __slots__ = ('_provider', '_plan', '_current')
+
+    def __init__(self, provider: ConfigProvider, plan: tuple):
+        self._provider = provider
+        self._plan = plan
+        self._current = (None, None)
+
+    @property
+    def values(self):
+        """
+        The record for the current settings version; hold on to it to read its fields consistently.
+        """
+        version, record = self._current
+        settings = self._provider.app_conf
+        if version is not settings:
+            record = self._provider._resolve_values(self._plan, settings)
+            self._current = (settings, record)
+
+        return record
+
+    def __getattr__(self, name):
+        return getattr(self.values, name)
+
+
+@lru_cache(maxsize=None)
+def _record_type(fields: tuple) -> type:
+    return namedtuple('ConfigValues', fields, rename=True)
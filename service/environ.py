@@ -0,0 +1,92 @@
+import logging
+import os
+
+from tools.lazy import LazyNode
+from tools.persistent import assoc_in
+
+logger = logging.getLogger(__name__)
+
+
+class Environment():
+    """
+    A snapshot of the process environment, taken on creation and on refresh().
+
+    Variables named <prefix>__<KEY>__<KEY>... override the app configuration
+    path they spell, matched case-insensitively against the existing keys:
+    APP__SERVICE__REDIS__HOST overrides service.redis.host. Their values take
+    the type of the setting they override: integers, floats and booleans (true
+    or false) are cast, everything else, new settings included, stays a string.
+    """
+
+    SEPARATOR = '__'
+
+    def __init__(self, prefix: str = 'APP', environ: dict = None):
+        self.prefix = prefix
+        self.variables = {}
+        self.overrides = ()
+        self.refresh(environ)
+
+    def refresh(self, environ: dict = None):
+        variables = dict(os.environ if environ is None else environ)
+        start = self.prefix + self.SEPARATOR
+        overrides = []
+
+        for name, value in sorted(variables.items()):
+            if name.startswith(start) and len(name) > len(start):
+                overrides.append((tuple(name[len(start):].split(self.SEPARATOR)), value))
+
+        self.variables, self.overrides = variables, tuple(overrides)
+
+    def get(self, name: str, default: any = None):
+        return self.variables.get(name, default)
+
+    def apply(self, app_conf: dict) -> dict:
+        """
+        Return a version of app_conf with the overrides applied.
+        """
+        for segments, value in self.overrides:
+            path, current = self._match(app_conf, segments)
+            try:
+                app_conf = assoc_in(app_conf, path, self._typed(value, current))
+            except (TypeError, ValueError) as e:
+                logger.warning('Ignoring the %s override of %s: %s', self.prefix, '.'.join(path), e)
+
+        return app_conf
+
+    @staticmethod
+    def _match(app_conf: dict, segments: tuple) -> tuple:
+        """
+        The path the segments spell, and the value found there (None if missing).
+        """
+        path = []
+        node = app_conf
+
+        for segment in segments:
+            key = segment.lower()
+            if isinstance(node, dict):
+                key = next((k for k in node if isinstance(k, str) and k.upper() == segment.upper()), key)
+                node = node.get(key)
+                if type(node) is LazyNode:
+                    node = node.resolve()
+            else:
+                node = None
+            path.append(key)
+
+        return path, node
+
+    BOOLEANS = {'true': True, 'false': False}
+    NOT_A_BOOLEAN_ERRMSG = '{!r} is not a boolean, use true or false'
+
+    @classmethod
+    def _typed(cls, value: str, current):
+        if isinstance(current, bool):
+            try:
+                return cls.BOOLEANS[value.strip().lower()]
+            except KeyError:
+                raise ValueError(cls.NOT_A_BOOLEAN_ERRMSG.format(value)) from None
+        elif isinstance(current, int):
+            return int(value)
+        elif isinstance(current, float):
+            return float(value)
+
+        return value
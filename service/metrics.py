@@ -0,0 +1,119 @@
+import logging
+import re
+import threading
+from bisect import bisect_left
+
+
+class MetricsSink():
+    """
+    Receives what ServiceProvider measures, per service name:
+
+    - counters: plan.hit, plan.miss, class_cache.hit, class_cache.miss,
+      instance.hit (singleton and request scoped services already built);
+    - timings, in seconds: construct (a whole build, dependencies included),
+      factory_build (a factory's build()), import (resolving a class or
+      factory) and conf (resolving a %path% argument).
+    """
+
+    def count(self, metric: str, service: str, value: int = 1):
+        raise NotImplementedError()
+
+    def timing(self, metric: str, service: str, seconds: float):
+        raise NotImplementedError()
+
+
+class Histogram():
+    """
+    Count, sum, min and max of timings, and how many fell under each bound.
+    """
+
+    BOUNDS = (1e-5, 1e-4, 1e-3, 1e-2, 1e-1, 1.0, 10.0)
+
+    __slots__ = ('count', 'total', 'min', 'max', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.buckets = [0] * (len(self.BOUNDS) + 1)
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+        self.buckets[bisect_left(self.BOUNDS, seconds)] += 1
+
+    def as_dict(self) -> dict:
+        return {'count': self.count, 'total': self.total, 'min': self.min, 'max': self.max,
+                'mean': self.total / self.count if self.count else None,
+                'buckets': dict(zip(self.BOUNDS + (float('inf'),), self.buckets))}
+
+
+class InMemorySink(MetricsSink):
+    """ Keeps counters and timing histograms, by metric and then by service """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.timings = {}
+
+    def count(self, metric: str, service: str, value: int = 1):
+        with self._lock:
+            counters = self.counters.setdefault(metric, {})
+            counters[service] = counters.get(service, 0) + value
+
+    def timing(self, metric: str, service: str, seconds: float):
+        with self._lock:
+            timings = self.timings.setdefault(metric, {})
+            if service not in timings:
+                timings[service] = Histogram()
+            timings[service].add(seconds)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {'counters': {metric: dict(counters) for metric, counters in self.counters.items()},
+                    'timings': {metric: {service: histogram.as_dict() for service, histogram in timings.items()}
+                                for metric, timings in self.timings.items()}}
+
+    def clear(self):
+        with self._lock:
+            self.counters.clear()
+            self.timings.clear()
+
+
+class LoggingSink(MetricsSink):
+    """ Logs every measure """
+
+    def __init__(self, logger: logging.Logger = None, level: int = logging.DEBUG):
+        self.logger = logger or logging.getLogger(__name__)
+        self.level = level
+
+    def count(self, metric: str, service: str, value: int = 1):
+        self.logger.log(self.level, '%s %s +%d', service, metric, value)
+
+    def timing(self, metric: str, service: str, seconds: float):
+        self.logger.log(self.level, '%s %s %.3f ms', service, metric, seconds * 1000)
+
+
+class StatsdSink(MetricsSink):
+    """
+    Formats measures as StatsD lines (prefix.service.metric:1|c, ...:0.42|ms)
+    and hands each one to write, a socket's send or a file's write for instance.
+    """
+
+    _UNSAFE = re.compile(r'[:|@\s]')
+
+    def __init__(self, write: callable, prefix: str = 'service'):
+        self.write = write
+        self.prefix = prefix
+
+    def count(self, metric: str, service: str, value: int = 1):
+        self.write(f'{self._name(metric, service)}:{value}|c')
+
+    def timing(self, metric: str, service: str, seconds: float):
+        self.write(f'{self._name(metric, service)}:{seconds * 1000:.3f}|ms')
+
+    def _name(self, metric: str, service: str) -> str:
+        return self._UNSAFE.sub('_', f'{self.prefix}.{service}.{metric}')
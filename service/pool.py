@@ -0,0 +1,230 @@
+import threading
+import time
+from collections import deque, namedtuple
+
+
+class PoolError(Exception):
+    pass
+
+
+class PoolTimeoutError(PoolError):
+    pass
+
+
+class PoolClosedError(PoolError):
+    pass
+
+
+PoolMetrics = namedtuple('PoolMetrics', ['size', 'in_use', 'idle', 'waiting', 'leases', 'created', 'destroyed',
+                                         'wait_time', 'max_wait_time'])
+
+
+class Lease():
+    """
+    An instance borrowed from a Pool, given back by release(), on leaving a
+    with block, or when the lease is garbage collected. Attributes not found on
+    the lease are looked up on the instance, so it can stand in for it.
+    """
+
+    def __init__(self, pool: 'Pool', instance):
+        self.pool = pool
+        self.instance = instance
+        self.released = False
+
+    def release(self, discard: bool = False):
+        """
+        Give the instance back, or destroy it with discard (after an error left it unusable).
+        """
+        if not self.released:
+            self.released = True
+            self.pool._release(self.instance, discard)
+
+    def __enter__(self):
+        return self.instance
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+    def __getattr__(self, name: str):
+        try:
+            instance = self.__dict__['instance']
+        except KeyError:
+            raise AttributeError(name)
+        return getattr(instance, name)
+
+    def __del__(self):
+        if not self.__dict__.get('released', True):
+            self.release()
+
+
+class Pool():
+    """
+    A bounded pool of instances built by create().
+
+    min_size instances are built up front and kept; the others are destroyed
+    after idle_timeout seconds unused. Any instance older than max_lifetime
+    seconds, or failing health_check(instance), is destroyed instead of being
+    leased. acquire() waits up to timeout seconds (forever with None) for an
+    instance when max_size are leased. Destroying an instance calls its close()
+    method, when it has one.
+    """
+
+    def __init__(self, create: callable, min_size: int = 0, max_size: int = 10, idle_timeout: float = None,
+                 max_lifetime: float = None, health_check: callable = None, timeout: float = None):
+        if not 0 <= min_size <= max_size or max_size < 1:
+            raise ValueError(f'Can not pool between {min_size} and {max_size} instances.')
+
+        self.create = create
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.health_check = health_check
+        self.timeout = timeout
+        self.closed = False
+
+        # Deleted leases release from __del__, possibly while this thread holds the lock.
+        self._condition = threading.Condition(threading.RLock())
+        self._idle = deque()  # (instance, created, last used), most recently used last.
+        self._created = {}  # id(instance) -> creation time, for every live instance.
+        self._size = 0
+        self._waiting = 0
+        self._leases = self._created_count = self._destroyed = 0
+        self._wait_time = self._max_wait_time = 0.0
+
+        for _ in range(min_size):
+            self._size += 1
+            instance = self._create()
+            self._idle.append((instance, self._created[id(instance)], time.monotonic()))
+
+    def acquire(self, timeout: float = None) -> Lease:
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = None if timeout is None else started + timeout
+
+        with self._condition:
+            while True:
+                if self.closed:
+                    raise PoolClosedError('The pool is closed.')
+
+                self._evict(time.monotonic())
+                instance = self._take_idle()
+                if instance is not None:
+                    break
+
+                if self._size < self.max_size:
+                    # Reserve the slot, then build without holding the lock.
+                    self._size += 1
+                    self._condition.release()
+                    try:
+                        instance = self._create()
+                    finally:
+                        self._condition.acquire()
+                    break
+
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise PoolTimeoutError(f'No instance was released within {timeout} seconds.')
+                self._waiting += 1
+                try:
+                    self._condition.wait(remaining)
+                finally:
+                    self._waiting -= 1
+
+            waited = time.monotonic() - started
+            self._leases += 1
+            self._wait_time += waited
+            self._max_wait_time = max(self._max_wait_time, waited)
+
+        return Lease(self, instance)
+
+    def metrics(self) -> PoolMetrics:
+        with self._condition:
+            return PoolMetrics(size=self._size, in_use=self._size - len(self._idle), idle=len(self._idle),
+                               waiting=self._waiting, leases=self._leases, created=self._created_count,
+                               destroyed=self._destroyed, wait_time=self._wait_time, max_wait_time=self._max_wait_time)
+
+    def close(self):
+        """
+        Destroy the idle instances, and the leased ones as they are released.
+        """
+        with self._condition:
+            self.closed = True
+            idle, self._idle = self._idle, deque()
+            self._condition.notify_all()
+
+        for instance, _, _ in idle:
+            self._destroy(instance)
+
+    def _evict(self, now: float):
+        """
+        Destroy the least recently used idle instances while they are expired or
+        idle for too long, down to min_size: taking idle instances only ever
+        looks at the most recently used one.
+        """
+        while self._idle and self._size > self.min_size:
+            instance, created, last_used = self._idle[0]
+            if not self._expired(created, now) and (self.idle_timeout is None or now - last_used <= self.idle_timeout):
+                break
+            self._idle.popleft()
+            self._destroy(instance)
+
+    def _take_idle(self):
+        now = time.monotonic()
+        while self._idle:
+            instance, created, last_used = self._idle.pop()
+            if self._expired(created, now) or (self.idle_timeout is not None and self._size > self.min_size
+                                                and now - last_used > self.idle_timeout):
+                self._destroy(instance)
+            elif self.health_check is not None and not self._healthy(instance):
+                self._destroy(instance)
+            else:
+                return instance
+
+        return None
+
+    def _release(self, instance, discard: bool):
+        with self._condition:
+            created = self._created.get(id(instance))
+            if discard or self.closed or created is None or self._expired(created, time.monotonic()):
+                self._destroy(instance)
+            else:
+                self._idle.append((instance, created, time.monotonic()))
+                self._evict(time.monotonic())
+            self._condition.notify()
+
+    def _expired(self, created: float, now: float) -> bool:
+        return self.max_lifetime is not None and now - created > self.max_lifetime
+
+    def _healthy(self, instance) -> bool:
+        try:
+            return bool(self.health_check(instance))
+        except Exception:
+            return False
+
+    def _create(self):
+        try:
+            instance = self.create()
+        except BaseException:
+            with self._condition:
+                self._size -= 1
+                self._condition.notify()
+            raise
+
+        with self._condition:
+            self._created[id(instance)] = time.monotonic()
+            self._created_count += 1
+
+        return instance
+
+    def _destroy(self, instance):
+        with self._condition:
+            if self._created.pop(id(instance), None) is None:
+                return
+            self._size -= 1
+            self._destroyed += 1
+            self._condition.notify()
+
+        close = getattr(instance, 'close', None)
+        if callable(close):
+            close()
@@ -1,8 +1,21 @@
+import asyncio
+import gc
+import inspect
 import os
+import threading
+import time
+import weakref
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache, partial
 
 from meta.construction import Singleton
 from meta.ioc import Importer
-from tools.dicttools import dictpath
+from service.environ import Environment
+from service.pool import Pool
+from service.proxy import ServiceProxy
+from tools.lazy import LazyNode, materialize
 
 
 class ServiceProviderError(Exception):
@@ -29,12 +42,167 @@ class BadConfPathError(ServiceProviderError):
     pass
 
 
+class UnknownScopeError(ServiceProviderError):
+    pass
+
+
+class NoRequestScopeError(ServiceProviderError):
+    pass
+
+
+class UnknownReferenceError(UnknownServiceError):
+    pass
+
+
+class AsyncServiceError(ServiceProviderError):
+    pass
+
+
+class BadPoolConfError(ServiceProviderError):
+    pass
+
+
+class ServiceCycleError(ServiceProviderError):
+
+    def __init__(self, message: str, chain: list):
+        super().__init__(message)
+        self.chain = chain
+
+
 class ServiceFactory():
 
     def build(self):
         raise NotImplementedError()
 
 
+class ServiceReference():
+    """
+    The thunk of a "@name" argument, which aget() resolves with aget().
+    """
+
+    __slots__ = ('provider', 'name')
+
+    def __init__(self, provider: 'ServiceProvider', name: str):
+        self.provider = provider
+        self.name = name
+
+    def __call__(self):
+        return self.provider.get(self.name)
+
+
+class ConstructionPlan():
+    """
+    A service definition compiled once: the class or factory to call, and a
+    thunk getting each of its arguments.
+    """
+
+    __slots__ = ('name', 'scope', 'constructor', 'is_factory', 'is_async', 'args', 'kwargs', 'pool')
+
+    ASYNC_SERVICE_ERRMSG = 'The factory of the service "{}" builds it asynchronously, get it with aget().'
+
+    def __init__(self, name: str, scope: str, constructor: type, is_factory: bool, args: tuple, kwargs: tuple,
+                 pool: dict = None):
+        self.name = name
+        self.scope = scope
+        self.constructor = constructor
+        self.is_factory = is_factory
+        self.is_async = is_factory and inspect.iscoroutinefunction(constructor.build)
+        self.args = args
+        self.kwargs = kwargs
+        self.pool = pool  # The Pool options of a pooled service.
+
+    def build(self, inject: dict = None):
+        if self.is_async:
+            raise AsyncServiceError(self.ASYNC_SERVICE_ERRMSG.format(self.name))
+
+        kwargs = {k: thunk() for k, thunk in self.kwargs}
+        if inject:
+            kwargs.update(inject)
+
+        instance = self.constructor(*[thunk() for thunk in self.args], **kwargs)
+        return self._build_factory(instance) if self.is_factory else instance
+
+    def _build_factory(self, factory):
+        return factory.build()
+
+    async def abuild(self, inject: dict = None):
+        """
+        Build the service, getting its "@name" arguments concurrently with aget()
+        and awaiting what its factory returns when it is awaitable.
+        """
+        thunks = self.args + tuple(thunk for _, thunk in self.kwargs)
+        values = [None if type(thunk) is ServiceReference else thunk() for thunk in thunks]
+
+        services = [i for i, thunk in enumerate(thunks) if type(thunk) is ServiceReference]
+        if services:
+            instances = await asyncio.gather(*(thunks[i].provider.aget(thunks[i].name) for i in services))
+            for i, instance in zip(services, instances):
+                values[i] = instance
+
+        kwargs = dict(zip((k for k, _ in self.kwargs), values[len(self.args):]))
+        if inject:
+            kwargs.update(inject)
+
+        instance = self.constructor(*values[:len(self.args)], **kwargs)
+        return await self._abuild_factory(instance) if self.is_factory else instance
+
+    async def _abuild_factory(self, factory):
+        instance = factory.build()
+        return await instance if inspect.isawaitable(instance) else instance
+
+
+class MeasuredConstructionPlan(ConstructionPlan):
+    """
+    A ConstructionPlan reporting its construct and factory_build timings to a MetricsSink.
+    """
+
+    __slots__ = ('metrics',)
+
+    def __init__(self, metrics, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = metrics
+
+    def build(self, inject: dict = None):
+        started = time.perf_counter()
+        try:
+            return super().build(inject)
+        finally:
+            self.metrics.timing('construct', self.name, time.perf_counter() - started)
+
+    def _build_factory(self, factory):
+        started = time.perf_counter()
+        try:
+            return factory.build()
+        finally:
+            self.metrics.timing('factory_build', self.name, time.perf_counter() - started)
+
+    async def abuild(self, inject: dict = None):
+        started = time.perf_counter()
+        try:
+            return await super().abuild(inject)
+        finally:
+            self.metrics.timing('construct', self.name, time.perf_counter() - started)
+
+    async def _abuild_factory(self, factory):
+        started = time.perf_counter()
+        try:
+            return await super()._abuild_factory(factory)
+        finally:
+            self.metrics.timing('factory_build', self.name, time.perf_counter() - started)
+
+
+_providers = weakref.WeakSet()  # Every live provider, reset in forked children.
+
+
+def _after_fork():
+    for provider in list(_providers):
+        provider.after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
 class ServiceProvider(metaclass=Singleton):
 
     UNKNOWN_SERVICE_ERRMSG = '"{}" is not a service we know of.'
@@ -42,6 +210,21 @@ class ServiceProvider(metaclass=Singleton):
     NO_CREATION_METHOD_ERRMSG = 'You must define either a class or a factory for the service "{}", none was found.'
     NOT_A_SERVICE_FACTORY_ERRMSG = 'The factory class for the service "{}" does not have a "build" method.'
     BAD_CONF_PATH_ERRMSG = 'The path "{}" was not found in the app configuration.'
+    UNKNOWN_SCOPE_ERRMSG = 'The service "{}" has an unknown scope "{}".'
+    NO_REQUEST_SCOPE_ERRMSG = 'The service "{}" is request scoped, but no request scope is active.'
+    UNKNOWN_REFERENCE_ERRMSG = 'The service "{}" references "{}", which is not a service we know of.'
+    SERVICE_CYCLE_ERRMSG = 'The services depend on each other: {}.'
+    BAD_POOL_CONF_ERRMSG = 'The pool of the service "{}" has unknown options: {}.'
+    ASYNC_POOL_ERRMSG = 'The factory of the service "{}" builds it asynchronously, which pools do not support.'
+
+    POOL_OPTIONS = ('min_size', 'max_size', 'idle_timeout', 'max_lifetime', 'health_check', 'timeout')
+
+    SINGLETON, TRANSIENT, REQUEST = 'singleton', 'transient', 'request'
+    DEFAULT_SCOPE = TRANSIENT
+
+    CONF_PATH_CACHE_SIZE = 1024
+
+    _MISSING = object()
 
     def __init__(self, *args, **kwargs):
         self.importer = Importer()  # Can't inject it, obviously.
@@ -49,84 +232,609 @@ class ServiceProvider(metaclass=Singleton):
         self.app_conf = {}
         self.service_classes = {}
         self.factory_classes = {}
+        self.lazy_conf = False  # Whether app_conf may hold LazyNode placeholders.
+        self._resolved_conf = (None, {})  # With lazy_conf: an app_conf version and the paths resolved in it.
+        self.environment = Environment(kwargs.get('env_prefix') or os.environ.get('APP_ENV_PREFIX', 'APP'))
+        self.service_plans = {}
+        self.dependencies = {}
+        self._compile_conf_path = lru_cache(maxsize=self.CONF_PATH_CACHE_SIZE)(self._split_conf_path)
+        self._singletons = {}
+        self._request_instances = ContextVar(f'{type(self).__name__}.request_instances', default=None)
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        self._in_flight = {}
+        self.pools = {}
+        self.metrics = kwargs.get('metrics')  # A MetricsSink, or None to measure nothing.
+
+        _providers.add(self)
 
     def conf(self, service_conf: dict, app_conf: dict = None):
         if app_conf is None:
             app_conf = {}
 
+        self._publish(service_conf, self._dependency_graph(service_conf), app_conf)
+
+    def _publish(self, service_conf: dict, dependencies: dict, app_conf: dict):
+        """
+        Swap in a configuration that was validated and built beforehand.
+        """
         self.service_conf = service_conf
+        self.dependencies = dependencies
         self.app_conf = app_conf
+        self.service_plans = {}
+        self._compile_conf_path.cache_clear()
+
+    def on_reset(self):
+        """
+        Called by Singleton.reset(): close the pools and drop the cached services.
+        """
+        self.invalidate()
+
+    def set_metrics(self, sink):
+        """
+        Report to the given MetricsSink from now on, or stop measuring with None.
+        """
+        self.metrics = sink
+        self.service_plans = {}
+        # Pools build with the plan they were created from.
+        self._close_pools(list(self.pools))
+
+    def prefork(self, freeze_gc: bool = True):
+        """
+        Get ready, in the parent process, to fork workers: compile the plan of
+        every service (importing their classes) without building any, so the
+        children share them copy-on-write. With freeze_gc, what survives a
+        collection is moved to gc's permanent generation, so collections in the
+        children do not touch (and copy) the pages holding it.
+        """
+        for name in self.service_conf:
+            if name not in self.service_plans:
+                self._plan(name)
+
+        if freeze_gc:
+            gc.collect()
+            gc.freeze()
+
+    def after_fork(self):
+        """
+        Called in a forked child: forget the singletons, pools and locks
+        inherited from the parent, so services are built again, on first use,
+        with connections of their own. The inherited instances are not closed:
+        their connections still belong to the parent.
+        """
+        self._singletons = {}
+        self.pools = {}
+        self._in_flight = {}
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    def refresh_env(self) -> set:
+        """
+        Take a new snapshot of the environment variables $ references read, and
+        forget the services reading one that changed, returning their names.
+        """
+        variables = self.environment.variables
+        self.environment.refresh()
+
+        services = self.changed_services(self.service_conf, self.app_conf, variables)
+        self.invalidate(services)
+        return services
+
+    def invalidate(self, names: set = None):
+        """
+        Forget what was cached for the given services, or for all of them.
+        """
+        if names is None:
+            self.service_classes.clear()
+            self.factory_classes.clear()
+            self.service_plans.clear()
+            self._singletons.clear()
+            self._close_pools(list(self.pools))
+            return
+
+        for name in names:
+            self.service_classes.pop(name, None)
+            self.factory_classes.pop(name, None)
+            self.service_plans.pop(name, None)
+            self._singletons.pop(name, None)
+        self._close_pools(names)
+
+    def _close_pools(self, names):
+        for name in names:
+            pool = self.pools.pop(name, None)
+            if pool is not None:
+                pool.close()
+
+    def pool_metrics(self) -> dict:
+        """
+        The PoolMetrics of every pooled service built so far.
+        """
+        return {name: pool.metrics() for name, pool in list(self.pools.items())}
+
+    def _dependency_graph(self, service_conf: dict) -> dict:
+        """
+        Map every service to the services its arguments reference, raising on
+        unknown references and on cycles.
+        """
+        graph = {}
+        for name, definition in service_conf.items():
+            dependencies = []
+            for dependency, lazy in self._service_references(definition):
+                if dependency not in service_conf:
+                    raise UnknownReferenceError(self.UNKNOWN_REFERENCE_ERRMSG.format(name, dependency))
+                elif not lazy and dependency not in dependencies:
+                    # Lazy references are only built on first use: they can not close a cycle.
+                    dependencies.append(dependency)
+            graph[name] = tuple(dependencies)
+
+        done = set()
+        for root in graph:
+            if root in done:
+                continue
+
+            chain, stack = [root], [iter(graph[root])]
+            while stack:
+                dependency = next(stack[-1], None)
+                if dependency is None:
+                    done.add(chain.pop())
+                    stack.pop()
+                elif dependency in chain:
+                    cycle = chain[chain.index(dependency):] + [dependency]
+                    raise ServiceCycleError(self.SERVICE_CYCLE_ERRMSG.format(' -> '.join(cycle)), cycle)
+                elif dependency not in done:
+                    chain.append(dependency)
+                    stack.append(iter(graph[dependency]))
+
+        return graph
+
+    def warm_up(self, max_workers: int = None) -> list:
+        """
+        Import every service class at once, then compile the plan of every
+        service, build the singletons and fill the pools, in topological order:
+        a service is only started once its dependencies are done, and
+        independent branches run in parallel on a thread pool. Singletons
+        needing an async factory are left for aget().
+
+        Return the names of the services, in the order they were done.
+        """
+        self.importer.preload([definition[key] for definition in self.service_conf.values() if definition
+                               for key in ('class', 'factory') if key in definition], max_workers)
+
+        dependents = {}
+        waiting = {}
+        for name, dependencies in self.dependencies.items():
+            waiting[name] = len(dependencies)
+            for dependency in dependencies:
+                dependents.setdefault(dependency, []).append(name)
+
+        done = []
+        asynchronous = set()
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='warm-up') as executor:
+            running = {executor.submit(self._warm_up, name, asynchronous): name
+                       for name, count in waiting.items() if not count}
+            while running:
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    if future.result():
+                        asynchronous.add(name)
+                    done.append(name)
+                    for dependent in dependents.get(name, ()):
+                        waiting[dependent] -= 1
+                        if not waiting[dependent]:
+                            running[executor.submit(self._warm_up, dependent, asynchronous)] = dependent
+
+        return done
+
+    def _warm_up(self, name: str, asynchronous: set) -> bool:
+        """
+        Warm a service up, returning whether building it needs aget().
+        """
+        plan = self.service_plans.get(name) or self._plan(name)
+        if plan.is_async or any(dependency in asynchronous for dependency in self.dependencies[name]):
+            return True
+        elif plan.pool is not None:
+            self._pool(plan)
+        elif plan.scope == self.SINGLETON:
+            self.get(name)
+
+        return False
+
+    def begin_request(self):
+        """
+        Open a request scope in the current context, returning the token end_request() takes.
+
+        The scope follows the context: threads and coroutines started from it
+        (with a copy of it) share its request scoped instances.
+        """
+        return self._request_instances.set({})
+
+    def end_request(self, token):
+        self._request_instances.reset(token)
+
+    @contextmanager
+    def request_scope(self):
+        token = self.begin_request()
+        try:
+            yield
+        finally:
+            self.end_request(token)
+
+    def changed_services(self, service_conf: dict, app_conf: dict, variables: dict = None) -> set:
+        """
+        Names of the services whose definition, referenced configuration or
+        dependencies differ between the given configuration and the current one,
+        and, given the variables of another environment snapshot, those whose
+        referenced environment variables differ from the current ones.
+        """
+        missing = self._MISSING
+        changed = set()
+        dependents = {}
+
+        for name in set(service_conf) | set(self.service_conf):
+            definition = self.service_conf.get(name)
+            if definition != service_conf.get(name):
+                changed.add(name)
+                continue
+
+            for ref in self._references(definition):
+                if ref[0] == '@':
+                    dependents.setdefault(ref[1:].lstrip('?'), set()).add(name)
+                elif '%' == ref[0] == ref[-1:] and self._conf_or_none(ref[1:-1]) != self._conf_or_none(ref[1:-1], app_conf):
+                    changed.add(name)
+                elif '$' == ref[0] and variables is not None:
+                    var = ref[1:-1] if len(ref) > 1 and '$' == ref[-1] else ref[1:]
+                    if variables.get(var, missing) != self.environment.get(var, missing):
+                        changed.add(name)
+
+        pending = list(changed)
+        while pending:
+            for name in dependents.get(pending.pop(), ()):
+                if name not in changed:
+                    changed.add(name)
+                    pending.append(name)
+
+        return changed
 
     def get(self, name: str, inject: dict = None):
-        if name not in self.service_conf:
-            raise UnknownServiceError(self.UNKNOWN_SERVICE_ERRMSG.format(name))
-        elif self.service_conf[name] and all(k in self.service_conf[name] for k in ('class', 'factory')):
-            raise TooManyCreationMethodsError(self.TOO_MANY_CREATION_METHODS_ERRMSG.format(name))
+        """
+        Get the service, built according to its scope: "transient" (the default)
+        builds one on every call, "singleton" once, and "request" once per request
+        scope. Injected arguments always get a new, uncached instance.
+
+        Services with a pool: section are leased from their pool instead: the
+        Lease stands in for the instance and gives it back on release(), at the
+        end of a with block, or once garbage collected. A lease injected into
+        another service as an "@name" argument is held for as long as that
+        service is alive; reference pooled services with "@?name" to lease
+        them on first use instead.
+        """
+        try:
+            plan = self.service_plans[name]
+        except KeyError:
+            plan = self._plan(name)
+        else:
+            if self.metrics is not None:
+                self.metrics.count('plan.hit', name)
+
+        if plan.pool is not None and not inject:
+            return self._pool(plan).acquire()
+        elif inject or plan.scope == self.TRANSIENT:
+            return plan.build(inject)
+        elif plan.scope == self.SINGLETON:
+            instances = self._singletons
+        else:
+            instances = self._request_instances.get()
+            if instances is None:
+                raise NoRequestScopeError(self.NO_REQUEST_SCOPE_ERRMSG.format(name))
 
-        if self.service_conf[name] and 'class' in self.service_conf[name]:
-            return self._instance_service_with_class(name, inject or {})
-        elif self.service_conf[name] and 'factory' in self.service_conf[name]:
-            return self._instance_service_with_factory(name, inject or {})
+        try:
+            instance = instances[name]
+        except KeyError:
+            pass
         else:
-            raise NoCreationMethodError(self.NO_CREATION_METHOD_ERRMSG.format(name))
+            if self.metrics is not None:
+                self.metrics.count('instance.hit', name)
+            return instance
+
+        with self._lock(name):
+            # Another thread may have built it while we were waiting.
+            try:
+                return instances[name]
+            except KeyError:
+                instance = instances[name] = plan.build()
+                return instance
+
+    async def aget(self, name: str, inject: dict = None):
+        """
+        Get the service like get() does, without blocking the event loop on
+        factories whose build() is a coroutine. Concurrent calls for a service
+        that is not built yet share a single construction per event loop. Leases
+        are waited for on the default executor.
+        """
+        try:
+            plan = self.service_plans[name]
+        except KeyError:
+            plan = self._plan(name)
+        else:
+            if self.metrics is not None:
+                self.metrics.count('plan.hit', name)
+
+        if plan.pool is not None and not inject:
+            loop = asyncio.get_running_loop()
+            pool = self.pools.get(name)
+            if pool is None:
+                # Creating a pool builds its min_size instances.
+                pool = await loop.run_in_executor(None, self._pool, plan)
+            return await loop.run_in_executor(None, pool.acquire)
+        elif inject or plan.scope == self.TRANSIENT:
+            return await plan.abuild(inject)
+        elif plan.scope == self.SINGLETON:
+            instances = self._singletons
+        else:
+            instances = self._request_instances.get()
+            if instances is None:
+                raise NoRequestScopeError(self.NO_REQUEST_SCOPE_ERRMSG.format(name))
 
-    def _instance_service_with_class(self, name: str, inject: dict):
-        if name not in self.service_classes:
-            self.service_classes[name] = self.importer.get_class(self.service_conf[name]['class'])
+        try:
+            instance = instances[name]
+        except KeyError:
+            pass
+        else:
+            if self.metrics is not None:
+                self.metrics.count('instance.hit', name)
+            return instance
+
+        # Tasks can only be awaited on the loop running them.
+        key = (id(instances), name, asyncio.get_running_loop())
+        task = self._in_flight.get(key)
+        if task is None:
+            task = self._in_flight[key] = asyncio.ensure_future(self._abuild_scoped(plan, instances, key))
+
+        # A cancelled caller must not cancel the construction the others wait for.
+        return await asyncio.shield(task)
+
+    async def _abuild_scoped(self, plan: ConstructionPlan, instances: dict, key: tuple):
+        try:
+            instance = await plan.abuild()
+            # A thread may have built it with get() meanwhile: keep the first one.
+            return instances.setdefault(plan.name, instance)
+        finally:
+            self._in_flight.pop(key, None)
 
-        kwargs = self._get_kw_args(name)
-        kwargs.update(inject)
-        return self.service_classes[name](*self._get_args(name), **kwargs)
+    def _pool(self, plan: ConstructionPlan) -> Pool:
+        try:
+            return self.pools[plan.name]
+        except KeyError:
+            pass
+
+        with self._lock(plan.name):
+            if plan.name not in self.pools:
+                self.pools[plan.name] = Pool(plan.build, **plan.pool)
+            return self.pools[plan.name]
+
+    def _lock(self, name: str) -> threading.RLock:
+        try:
+            return self._locks[name]
+        except KeyError:
+            with self._locks_lock:
+                return self._locks.setdefault(name, threading.RLock())
+
+    def _plan(self, name: str) -> ConstructionPlan:
+        """
+        Validate a service definition and compile it into its construction plan.
+        """
+        if name not in self.service_conf:
+            raise UnknownServiceError(self.UNKNOWN_SERVICE_ERRMSG.format(name))
 
-    def _instance_service_with_factory(self, name: str):
-        if name not in self.factory_classes:
-            factory_class = self.importer.get_class(self.service_conf[name]['factory'])
+        definition = self.service_conf[name] or {}
+        if all(k in definition for k in ('class', 'factory')):
+            raise TooManyCreationMethodsError(self.TOO_MANY_CREATION_METHODS_ERRMSG.format(name))
 
-            if not hasattr(factory_class, 'build') or not callable(factory_class.build):
-                raise NotAServiceFactoryError(self.NOT_A_SERVICE_FACTORY_ERRMSG.format(name))
+        scope = definition.get('scope', self.DEFAULT_SCOPE)
+        if scope not in (self.SINGLETON, self.TRANSIENT, self.REQUEST):
+            raise UnknownScopeError(self.UNKNOWN_SCOPE_ERRMSG.format(name, scope))
 
-            self.factory_classes[name] = factory_class
+        if 'class' not in definition and 'factory' not in definition:
+            raise NoCreationMethodError(self.NO_CREATION_METHOD_ERRMSG.format(name))
 
-        return self.factory_classes[name](*self._get_args(name), **self._get_kw_args(name)).build()
+        classes = self.service_classes if 'class' in definition else self.factory_classes
+        if self.metrics is not None:
+            self.metrics.count('plan.miss', name)
+            self.metrics.count('class_cache.hit' if name in classes else 'class_cache.miss', name)
 
-    def _get_args(self, name: str):
-        if 'arguments' in self.service_conf[name]:
-            return [self._get_arg(ref) for ref in self.service_conf[name]['arguments']]
+        if 'class' in definition:
+            if name not in self.service_classes:
+                self.service_classes[name] = self._import(name, definition['class'])
+            constructor = self.service_classes[name]
+        else:
+            if name not in self.factory_classes:
+                factory_class = self._import(name, definition['factory'])
+
+                if not hasattr(factory_class, 'build') or not callable(factory_class.build):
+                    raise NotAServiceFactoryError(self.NOT_A_SERVICE_FACTORY_ERRMSG.format(name))
+
+                self.factory_classes[name] = factory_class
+            constructor = self.factory_classes[name]
+
+        pool = definition.get('pool')
+        if pool is not None:
+            pool = dict(pool or {})
+            unknown = [option for option in pool if option not in self.POOL_OPTIONS]
+            if unknown:
+                raise BadPoolConfError(self.BAD_POOL_CONF_ERRMSG.format(name, ', '.join(unknown)))
+            if isinstance(pool.get('health_check'), str):
+                pool['health_check'] = self.importer.get_class(pool['health_check'])
+            if 'factory' in definition and inspect.iscoroutinefunction(constructor.build):
+                # Pools build and lease from threads.
+                raise BadPoolConfError(self.ASYNC_POOL_ERRMSG.format(name))
+
+        plan_args = (name, scope, constructor, 'factory' in definition,
+                     tuple(self._compile_arg(ref, name) for ref in definition.get('arguments') or ()),
+                     tuple((k, self._compile_arg(v, name)) for k, v in (definition.get('kwarguments') or {}).items()),
+                     pool)
+        if self.metrics is None:
+            plan = ConstructionPlan(*plan_args)
         else:
-            return []
+            plan = MeasuredConstructionPlan(self.metrics, *plan_args)
+        self.service_plans[name] = plan
 
-    def _get_kw_args(self, name: str):
-        if 'kwarguments' in self.service_conf[name]:
-            return {k: self._get_arg(v) for k, v in self.service_conf[name]['kwarguments'].items()}
-        return {}
+        return plan
+
+    def _import(self, name: str, class_path: str) -> type:
+        if self.metrics is None:
+            return self.importer.get_class(class_path)
+
+        started = time.perf_counter()
+        try:
+            return self.importer.get_class(class_path)
+        finally:
+            self.metrics.timing('import', name, time.perf_counter() - started)
 
     def _get_arg(self, ref: any):
-        if isinstance(ref, str):
-            if '@' == ref[0]:
-                return self.get(ref[1:])
+        return self._compile_arg(ref)()
+
+    def _compile_arg(self, ref: any, service: str = None) -> callable:
+        """
+        Compile a reference into a thunk returning its value.
+
+        "@name" is a service, "@?name" a ServiceProxy building it on first use,
+        "%path%" an app configuration path, "$VAR" (or "$VAR$") and
+        ["$VAR", default] environment variables; anything else is a literal.
+        """
+        if isinstance(ref, str) and ref:
+            if '@?' == ref[:2]:
+                return partial(ServiceProxy, self, ref[2:])
+            elif '@' == ref[0]:
+                return ServiceReference(self, ref[1:])
             elif '%' == ref[0] == ref[-1:]:
-                return self._get_conf(ref[1:-1])
+                thunk = partial(self._walk_conf, *self._compile_conf_path(ref[1:-1]))
+                return thunk if self.metrics is None or service is None else self._measured(thunk, service)
             elif '$' == ref[0]:
-                return self._get_env(ref[1:-1])
-        elif isinstance(ref, list):
-            if '$' == ref[0][0]:
-                return self._get_env(ref[0][1:], ref[1])
-
-        return ref  # Literal
-
-    def _get_conf(self, path: str):
-        parts = path.split('.')
+                return self._compile_env(ref[1:-1] if len(ref) > 1 and '$' == ref[-1] else ref[1:], None, service)
+        elif isinstance(ref, list) and ref and isinstance(ref[0], str) and '$' == ref[0][:1]:
+            return self._compile_env(ref[0][1:], ref[1] if len(ref) > 1 else None, service)
+
+        return lambda: ref
+
+    def _measured(self, thunk: callable, service: str) -> callable:
+        metrics = self.metrics
+
+        def measured():
+            started = time.perf_counter()
+            try:
+                return thunk()
+            finally:
+                metrics.timing('conf', service, time.perf_counter() - started)
+
+        return measured
+
+    def _compile_env(self, var: str, default: any, service: str = None) -> callable:
+        # The default is only resolved when the variable is missing.
+        default = self._compile_arg(default, service)
+        missing = self._MISSING
+
+        def env():
+            value = self.environment.get(var, missing)
+            return default() if value is missing else value
+
+        return env
+
+    @classmethod
+    def _references(cls, definition):
+        """
+        Yield every reference string found in a service definition's arguments.
+        """
+        if not isinstance(definition, dict):
+            return
+
+        pending = [definition.get('arguments'), definition.get('kwarguments')]
+        while pending:
+            value = pending.pop()
+            if isinstance(value, str) and value[:1] in ('@', '%', '$'):
+                yield value
+            elif isinstance(value, list):
+                pending.extend(value)
+            elif isinstance(value, dict):
+                pending.extend(value.values())
+
+    @staticmethod
+    def _service_references(definition):
+        """
+        Yield the (name, lazy) of the services a definition's arguments reference, as get() resolves them.
+        """
+        if not isinstance(definition, dict):
+            return
+
+        pending = list(definition.get('arguments') or ()) + list((definition.get('kwarguments') or {}).values())
+        pending.reverse()
+        while pending:
+            ref = pending.pop()
+            if isinstance(ref, str) and '@' == ref[:1]:
+                yield (ref[2:], True) if '?' == ref[1:2] else (ref[1:], False)
+            elif isinstance(ref, list) and len(ref) > 1 and isinstance(ref[0], str) and '$' == ref[0][:1]:
+                pending.append(ref[1])
+
+    def _conf_or_none(self, path: str, app_conf: dict = None):
         try:
-            trunk = self.app_conf[parts[0]]
-        except KeyError as e:
-            raise BadConfPathError(self.BAD_CONF_PATH_ERRMSG.format(parts[0]))
+            return self._get_conf(path, app_conf)
+        except BadConfPathError:
+            return None
+
+    def _get_conf(self, path: str, app_conf: dict = None):
+        return self._walk_conf(*self._compile_conf_path(path), app_conf)
+
+    def _walk_conf(self, trunk: str, branches: tuple, app_conf: dict = None):
+        conf = self.app_conf if app_conf is None else app_conf
+        if self.lazy_conf and conf is self.app_conf:
+            # Built subtrees are only walked once per version of the settings.
+            version, resolved = self._resolved_conf
+            if version is not conf:
+                resolved = {}
+                self._resolved_conf = conf, resolved
+            try:
+                return resolved[trunk, branches]
+            except KeyError:
+                pass
+        else:
+            resolved = None
 
         try:
-            return dictpath(trunk, parts[1:])
+            node = conf[trunk]
         except KeyError as e:
-            raise BadConfPathError(self.BAD_CONF_PATH_ERRMSG.format(e.args[0]))
+            raise BadConfPathError(self.BAD_CONF_PATH_ERRMSG.format(trunk))
+        if type(node) is LazyNode:
+            node = node.resolve()
+            dict.__setitem__(conf, trunk, node)
+
+        for branch in branches:
+            if not isinstance(node, dict):
+                break
+            try:
+                child = node[branch]
+            except KeyError as e:
+                raise BadConfPathError(self.BAD_CONF_PATH_ERRMSG.format(branch))
+            if type(child) is LazyNode:
+                child = child.resolve()
+                dict.__setitem__(node, branch, child)
+            node = child
+
+        if self.lazy_conf and type(node) in (dict, list):
+            materialize(node)
+        if resolved is not None:
+            resolved[trunk, branches] = node
+
+        return node
+
+    @staticmethod
+    def _split_conf_path(path: str) -> tuple:
+        """
+        Compile a dotted path into its (trunk, branches) accessor, parsed once per path.
+        """
+        parts = path.split('.')
+        return parts[0], tuple(parts[1:])
 
     def _get_env(self, var: str, default: any = None):
         default = self._get_arg(default)
 
-        return os.environ.get(var, default)
+        return self.environment.get(var, default)
@@ -0,0 +1,84 @@
+import threading
+
+
+class ServiceProxy():
+    """
+    Stands in for the service an "@?name" argument references, getting it from
+    the provider on first use: attribute access, calls, with blocks, and the
+    usual container and comparison operators all go to the service.
+    """
+
+    __slots__ = ('_provider', '_name', '_instance', '_lock')
+
+    _UNRESOLVED = object()
+
+    def __init__(self, provider, name: str):
+        object.__setattr__(self, '_provider', provider)
+        object.__setattr__(self, '_name', name)
+        object.__setattr__(self, '_instance', self._UNRESOLVED)
+        object.__setattr__(self, '_lock', threading.Lock())
+
+    def _resolve(self):
+        instance = self._instance
+        if instance is self._UNRESOLVED:
+            with self._lock:
+                instance = self._instance
+                if instance is self._UNRESOLVED:
+                    instance = self._provider.get(self._name)
+                    object.__setattr__(self, '_instance', instance)
+
+        return instance
+
+    def __getattr__(self, name: str):
+        return getattr(self._resolve(), name)
+
+    def __setattr__(self, name: str, value):
+        setattr(self._resolve(), name, value)
+
+    def __delattr__(self, name: str):
+        delattr(self._resolve(), name)
+
+    def __repr__(self):
+        if self._instance is self._UNRESOLVED:
+            return f'<ServiceProxy "{self._name}" (not built yet)>'
+        return repr(self._instance)
+
+    def __call__(self, *args, **kwargs):
+        return self._resolve()(*args, **kwargs)
+
+    def __enter__(self):
+        return self._resolve().__enter__()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return self._resolve().__exit__(exc_type, exc_value, traceback)
+
+    def __bool__(self):
+        return bool(self._resolve())
+
+    def __len__(self):
+        return len(self._resolve())
+
+    def __iter__(self):
+        return iter(self._resolve())
+
+    def __contains__(self, item):
+        return item in self._resolve()
+
+    def __getitem__(self, key):
+        return self._resolve()[key]
+
+    def __setitem__(self, key, value):
+        self._resolve()[key] = value
+
+    def __eq__(self, other):
+        return self._resolve() == other
+
+    def __hash__(self):
+        return hash(self._resolve())
+
+
+def is_resolved(proxy: ServiceProxy) -> bool:
+    """
+    Whether the proxy already built its service.
+    """
+    return proxy._instance is not ServiceProxy._UNRESOLVED
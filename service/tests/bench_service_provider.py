@@ -0,0 +1,87 @@
+"""
+Latency of ServiceProvider.get() for the services of configs/service_conf.yaml,
+built from stand-in classes, against interpreting their definitions on every
+call as get() used to. The scoped column keeps their scope and pool sections.
+
+    python -m service.tests.bench_service_provider [calls]
+"""
+import os
+import sys
+import timeit
+
+from meta.construction import Singleton
+from service.provider import ServiceProvider
+from service.proxy import ServiceProxy
+from util.loader import load_file
+
+SERVICE_CONF_PATH = os.path.join(os.path.dirname(__file__), '..', '..', 'configs', 'service_conf.yaml')
+
+APP_CONF = {'service': {'mysql': {'config': {'read': {'host': 'db-read'}, 'write': {'host': 'db-write'},
+                                             'port': 3306, 'database': 'app', 'charset': 'utf8',
+                                             'user': 'app', 'passwd': 'secret'}},
+                        'redis': {'port': 6379, 'host': 'localhost', 'protocol': 'redis',
+                                  'REDIS_DB_NOTIFY': 1, 'REDIS_DB_OFFERINGS': 2, 'REDIS_DB_CONTENT': 3,
+                                  'REDIS_DB_PUBLISHING': 4, 'REDIS_DB_OFFERINGS_EXPIRE': 60,
+                                  'REDIS_DB_CONTENT_EXPIRE': 60, 'REDIS_DB_WHITELIST_EXPIRE': 60}}}
+
+
+class StandIn():
+
+    def __init__(self, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+
+
+def service_conf(scoped: bool) -> dict:
+    conf, _ = load_file(SERVICE_CONF_PATH)
+    for definition in conf.values():
+        definition['class'] = f'{__name__}.StandIn'
+        if not scoped:
+            definition.pop('scope', None)
+            definition.pop('pool', None)
+    return conf
+
+
+def interpret(provider: ServiceProvider, name: str):
+    """
+    Build a service the way get() did before construction plans.
+    """
+    definition = provider.service_conf[name]
+    cls = provider.importer.get_class(definition['class'])
+
+    def arg(ref):
+        if isinstance(ref, str) and ref[:2] == '@?':
+            return ServiceProxy(provider, ref[2:])
+        elif isinstance(ref, str) and ref[:1] == '@':
+            return interpret(provider, ref[1:])
+        elif isinstance(ref, str) and '%' == ref[:1] == ref[-1:]:
+            return provider._get_conf(ref[1:-1])
+        return ref
+
+    return cls(*[arg(ref) for ref in definition.get('arguments', ())],
+               **{k: arg(v) for k, v in definition.get('kwarguments', {}).items()})
+
+
+def main(argv: list):
+    calls = int(argv[0]) if argv else 20000
+    Singleton._instances.pop(ServiceProvider, None)
+    provider = ServiceProvider()
+
+    print(f'{calls} calls, microseconds per call')
+    print(f"{'service':<24}{'interpreted':>12}{'planned':>12}{'scoped':>12}")
+    for name in service_conf(False):
+        timings = []
+        for scoped, run in ((False, lambda: interpret(provider, name)),
+                            (False, lambda: provider.get(name)),
+                            (True, lambda: provider.get(name))):
+            provider.conf(service_conf(scoped), APP_CONF)
+            provider.invalidate()
+            run()
+            timings.append(timeit.timeit(run, number=calls) / calls * 1e6)
+        print(f'{name:<24}' + ''.join(f'{timing:>12.2f}' for timing in timings))
+
+    Singleton._instances.pop(ServiceProvider, None)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,68 @@
+import logging
+import unittest
+
+from service.metrics import Histogram, InMemorySink, LoggingSink, StatsdSink
+
+
+class InMemorySinkTest(unittest.TestCase):
+
+    maxDiff = None
+
+    def test_counters_and_timings(self):
+        # Given...
+        sink = InMemorySink()
+        # When...
+        sink.count('plan.hit', 'service.db')
+        sink.count('plan.hit', 'service.db', 2)
+        sink.timing('construct', 'service.db', 0.002)
+        sink.timing('construct', 'service.db', 0.004)
+        snapshot = sink.snapshot()
+        # Then...
+        self.assertEqual({'plan.hit': {'service.db': 3}}, snapshot['counters'])
+        timing = snapshot['timings']['construct']['service.db']
+        self.assertEqual(2, timing['count'])
+        self.assertAlmostEqual(0.003, timing['mean'])
+        self.assertEqual((0.002, 0.004), (timing['min'], timing['max']))
+        self.assertEqual(2, timing['buckets'][1e-2])
+        sink.clear()
+        self.assertEqual({'counters': {}, 'timings': {}}, sink.snapshot())
+
+    def test_histogram_buckets(self):
+        # Given...
+        histogram = Histogram()
+        # When...
+        for seconds in (0.000001, 0.0005, 0.0005, 20):
+            histogram.add(seconds)
+        # Then...
+        self.assertEqual([1, 0, 2, 0, 0, 0, 0, 1], histogram.buckets)
+
+
+class LoggingSinkTest(unittest.TestCase):
+
+    def test_log_lines(self):
+        # Given...
+        sink = LoggingSink(logging.getLogger('metrics'), logging.INFO)
+        # When...
+        with self.assertLogs('metrics', 'INFO') as logs:
+            sink.count('instance.hit', 'service.db')
+            sink.timing('construct', 'service.db', 0.0015)
+        # Then...
+        self.assertEqual(['INFO:metrics:service.db instance.hit +1', 'INFO:metrics:service.db construct 1.500 ms'],
+                         logs.output)
+
+
+class StatsdSinkTest(unittest.TestCase):
+
+    def test_statsd_lines(self):
+        # Given...
+        lines = []
+        sink = StatsdSink(lines.append, prefix='app')
+        # When...
+        sink.count('class_cache.miss', 'service.mysql.read')
+        sink.timing('conf', 'odd name:1', 0.00025)
+        # Then...
+        self.assertEqual(['app.service.mysql.read.class_cache.miss:1|c', 'app.odd_name_1.conf:0.250|ms'], lines)
+
+
+if __name__ == '__main__':
+    unittest.main()
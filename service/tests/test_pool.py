@@ -0,0 +1,179 @@
+import threading
+import time
+import unittest
+
+from service.pool import Pool, PoolClosedError, PoolTimeoutError
+
+
+class FakeConnection():
+    """ An in-process stand-in for a database client """
+    opened = 0
+
+    def __init__(self):
+        FakeConnection.opened += 1
+        self.number = FakeConnection.opened
+        self.alive = True
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class PoolTest(unittest.TestCase):
+
+    maxDiff = None
+
+    def setUp(self):
+        FakeConnection.opened = 0
+
+    def test_leases_are_reused(self):
+        # Given...
+        pool = Pool(FakeConnection, max_size=2)
+        # When...
+        with pool.acquire() as first:
+            pass
+        with pool.acquire() as second:
+            in_use = pool.metrics().in_use
+        # Then...
+        self.assertIs(first, second)
+        self.assertEqual(1, in_use)
+        self.assertEqual((1, 0, 1, 2, 1), pool.metrics()[:3] + pool.metrics()[4:6])
+
+    def test_min_size_is_built_up_front(self):
+        # When...
+        pool = Pool(FakeConnection, min_size=2, max_size=4)
+        # Then...
+        self.assertEqual(2, FakeConnection.opened)
+        self.assertEqual(2, pool.metrics().idle)
+
+    def test_lease_stands_in_for_the_instance(self):
+        # Given...
+        pool = Pool(FakeConnection)
+        # When...
+        lease = pool.acquire()
+        # Then...
+        self.assertEqual(1, lease.number)
+        lease.release()
+        lease.release()
+        self.assertEqual(1, pool.metrics().idle)
+
+    def test_garbage_collected_leases_are_released(self):
+        # Given...
+        pool = Pool(FakeConnection, max_size=1)
+        # When...
+        pool.acquire()
+        # Then...
+        self.assertEqual(0, pool.metrics().in_use)
+
+    def test_acquire_waits_for_a_release(self):
+        # Given...
+        pool = Pool(FakeConnection, max_size=1)
+        lease = pool.acquire()
+        timer = threading.Timer(0.05, lease.release)
+        # When...
+        timer.start()
+        with pool.acquire(timeout=1) as connection:
+            metrics = pool.metrics()
+        # Then...
+        self.assertIs(lease.instance, connection)
+        self.assertEqual(1, FakeConnection.opened)
+        self.assertGreaterEqual(metrics.max_wait_time, 0.04)
+
+    def test_acquire_times_out(self):
+        # Given...
+        pool = Pool(FakeConnection, max_size=1, timeout=0.01)
+        lease = pool.acquire()
+        # When/Then...
+        with self.assertRaises(PoolTimeoutError):
+            pool.acquire()
+        lease.release()
+
+    def test_concurrent_acquires_stay_within_max_size(self):
+        # Given...
+        pool = Pool(FakeConnection, max_size=3)
+        peak = []
+
+        def work():
+            for _ in range(20):
+                with pool.acquire():
+                    peak.append(pool.metrics().in_use)
+                    time.sleep(0.001)
+
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        # When...
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # Then...
+        self.assertLessEqual(max(peak), 3)
+        self.assertLessEqual(FakeConnection.opened, 3)
+        self.assertEqual(160, pool.metrics().leases)
+
+    def test_unhealthy_and_expired_instances_are_destroyed(self):
+        # Given...
+        pool = Pool(FakeConnection, max_size=2, health_check=lambda connection: connection.alive)
+        with pool.acquire() as broken:
+            broken.alive = False
+        # When...
+        with pool.acquire() as connection:
+            pass
+        # Then...
+        self.assertTrue(broken.closed)
+        self.assertIsNot(broken, connection)
+        self.assertEqual(1, pool.metrics().destroyed)
+
+    def test_idle_timeout_and_max_lifetime(self):
+        # Given...
+        idle = Pool(FakeConnection, min_size=1, max_size=2, idle_timeout=0.01)
+        aged = Pool(FakeConnection, max_size=1, max_lifetime=0.01)
+        first, second = idle.acquire(), idle.acquire()
+        first.release()
+        second.release()
+        with aged.acquire() as old:
+            pass
+        # When...
+        time.sleep(0.02)
+        with idle.acquire():
+            sizes = idle.metrics().size
+        with aged.acquire() as new:
+            pass
+        # Then...
+        self.assertEqual(1, sizes)
+        self.assertIsNot(old, new)
+        self.assertTrue(old.closed)
+
+    def test_least_recently_used_idle_instances_are_evicted(self):
+        # Given...
+        pool = Pool(FakeConnection, min_size=1, max_size=5, idle_timeout=0.05)
+        leases = [pool.acquire() for _ in range(5)]
+        for lease in leases:
+            lease.release()
+        # When...
+        for _ in range(5):
+            time.sleep(0.02)
+            with pool.acquire():
+                pass
+        # Then...
+        self.assertEqual((1, 0, 1), pool.metrics()[:3])
+        self.assertEqual(4, pool.metrics().destroyed)
+        self.assertEqual([True, True, True, True, False], [lease.instance.closed for lease in leases])
+
+    def test_discard_and_close(self):
+        # Given...
+        pool = Pool(FakeConnection, max_size=2)
+        lease, kept = pool.acquire(), pool.acquire()
+        # When...
+        lease.release(discard=True)
+        pool.close()
+        kept.release()
+        # Then...
+        self.assertTrue(lease.instance.closed)
+        self.assertTrue(kept.instance.closed)
+        self.assertEqual(0, pool.metrics().size)
+        with self.assertRaises(PoolClosedError):
+            pool.acquire()
+
+
+if __name__ == '__main__':
+    unittest.main()
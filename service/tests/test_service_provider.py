@@ -0,0 +1,790 @@
+import asyncio
+import contextvars
+import gc
+import json
+import os
+import threading
+import time
+import unittest
+import weakref
+
+from meta.construction import Singleton
+from service.environ import Environment
+from service.metrics import InMemorySink
+from service.pool import Lease
+from service.proxy import ServiceProxy, is_resolved
+from service.provider import (ServiceProvider, AsyncServiceError, ConstructionPlan, BadConfPathError, BadPoolConfError,
+                              NoRequestScopeError, ServiceCycleError, UnknownReferenceError, UnknownScopeError,
+                              _providers)
+
+
+APP_CONF = {'service': {'mysql': {'config': {'port': 3306, 'host': 'db'}},
+                        'redis': {'host': 'localhost'}},
+            'jwt': {'token': 'Bearer abc'}}
+
+
+class Connection():
+    built = 0
+    order = []
+
+    def __init__(self, host=None, *dependencies):
+        time.sleep(0.01)  # Widen the window for concurrent first calls.
+        Connection.built += 1
+        Connection.order.append(host)
+        self.host = host
+        self.dependencies = dependencies
+
+
+class ThreadConnection(Connection):
+    threads = []
+
+    def __init__(self, host=None, *dependencies):
+        super().__init__(host, *dependencies)
+        ThreadConnection.threads.append(threading.current_thread())
+
+
+class Store():
+
+    def __init__(self, connection, host=None):
+        self.connection = connection
+        self.host = host
+
+
+class StoreFactory():
+
+    def __init__(self, host=None):
+        self.host = host
+
+    def build(self):
+        return Store(None, self.host)
+
+
+class AsyncConnectionFactory():
+    built = 0
+    building = 0
+    most_building = 0
+
+    def __init__(self, host=None):
+        self.host = host
+
+    async def build(self):
+        AsyncConnectionFactory.building += 1
+        AsyncConnectionFactory.most_building = max(AsyncConnectionFactory.most_building,
+                                                   AsyncConnectionFactory.building)
+        try:
+            await asyncio.sleep(0.05)
+        finally:
+            AsyncConnectionFactory.building -= 1
+        AsyncConnectionFactory.built += 1
+        return Store(None, self.host)
+
+
+def is_alive(connection):
+    return connection.host != 'dead'
+
+
+SERVICE_CONF = {'service.connection': {'class': f'{__name__}.Connection', 'scope': 'singleton',
+                                       'kwarguments': {'host': '%service.redis.host%'}},
+                'service.session': {'class': f'{__name__}.Connection', 'scope': 'request'},
+                'service.store': {'class': f'{__name__}.Store', 'arguments': ['@service.connection']},
+                'service.store.factory': {'factory': f'{__name__}.StoreFactory', 'scope': 'singleton'},
+                'service.odd': {'class': f'{__name__}.Connection', 'scope': 'weekly'}}
+
+
+class ServiceProviderTestCase(unittest.TestCase):
+
+    maxDiff = None
+
+    def setUp(self):
+        Singleton._instances.pop(ServiceProvider, None)
+        self.provider = ServiceProvider()
+
+    def tearDown(self):
+        Singleton._instances.pop(ServiceProvider, None)
+
+
+class ServiceProviderConfTest(ServiceProviderTestCase):
+
+    def test_get_conf(self):
+        # Given...
+        self.provider.conf({}, APP_CONF)
+        # When/Then...
+        self.assertEqual(3306, self.provider._get_conf('service.mysql.config.port'))
+        self.assertEqual({'host': 'localhost'}, self.provider._get_conf('service.redis'))
+        self.assertEqual('Bearer abc', self.provider._get_conf('jwt.token.beyond.leaf'))
+
+    def test_get_conf_bad_path(self):
+        # Given...
+        self.provider.conf({}, APP_CONF)
+        # When...
+        with self.assertRaises(BadConfPathError) as context:
+            self.provider._get_conf('service.mysql.nope.port')
+        # Then...
+        self.assertEqual('The path "nope" was not found in the app configuration.', str(context.exception))
+
+    def test_compiled_paths_are_cached_and_reset_by_conf(self):
+        # Given...
+        self.provider.conf({}, APP_CONF)
+        # When...
+        for _ in range(3):
+            self.provider._get_conf('service.mysql.config.port')
+        hits = self.provider._compile_conf_path.cache_info().hits
+        self.provider.conf({}, {'service': {'mysql': {'config': {'port': 3307}}}})
+        # Then...
+        self.assertEqual(2, hits)
+        self.assertEqual(0, self.provider._compile_conf_path.cache_info().currsize)
+        self.assertEqual(3307, self.provider._get_conf('service.mysql.config.port'))
+
+
+class ServiceProviderArgumentsTest(ServiceProviderTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.provider.environment = Environment(environ={'REDIS_HOST': 'redis-host'})
+
+    def test_env_references(self):
+        # Given...
+        self.provider.conf({}, APP_CONF)
+        # When/Then...
+        self.assertEqual('redis-host', self.provider._get_arg('$REDIS_HOST'))
+        self.assertEqual('redis-host', self.provider._get_arg('$REDIS_HOST$'))
+        self.assertEqual('redis-host', self.provider._get_arg(['$REDIS_HOST', 'fallback']))
+        self.assertEqual('db', self.provider._get_arg(['$MISSING', '%service.mysql.config.host%']))
+        self.assertIsNone(self.provider._get_arg('$MISSING'))
+
+    def test_refresh_env_invalidates_services_reading_changed_variables(self):
+        # Given...
+        self.provider.conf({'service.redis': {'class': f'{__name__}.Store', 'scope': 'singleton',
+                                              'arguments': [None, '$REDIS_HOST']},
+                            'service.mysql': {'class': f'{__name__}.Store', 'scope': 'singleton',
+                                              'arguments': [None, '$MYSQL_HOST']}}, APP_CONF)
+        self.provider.environment.refresh({'REDIS_HOST': 'first', 'MYSQL_HOST': 'db'})
+        redis, mysql = self.provider.get('service.redis'), self.provider.get('service.mysql')
+        self.provider.environment.refresh = lambda environ=None: Environment.refresh(
+            self.provider.environment, {'REDIS_HOST': 'second', 'MYSQL_HOST': 'db'})
+        # When...
+        services = self.provider.refresh_env()
+        # Then...
+        self.assertEqual({'service.redis'}, services)
+        self.assertEqual('second', self.provider.get('service.redis').host)
+        self.assertIs(mysql, self.provider.get('service.mysql'))
+        self.assertIsNot(redis, self.provider.get('service.redis'))
+
+    def test_env_default_is_only_resolved_when_missing(self):
+        # Given...
+        self.provider.conf({}, APP_CONF)
+        # When/Then...
+        self.assertEqual('redis-host', self.provider._get_arg(['$REDIS_HOST', '%no.such.path%']))
+
+    def test_plans_are_compiled_once_per_definition(self):
+        # Given...
+        self.provider.conf({'service.pair': {'class': f'{__name__}.Store',
+                                             'arguments': [42], 'kwarguments': {'host': ['$REDIS_PORT', 6379]}}},
+                           APP_CONF)
+        # When...
+        pair = self.provider.get('service.pair')
+        plan = self.provider.service_plans['service.pair']
+        self.provider.get('service.pair')
+        # Then...
+        self.assertEqual(42, pair.connection)
+        self.assertEqual(6379, pair.host)
+        self.assertIs(plan, self.provider.service_plans['service.pair'])
+        self.assertIs(Store, plan.constructor)
+        self.provider.invalidate(['service.pair'])
+        self.assertNotIn('service.pair', self.provider.service_plans)
+        self.provider.get('service.pair')
+        self.provider.conf({}, APP_CONF)
+        self.assertEqual({}, self.provider.service_plans)
+
+
+class ServiceProviderScopeTest(ServiceProviderTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.provider.conf(SERVICE_CONF, APP_CONF)
+        Connection.built = 0
+
+    def test_transient_services_share_singleton_dependencies(self):
+        # When...
+        first = self.provider.get('service.store')
+        second = self.provider.get('service.store')
+        # Then...
+        self.assertIsNot(first, second)
+        self.assertIs(first.connection, second.connection)
+        self.assertEqual('localhost', first.connection.host)
+        self.assertEqual(1, Connection.built)
+
+    def test_concurrent_first_calls_build_one_singleton(self):
+        # Given...
+        instances = []
+        threads = [threading.Thread(target=lambda: instances.append(self.provider.get('service.connection')))
+                   for _ in range(8)]
+        # When...
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # Then...
+        self.assertEqual(8, len(instances))
+        self.assertEqual(1, len({id(instance) for instance in instances}))
+        self.assertEqual(1, Connection.built)
+
+    def test_injection_builds_an_uncached_instance(self):
+        # When...
+        singleton = self.provider.get('service.connection')
+        injected = self.provider.get('service.connection', {'host': 'other'})
+        # Then...
+        self.assertIsNot(singleton, injected)
+        self.assertEqual('other', injected.host)
+        self.assertIs(singleton, self.provider.get('service.connection'))
+
+    def test_factory_services(self):
+        # When...
+        store = self.provider.get('service.store.factory')
+        injected = self.provider.get('service.store.factory', {'host': 'other'})
+        # Then...
+        self.assertIs(store, self.provider.get('service.store.factory'))
+        self.assertIsNot(store, injected)
+
+    def test_request_scope(self):
+        # Given...
+        sessions = []
+        # When...
+        with self.provider.request_scope():
+            first = self.provider.get('service.session')
+            contextvars.copy_context().run(lambda: sessions.append(self.provider.get('service.session')))
+        with self.provider.request_scope():
+            second = self.provider.get('service.session')
+        # Then...
+        self.assertIs(first, sessions[0])
+        self.assertIsNot(first, second)
+        with self.assertRaises(NoRequestScopeError):
+            self.provider.get('service.session')
+
+    def test_request_scopes_are_context_local(self):
+        # Given...
+        sessions = {}
+
+        def request(key):
+            with self.provider.request_scope():
+                sessions[key] = (self.provider.get('service.session'), self.provider.get('service.session'))
+
+        threads = [threading.Thread(target=request, args=(key,)) for key in range(2)]
+        # When...
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # Then...
+        self.assertIs(sessions[0][0], sessions[0][1])
+        self.assertIsNot(sessions[0][0], sessions[1][0])
+
+    def test_invalidate_drops_singletons(self):
+        # Given...
+        connection = self.provider.get('service.connection')
+        # When...
+        self.provider.invalidate({'service.connection'})
+        # Then...
+        self.assertIsNot(connection, self.provider.get('service.connection'))
+
+    def test_unknown_scope(self):
+        # When...
+        with self.assertRaises(UnknownScopeError) as context:
+            self.provider.get('service.odd')
+        # Then...
+        self.assertEqual('The service "service.odd" has an unknown scope "weekly".', str(context.exception))
+
+
+class ServiceProviderGraphTest(ServiceProviderTestCase):
+
+    def _service(self, name, *dependencies, scope='singleton'):
+        return name, {'class': f'{__name__}.Connection', 'scope': scope,
+                      'arguments': [name] + [f'@{dependency}' for dependency in dependencies]}
+
+    def test_dependency_graph(self):
+        # When...
+        self.provider.conf(dict([self._service('a', 'b', 'c'), self._service('b', 'c'), self._service('c')]))
+        # Then...
+        self.assertEqual({'a': ('b', 'c'), 'b': ('c',), 'c': ()}, self.provider.dependencies)
+
+    def test_env_defaults_are_dependencies(self):
+        # When...
+        self.provider.conf({'a': {'class': f'{__name__}.Connection', 'kwarguments': {'host': ['$HOST', '@b']}},
+                            'b': {'class': f'{__name__}.Connection', 'arguments': [{'literal': '@nothing'}]}})
+        # Then...
+        self.assertEqual({'a': ('b',), 'b': ()}, self.provider.dependencies)
+
+    def test_cycles_are_reported_by_conf(self):
+        # Given...
+        self.provider.conf(dict([self._service('a')]))
+        # When...
+        with self.assertRaises(ServiceCycleError) as context:
+            self.provider.conf(dict([self._service('a', 'b'), self._service('b', 'c'), self._service('c', 'b')]))
+        # Then...
+        self.assertEqual(['b', 'c', 'b'], context.exception.chain)
+        self.assertEqual('The services depend on each other: b -> c -> b.', str(context.exception))
+        self.assertEqual(['a'], list(self.provider.service_conf))
+
+    def test_unknown_references_are_reported_by_conf(self):
+        # When...
+        with self.assertRaises(UnknownReferenceError) as context:
+            self.provider.conf(dict([self._service('a', 'nope')]))
+        # Then...
+        self.assertEqual('The service "a" references "nope", which is not a service we know of.',
+                         str(context.exception))
+
+    def test_warm_up_builds_singletons_in_topological_order(self):
+        # Given...
+        self.provider.conf(dict([self._service('top', 'left', 'right'), self._service('left', 'base'),
+                                 self._service('right', 'base'), self._service('base'),
+                                 self._service('other', scope='transient')]))
+        Connection.built, Connection.order = 0, []
+        # When...
+        done = self.provider.warm_up(max_workers=4)
+        # Then...
+        self.assertEqual({'top', 'left', 'right', 'base', 'other'}, set(done))
+        self.assertEqual('base', Connection.order[0])
+        self.assertEqual({'left', 'right'}, set(Connection.order[1:3]))
+        self.assertEqual('top', Connection.order[3])
+        self.assertEqual(4, Connection.built)
+        self.assertIn('other', self.provider.service_plans)
+        top = self.provider.get('top')
+        self.assertIs(top.dependencies[0].dependencies[0], top.dependencies[1].dependencies[0])
+        self.assertEqual(4, Connection.built)
+
+
+class ServiceProviderAsyncTest(ServiceProviderTestCase):
+
+    def setUp(self):
+        super().setUp()
+        factory = f'{__name__}.AsyncConnectionFactory'
+        self.provider.conf({'service.read': {'factory': factory, 'scope': 'singleton', 'kwarguments': {'host': 'read'}},
+                            'service.write': {'factory': factory, 'scope': 'singleton', 'arguments': ['write']},
+                            'service.cache': {'factory': factory, 'scope': 'request'},
+                            'service.store': {'class': f'{__name__}.Store',
+                                              'arguments': ['@service.read'], 'kwarguments': {'host': '@service.write'}},
+                            'service.plain': {'class': f'{__name__}.Store', 'arguments': [None]}}, APP_CONF)
+        AsyncConnectionFactory.built = AsyncConnectionFactory.most_building = 0
+
+    def test_async_factories_and_concurrent_arguments(self):
+        # When...
+        store = asyncio.run(self.provider.aget('service.store'))
+        # Then...
+        self.assertEqual('read', store.connection.host)
+        self.assertEqual('write', store.host.host)
+        self.assertEqual(2, AsyncConnectionFactory.most_building)
+        self.assertIs(store.connection, self.provider.get('service.store').connection)
+
+    def test_concurrent_calls_share_one_construction(self):
+        # Given...
+        async def requests():
+            return await asyncio.gather(*(self.provider.aget('service.read') for _ in range(10)))
+        # When...
+        instances = asyncio.run(requests())
+        # Then...
+        self.assertEqual(1, AsyncConnectionFactory.built)
+        self.assertEqual(1, len({id(instance) for instance in instances}))
+        self.assertEqual({}, self.provider._in_flight)
+
+    def test_concurrent_calls_from_several_event_loops(self):
+        # Given...
+        barrier = threading.Barrier(4)
+        instances, errors = [], []
+
+        def thread():
+            async def request():
+                barrier.wait()
+                return await self.provider.aget('service.read')
+            try:
+                instances.append(asyncio.run(request()))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=thread) for _ in range(4)]
+        # When...
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        # Then...
+        self.assertEqual([], errors)
+        self.assertEqual(1, len({id(instance) for instance in instances}))
+        self.assertEqual({}, self.provider._in_flight)
+
+    def test_request_scope(self):
+        # Given...
+        async def request():
+            with self.provider.request_scope():
+                return await asyncio.gather(self.provider.aget('service.cache'), self.provider.aget('service.cache'))
+        # When...
+        first, second = asyncio.run(request()), asyncio.run(request())
+        # Then...
+        self.assertIs(first[0], first[1])
+        self.assertIsNot(first[0], second[0])
+        self.assertEqual(2, AsyncConnectionFactory.built)
+
+    def test_get_refuses_async_factories(self):
+        # When...
+        with self.assertRaises(AsyncServiceError) as context:
+            self.provider.get('service.read')
+        # Then...
+        self.assertEqual('The factory of the service "service.read" builds it asynchronously, get it with aget().',
+                         str(context.exception))
+        self.assertIsNone(asyncio.run(self.provider.aget('service.plain')).connection)
+
+    def test_warm_up_leaves_async_singletons(self):
+        # When...
+        self.provider.warm_up()
+        # Then...
+        self.assertEqual(0, AsyncConnectionFactory.built)
+        self.assertEqual(set(self.provider.service_conf), set(self.provider.service_plans))
+
+
+class ServiceProviderPoolTest(ServiceProviderTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.provider.conf({'service.db': {'class': f'{__name__}.Connection', 'kwarguments': {'host': 'db'},
+                                           'pool': {'min_size': 1, 'max_size': 2,
+                                                    'health_check': f'{__name__}.is_alive'}},
+                            'service.store': {'class': f'{__name__}.Store', 'arguments': ['@service.db']},
+                            'service.odd': {'class': f'{__name__}.Connection', 'pool': {'size': 3}},
+                            'service.thread': {'class': f'{__name__}.ThreadConnection', 'pool': {'min_size': 2}},
+                            'service.lazy_store': {'class': f'{__name__}.Store', 'arguments': ['@?service.db']},
+                            'service.async': {'factory': f'{__name__}.AsyncConnectionFactory', 'pool': {}}},
+                           APP_CONF)
+        Connection.built = 0
+        ThreadConnection.threads = []
+
+    def test_pooled_services_are_leased(self):
+        # When...
+        with self.provider.get('service.db') as first:
+            in_use = self.provider.pool_metrics()['service.db'].in_use
+        with self.provider.get('service.db') as second:
+            pass
+        # Then...
+        self.assertIs(first, second)
+        self.assertEqual(1, in_use)
+        self.assertEqual(1, Connection.built)
+        self.assertIs(is_alive, self.provider.pools['service.db'].health_check)
+
+    def test_dependents_hold_a_lease(self):
+        # When...
+        store = self.provider.get('service.store')
+        in_use = self.provider.pool_metrics()['service.db'].in_use
+        del store
+        gc.collect()
+        # Then...
+        self.assertEqual(1, in_use)
+        self.assertEqual(0, self.provider.pool_metrics()['service.db'].in_use)
+
+    def test_lazy_dependents_lease_on_first_use(self):
+        # When...
+        store = self.provider.get('service.lazy_store')
+        pools = dict(self.provider.pools)
+        host = store.connection.host
+        in_use = self.provider.pool_metrics()['service.db'].in_use
+        del store
+        gc.collect()
+        # Then...
+        self.assertEqual({}, pools)
+        self.assertEqual('db', host)
+        self.assertEqual(1, in_use)
+        self.assertEqual(0, self.provider.pool_metrics()['service.db'].in_use)
+
+    def test_lease_with_aget(self):
+        # When...
+        lease = asyncio.run(self.provider.aget('service.db'))
+        # Then...
+        self.assertIsInstance(lease, Lease)
+        self.assertEqual('db', lease.host)
+        lease.release()
+
+    def test_aget_creates_pools_off_the_event_loop(self):
+        # When...
+        lease = asyncio.run(self.provider.aget('service.thread'))
+        lease.release()
+        # Then...
+        self.assertEqual(2, len(ThreadConnection.threads))
+        self.assertNotIn(threading.main_thread(), ThreadConnection.threads)
+
+    def test_async_factories_cannot_be_pooled(self):
+        # When...
+        with self.assertRaises(BadPoolConfError) as context:
+            asyncio.run(self.provider.aget('service.async'))
+        # Then...
+        self.assertEqual('The factory of the service "service.async" builds it asynchronously, '
+                         'which pools do not support.', str(context.exception))
+
+    def test_set_metrics_closes_pools(self):
+        # Given...
+        self.provider.get('service.db').release()
+        pool = self.provider.pools['service.db']
+        # When...
+        self.provider.set_metrics(InMemorySink())
+        lease = self.provider.get('service.db')
+        lease.release()
+        # Then...
+        self.assertTrue(pool.closed)
+        self.assertIsNot(pool, self.provider.pools['service.db'])
+        self.provider.set_metrics(None)
+
+    def test_injection_builds_an_unpooled_instance(self):
+        # When...
+        connection = self.provider.get('service.db', {'host': 'other'})
+        # Then...
+        self.assertIsInstance(connection, Connection)
+        self.assertEqual({}, self.provider.pools)
+
+    def test_warm_up_fills_pools_and_invalidate_closes_them(self):
+        # Given...
+        self.provider.conf({k: v for k, v in self.provider.service_conf.items() if k in {'service.db', 'service.store'}},
+                           APP_CONF)
+        # When...
+        self.provider.warm_up()
+        pool = self.provider.pools['service.db']
+        self.provider.invalidate({'service.db'})
+        # Then...
+        self.assertEqual(1, Connection.built)
+        self.assertTrue(pool.closed)
+        self.assertNotIn('service.db', self.provider.pools)
+
+    def test_unknown_pool_options(self):
+        # When...
+        with self.assertRaises(BadPoolConfError) as context:
+            self.provider.get('service.odd')
+        # Then...
+        self.assertEqual('The pool of the service "service.odd" has unknown options: size.', str(context.exception))
+
+
+class ServiceProviderProxyTest(ServiceProviderTestCase):
+
+    def setUp(self):
+        super().setUp()
+        connection = f'{__name__}.Connection'
+        self.provider.conf({'service.read': {'class': connection, 'arguments': ['read']},
+                            'service.write': {'class': connection, 'arguments': ['write'], 'scope': 'singleton'},
+                            'service.store': {'class': f'{__name__}.Store',
+                                              'arguments': ['@service.read'], 'kwarguments': {'host': '@?service.write'}},
+                            'service.parent': {'class': connection, 'arguments': ['parent', '@service.child']},
+                            'service.child': {'class': connection, 'arguments': ['child', '@?service.parent']}},
+                           APP_CONF)
+        Connection.built = 0
+
+    def test_lazy_references_are_built_on_first_use(self):
+        # When...
+        store = self.provider.get('service.store')
+        built = Connection.built
+        host = store.host.host
+        # Then...
+        self.assertEqual(1, built)
+        self.assertIsInstance(store.host, ServiceProxy)
+        self.assertTrue(is_resolved(store.host))
+        self.assertEqual('write', host)
+        self.assertEqual(2, Connection.built)
+        self.assertEqual(self.provider.get('service.write'), store.host)
+
+    def test_proxy_repr(self):
+        # When...
+        store = self.provider.get('service.store')
+        # Then...
+        self.assertEqual('<ServiceProxy "service.write" (not built yet)>', repr(store.host))
+        self.assertFalse(is_resolved(store.host))
+
+    def test_lazy_references_break_cycles(self):
+        # When...
+        parent = self.provider.get('service.parent')
+        # Then...
+        self.assertEqual(('service.child',), self.provider.dependencies['service.parent'])
+        self.assertEqual((), self.provider.dependencies['service.child'])
+        self.assertEqual('parent', parent.dependencies[0].dependencies[0].host)
+
+    def test_unknown_lazy_references_are_reported(self):
+        # When/Then...
+        with self.assertRaises(UnknownReferenceError):
+            self.provider.conf({'service.store': {'class': f'{__name__}.Store', 'arguments': ['@?service.nope']}})
+
+
+class ServiceProviderForkTest(ServiceProviderTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.provider.conf({k: v for k, v in SERVICE_CONF.items() if k != 'service.odd'}, APP_CONF)
+
+    def tearDown(self):
+        gc.unfreeze()
+        super().tearDown()
+
+    def test_prefork_compiles_plans_and_freezes_gc(self):
+        # When...
+        self.provider.prefork()
+        # Then...
+        self.assertEqual(set(SERVICE_CONF) - {'service.odd'}, set(self.provider.service_plans))
+        self.assertGreater(gc.get_freeze_count(), 0)
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'needs os.fork')
+    def test_children_build_their_own_services(self):
+        # Given...
+        self.provider.prefork(freeze_gc=False)
+        parent = self.provider.get('service.connection')
+        read, write = os.pipe()
+        # When...
+        pid = os.fork()
+        if not pid:
+            os.close(read)
+            child = self.provider.get('service.connection')
+            with os.fdopen(write, 'w') as fp:
+                json.dump({'same': child is parent, 'plans': len(self.provider.service_plans)}, fp)
+            os._exit(0)
+        os.close(write)
+        with os.fdopen(read) as fp:
+            result = json.load(fp)
+        os.waitpid(pid, 0)
+        # Then...
+        self.assertEqual({'same': False, 'plans': 4}, result)
+        self.assertIs(parent, self.provider.get('service.connection'))
+
+    def test_fork_hook_forgets_dropped_providers(self):
+        # Given...
+        dropped = []
+        for _ in range(3):
+            Singleton._instances.pop(ServiceProvider, None)
+            dropped.append(weakref.ref(ServiceProvider()))
+        # When...
+        Singleton._instances.pop(ServiceProvider, None)
+        gc.collect()
+        # Then...
+        self.assertEqual([None, None, None], [provider() for provider in dropped])
+        self.assertIn(self.provider, _providers)
+
+
+class ServiceProviderMetricsTest(ServiceProviderTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.sink = InMemorySink()
+        self.provider.set_metrics(self.sink)
+        self.provider.conf({k: v for k, v in SERVICE_CONF.items() if k != 'service.odd'}, APP_CONF)
+
+    def test_counters(self):
+        # When...
+        for _ in range(3):
+            self.provider.get('service.store')
+        self.provider.get('service.store.factory')
+        # Then...
+        self.assertEqual({'plan.miss': {'service.store': 1, 'service.connection': 1, 'service.store.factory': 1},
+                          'plan.hit': {'service.store': 2, 'service.connection': 2},
+                          'class_cache.miss': {'service.store': 1, 'service.connection': 1,
+                                               'service.store.factory': 1},
+                          'instance.hit': {'service.connection': 2}}, self.sink.snapshot()['counters'])
+
+    def test_timings(self):
+        # When...
+        self.provider.get('service.store')
+        self.provider.get('service.store.factory')
+        timings = self.sink.snapshot()['timings']
+        # Then...
+        self.assertEqual({'construct', 'factory_build', 'import', 'conf'}, set(timings))
+        self.assertEqual({'service.store', 'service.connection', 'service.store.factory'}, set(timings['construct']))
+        self.assertEqual({'service.connection'}, set(timings['conf']))
+        self.assertGreaterEqual(timings['construct']['service.store']['min'],
+                                timings['construct']['service.connection']['min'])
+
+    def test_aget_measures_like_get(self):
+        # Given...
+        async def get_all():
+            for _ in range(3):
+                await self.provider.aget('service.store')
+            await self.provider.aget('service.store.factory')
+        # When...
+        asyncio.run(get_all())
+        snapshot = self.sink.snapshot()
+        # Then...
+        self.assertEqual({'plan.miss': {'service.store': 1, 'service.connection': 1, 'service.store.factory': 1},
+                          'plan.hit': {'service.store': 2, 'service.connection': 2},
+                          'class_cache.miss': {'service.store': 1, 'service.connection': 1,
+                                               'service.store.factory': 1},
+                          'instance.hit': {'service.connection': 2}}, snapshot['counters'])
+        self.assertEqual({'construct', 'factory_build', 'import', 'conf'}, set(snapshot['timings']))
+        self.assertEqual({'service.store.factory'}, set(snapshot['timings']['factory_build']))
+
+    def test_nothing_is_measured_once_disabled(self):
+        # Given...
+        self.provider.set_metrics(None)
+        # When...
+        self.provider.get('service.store')
+        # Then...
+        self.assertEqual({'counters': {}, 'timings': {}}, self.sink.snapshot())
+        self.assertIs(ConstructionPlan, type(self.provider.service_plans['service.store']))
+
+
+class EnvironmentTest(unittest.TestCase):
+
+    maxDiff = None
+
+    def test_overrides_are_typed_and_matched_case_insensitively(self):
+        # Given...
+        environment = Environment(environ={'APP__SERVICE__MYSQL__CONFIG__PORT': '3307',
+                                           'APP__JWT__TOKEN': 'Bearer xyz',
+                                           'APP__FEATURES__BETA': 'true',
+                                           'OTHER__JWT__TOKEN': 'ignored'})
+        # When...
+        app_conf = environment.apply(APP_CONF)
+        # Then...
+        self.assertEqual({'service': {'mysql': {'config': {'port': 3307, 'host': 'db'}},
+                                      'redis': {'host': 'localhost'}},
+                          'jwt': {'token': 'Bearer xyz'},
+                          'features': {'beta': 'true'}}, app_conf)
+        self.assertEqual('Bearer abc', APP_CONF['jwt']['token'])
+        self.assertIs(APP_CONF['service']['redis'], app_conf['service']['redis'])
+
+    def test_overrides_take_the_type_of_the_setting(self):
+        # Given...
+        app_conf = {'db': {'passwd': 'secret', 'port': 3306, 'timeout': 1.5, 'debug': False},
+                    'jwt': {'token': 'abc'}, 'cron': {'at': '00:00'}}
+        environment = Environment(environ={'APP__DB__PASSWD': '0755', 'APP__DB__PORT': '3307',
+                                           'APP__DB__TIMEOUT': '2', 'APP__DB__DEBUG': 'True',
+                                           'APP__JWT__TOKEN': 'off', 'APP__CRON__AT': '12:30',
+                                           'APP__JWT__ISSUER': 'null'})
+        # When...
+        app_conf = environment.apply(app_conf)
+        # Then...
+        self.assertEqual({'db': {'passwd': '0755', 'port': 3307, 'timeout': 2.0, 'debug': True},
+                          'jwt': {'token': 'off', 'issuer': 'null'}, 'cron': {'at': '12:30'}}, app_conf)
+
+    def test_override_of_the_wrong_type_is_ignored(self):
+        # Given...
+        environment = Environment(environ={'APP__SERVICE__MYSQL__CONFIG__PORT': 'db-port',
+                                           'APP__FEATURES__BETA': 'yes'})
+        # When...
+        with self.assertLogs('service.environ', 'WARNING') as logs:
+            app_conf = environment.apply(dict(APP_CONF, features={'beta': False}))
+        # Then...
+        self.assertEqual(3306, app_conf['service']['mysql']['config']['port'])
+        self.assertEqual(False, app_conf['features']['beta'])
+        self.assertEqual(2, len(logs.records))
+
+    def test_override_below_a_leaf_is_ignored(self):
+        # Given...
+        environment = Environment(environ={'APP__JWT__TOKEN__VALUE': 'x'})
+        # When...
+        with self.assertLogs('service.environ', 'WARNING'):
+            app_conf = environment.apply(APP_CONF)
+        # Then...
+        self.assertIs(APP_CONF, app_conf)
+
+    def test_snapshot_is_only_taken_on_refresh(self):
+        # Given...
+        environ = {'REDIS_HOST': 'first'}
+        environment = Environment(environ=environ)
+        # When...
+        environ['REDIS_HOST'] = 'second'
+        before = environment.get('REDIS_HOST')
+        environment.refresh(environ)
+        # Then...
+        self.assertEqual('first', before)
+        self.assertEqual('second', environment.get('REDIS_HOST'))
+
+
+if __name__ == '__main__':
+    unittest.main()
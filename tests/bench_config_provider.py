@@ -0,0 +1,86 @@
+"""
+Startup time and memory of ConfigProvider, eager versus lazy, on a synthetic
+app configuration with many large sections, half of them !included, when a
+worker only reads a couple of keys.
+
+    python -m tests.bench_config_provider [sections] [keys_per_section]
+"""
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from meta.construction import Singleton
+from provider import ConfigProvider
+
+
+def write_configs(directory: str, sections: int, keys: int) -> str:
+    with open(os.path.join(directory, 'service_conf.yaml'), 'w') as fp:
+        fp.write("service.dummy:\n  class: 'meta.ioc.Importer'\n")
+
+    lines = ["jwt:\n  token: 'Bearer abc'\n  token_basic: 'Basic xyz'\n"]
+    for section in range(sections):
+        body = ''.join(f"  key_{key}: {{name: 'value {key}', limits: [1, 2, 3]}}\n" for key in range(keys))
+        if section % 2:
+            with open(os.path.join(directory, f'section_{section}.yaml'), 'w') as fp:
+                fp.write(body.replace('\n  ', '\n')[2:])
+            lines.append(f"section_{section}: !include section_{section}.yaml\n")
+        else:
+            lines.append(f"section_{section}:\n{body}")
+
+    app_conf_path = os.path.join(directory, 'config.yaml')
+    with open(app_conf_path, 'w') as fp:
+        fp.write(''.join(lines))
+
+    return app_conf_path
+
+
+def measure(app_conf_path: str, lazy: bool) -> dict:
+    """
+    Time a cold start and two reads, then repeat it under tracemalloc for memory.
+    """
+    result = {}
+
+    for traced in (False, True):
+        Singleton._instances.pop(ConfigProvider, None)
+        gc.collect()
+        if traced:
+            tracemalloc.start()
+
+        started = time.perf_counter()
+        provider = ConfigProvider(app_conf=app_conf_path, lazy=lazy)
+        startup = time.perf_counter() - started
+        provider.get_value('jwt.token')
+        provider.get_value('section_1.key_0.name')
+        total = time.perf_counter() - started
+
+        if traced:
+            result['current'], result['peak'] = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        else:
+            result['startup'], result['total'] = startup, total
+        del provider
+
+    Singleton._instances.pop(ConfigProvider, None)
+    return result
+
+
+def main(argv: list):
+    sections = int(argv[0]) if argv else 40
+    keys = int(argv[1]) if len(argv) > 1 else 500
+
+    with tempfile.TemporaryDirectory() as directory:
+        app_conf_path = write_configs(directory, sections, keys)
+        os.environ['SERVICE_CONFIG_PATH'] = os.path.join(directory, 'service_conf.yaml')
+        results = {'eager': measure(app_conf_path, False), 'lazy': measure(app_conf_path, True)}
+
+    print(f'{sections} sections x {keys} keys, reading 2 keys')
+    for mode, result in results.items():
+        print(f"{mode:>6}: startup {result['startup'] * 1000:8.1f} ms, with reads {result['total'] * 1000:8.1f} ms, "
+              f"retained {result['current'] / 2**20:6.2f} MiB, peak {result['peak'] / 2**20:6.2f} MiB")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,500 @@
+import contextlib
+import gc
+import os
+import pickle
+import tempfile
+import unittest
+
+from meta.construction import Singleton
+from provider import ConfigProvider, KeyedConfigProvider
+from util import snapshot
+from tools.lazy import LazyNode
+from util.loader import Loader
+
+
+APP_CONF = """
+jwt:
+  token: 'Bearer abc'
+  token_basic: 'Basic xyz'
+service:
+  thirstie_legacy:
+    base_url: 'http://legacy'
+  redis:
+    host: 'localhost'
+    port: 6379
+  mysql:
+    config:
+      port: 3306
+      host: 'db'
+merchants:
+  - name: 'first'
+    host: 'merchant-host'
+host: 'top-level-host'
+"""
+
+SERVICE_CONF = """
+service.dummy:
+  class: 'meta.ioc.Importer'
+"""
+
+
+class ConfigProviderTestCase(unittest.TestCase):
+
+    maxDiff = None
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.app_conf_path = self._write('config.yaml', APP_CONF)
+        self.service_conf_path = self._write('service_conf.yaml', SERVICE_CONF)
+        self._environ = dict(os.environ)
+        os.environ['SERVICE_CONFIG_PATH'] = self.service_conf_path
+        Singleton._instances.pop(ConfigProvider, None)
+
+    def tearDown(self):
+        Singleton._instances.pop(ConfigProvider, None)
+        os.environ.clear()
+        os.environ.update(self._environ)
+        self.tmp.cleanup()
+
+    def _write(self, name, content):
+        path = os.path.join(self.tmp.name, name)
+        with open(path, 'w') as fp:
+            fp.write(content)
+        return path
+
+    def _provider(self):
+        return ConfigProvider(app_conf=self.app_conf_path)
+
+
+class ConfigProviderIndexTest(ConfigProviderTestCase):
+
+    def test_value_matches_locate_value(self):
+        # Given...
+        provider = self._provider()
+        # When...
+        keys = ('jwt', 'token', 'host', 'port', 'name', 'base_url')
+        # Then...
+        for key in keys:
+            self.assertIs(provider.locate_value(provider.settings, key)[0], provider.value(key))
+
+    def test_value_of_unknown_key(self):
+        # Given...
+        provider = self._provider()
+        # When/Then...
+        with self.assertRaises(IndexError):
+            provider.value('nope')
+
+    def test_get_value(self):
+        # Given...
+        provider = self._provider()
+        # When/Then...
+        self.assertEqual('Basic xyz', provider.get_value('jwt.token_basic'))
+        self.assertEqual(3306, provider.get_value('service.mysql.config.port'))
+        self.assertEqual('default', provider.get_value('service.nope', 'default'))
+
+    def test_set_value_reindexes(self):
+        # Given...
+        provider = self._provider()
+        # When...
+        provider.set_value('service.redis', {'host': 'redis-host'})
+        provider.set_value('service.queue.host', 'queue-host')
+        provider.set_value('aaa.host', 'new-host')
+        # Then...
+        self.assertIsNone(provider.get_value('service.redis.port'))
+        self.assertEqual('redis-host', provider.get_value('service.redis.host'))
+        self.assertEqual({'host': 'queue-host'}, provider.get_value('service.queue'))
+        for key in ('host', 'port', 'aaa'):
+            self.assertEqual(provider.locate_value(provider.settings, key), provider._key_index[key])
+
+
+    def test_conf_indexes_before_publishing(self):
+        # Given...
+        provider = self._provider()
+        publish, indexed = provider._publish, []
+
+        def checked_publish(service_conf, dependencies, app_conf):
+            indexed.append((provider.app_conf['jwt']['token'], provider.get_value('jwt.token')))
+            publish(service_conf, dependencies, app_conf)
+
+        provider._publish = checked_publish
+        # When...
+        provider.conf(provider.service_conf, dict(provider.app_conf, jwt={'token': 'Bearer new'}))
+        # Then...
+        self.assertEqual([('Bearer abc', 'Bearer new')], indexed)
+        self.assertEqual('Bearer new', provider.settings['jwt']['token'])
+
+    def test_query(self):
+        # Given...
+        provider = self._provider()
+        # When/Then...
+        self.assertEqual(['localhost', 'db'], provider.query('service.**.host'))
+        self.assertEqual(['merchant-host'], provider.query('merchants[0].host'))
+        self.assertEqual(provider.locate_value(provider.settings, 'port'), provider.query('**.port'))
+
+
+class ConfigProviderValuesTest(ConfigProviderTestCase):
+
+    def test_get_values(self):
+        # Given...
+        provider = self._provider()
+        paths = {'base_url': 'service.thirstie_legacy.base_url',
+                 'token_basic': 'jwt.token_basic',
+                 'port': 'service.mysql.config.port',
+                 'mysql': 'service.mysql',
+                 'beyond': 'jwt.token.beyond',
+                 'missing': 'service.nope.port',
+                 'unknown': 'nope'}
+        # When...
+        values = provider.get_values(paths, {'missing': 42})
+        # Then...
+        for field, path in paths.items():
+            self.assertEqual(provider.get_value(path, 42 if field == 'missing' else None), getattr(values, field))
+        with self.assertRaises(AttributeError):
+            values.port = 3307
+
+    def test_get_values_from_a_list(self):
+        # Given...
+        provider = self._provider()
+        # When...
+        values = provider.get_values(['jwt.token', 'service.redis.host'])
+        # Then...
+        self.assertEqual(('Bearer abc', 'localhost'), tuple(values))
+        self.assertEqual('localhost', values.service_redis_host)
+
+    def test_view_follows_new_versions(self):
+        # Given...
+        provider = self._provider()
+        view = provider.view({'token': 'jwt.token', 'host': 'service.redis.host'})
+        record = view.values
+        # When...
+        unchanged = view.values
+        provider.set_value('jwt.token', 'Bearer def')
+        # Then...
+        self.assertIs(record, unchanged)
+        self.assertEqual('Bearer abc', record.token)
+        self.assertEqual('Bearer def', view.token)
+        self.assertEqual('localhost', view.host)
+
+    def test_get_values_in_lazy_mode(self):
+        # Given...
+        provider = ConfigProvider(app_conf=self.app_conf_path, lazy=True)
+        # When...
+        values = provider.get_values({'redis': 'service.redis', 'token': 'jwt.token'})
+        # Then...
+        self.assertEqual({'host': 'localhost', 'port': 6379}, values.redis)
+        self.assertEqual('Bearer abc', values.token)
+
+
+class ConfigProviderVersionTest(ConfigProviderTestCase):
+
+    def test_set_value_publishes_a_new_version(self):
+        # Given...
+        provider = self._provider()
+        before = provider.settings
+        # When...
+        provider.set_value('service.redis.host', 'redis-host')
+        after = provider.settings
+        # Then...
+        self.assertEqual('localhost', before['service']['redis']['host'])
+        self.assertEqual('redis-host', after['service']['redis']['host'])
+        self.assertIs(before['jwt'], after['jwt'])
+        self.assertIs(before['service']['mysql'], after['service']['mysql'])
+        self.assertIs(after, provider.app_conf)
+
+    def test_versions_can_not_be_modified(self):
+        # Given...
+        provider = self._provider()
+        # When/Then...
+        with self.assertRaises(TypeError):
+            provider.settings['jwt']['token'] = 'changed'
+        with self.assertRaises(TypeError):
+            provider.get_value('merchants').append({})
+
+
+class ConfigProviderSnapshotTest(ConfigProviderTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self._write('commons.yaml', "signals:\n  - low_stock\n")
+        self.app_conf_path = self._write('config.yaml', APP_CONF + "commons: !include commons.yaml\n")
+        self.snapshot_path = os.path.join(self.tmp.name, 'snapshot.pickle')
+        os.environ['CONFIG_SNAPSHOT_PATH'] = self.snapshot_path
+
+    def test_snapshot_is_written_and_reused(self):
+        # Given...
+        provider = self._provider()
+        Singleton._instances.pop(ConfigProvider, None)
+        with open(self.snapshot_path, 'rb') as fp:
+            stored = pickle.load(fp)
+        stored['settings']['jwt']['token'] = 'From the snapshot'
+        snapshot.dump(self.snapshot_path, stored)
+        # When...
+        reloaded = self._provider()
+        # Then...
+        self.assertEqual(['low_stock'], provider.get_value('commons.signals'))
+        self.assertEqual(3, len(stored['files']))
+        self.assertEqual('From the snapshot', reloaded.get_value('jwt.token'))
+
+    def test_snapshot_is_invalidated_by_included_files(self):
+        # Given...
+        self._provider()
+        Singleton._instances.pop(ConfigProvider, None)
+        # When...
+        self._write('commons.yaml', "signals:\n  - out_of_stock\n  - submit_cart\n")
+        provider = self._provider()
+        # Then...
+        self.assertEqual(['out_of_stock', 'submit_cart'], provider.get_value('commons.signals'))
+
+    def test_cli_builds_a_valid_snapshot(self):
+        # When...
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            status = snapshot.main(['--app-conf', self.app_conf_path,
+                                    '--service-conf', self.service_conf_path,
+                                    self.snapshot_path])
+        # Then...
+        self.assertEqual(0, status)
+        self.assertIsNotNone(snapshot.load(self.snapshot_path, self.service_conf_path, self.app_conf_path))
+
+
+class ConfigProviderReloadTest(ConfigProviderTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self._write('redis.yaml', "host: 'localhost'\nport: 6379\n")
+        self._write('signals.yaml', "- low_stock\n")
+        self.app_conf_path = self._write('config.yaml', "service:\n"
+                                                        "  redis: !include redis.yaml\n"
+                                                        "  mysql:\n"
+                                                        "    port: 3306\n"
+                                                        "signals: !include signals.yaml\n")
+        self.service_conf_path = self._write('service_conf.yaml', "service.redis:\n"
+                                                                  "  class: 'meta.ioc.Importer'\n"
+                                                                  "  kwarguments:\n"
+                                                                  "    host: '%service.redis.host%'\n"
+                                                                  "service.store:\n"
+                                                                  "  class: 'meta.ioc.Importer'\n"
+                                                                  "  arguments: ['@service.redis']\n"
+                                                                  "service.mysql:\n"
+                                                                  "  class: 'meta.ioc.Importer'\n"
+                                                                  "  kwarguments:\n"
+                                                                  "    port: '%service.mysql.port%'\n")
+        os.environ['SERVICE_CONFIG_PATH'] = self.service_conf_path
+
+    def test_reload_swaps_changed_config_and_notifies(self):
+        # Given...
+        provider = ConfigProvider(app_conf=self.app_conf_path, reload=3600)
+        self.addCleanup(provider.stop_watching)
+        provider.service_classes = {'service.redis': object, 'service.store': object, 'service.mysql': object}
+        notified = []
+        provider.add_reload_listener(lambda p, services, files: notified.append(services))
+        # When...
+        path = self._write('redis.yaml', "host: 'redis.internal'\nport: 6379\n")
+        changed = provider._watcher.poll()
+        # Then...
+        self.assertEqual([path], changed)
+        self.assertEqual([{'service.redis', 'service.store'}], notified)
+        self.assertEqual('redis.internal', provider.get_value('service.redis.host'))
+        self.assertEqual(['low_stock'], provider.value('signals'))
+        self.assertEqual({'service.mysql': object}, provider.service_classes)
+
+    def test_failing_reload_listener(self):
+        # Given...
+        provider = ConfigProvider(app_conf=self.app_conf_path, reload=3600)
+        self.addCleanup(provider.stop_watching)
+        notified = []
+
+        def failing(p, services, files):
+            notified.append('failing')
+            raise RuntimeError('listener')
+
+        provider.add_reload_listener(failing)
+        provider.add_reload_listener(lambda p, services, files: notified.append('next'))
+        path = self._write('redis.yaml', "host: 'redis.internal'\nport: 6379\n")
+        # When...
+        with self.assertLogs('provider', 'ERROR'):
+            first = provider._watcher.poll()
+        second = provider._watcher.poll()
+        # Then...
+        self.assertEqual([path], first)
+        self.assertEqual([], second)
+        self.assertEqual(['failing', 'next'], notified)
+
+    def test_reload_only_parses_changed_files(self):
+        # Given...
+        provider = ConfigProvider(app_conf=self.app_conf_path, reload=3600)
+        self.addCleanup(provider.stop_watching)
+        opened = []
+        loader_init = Loader.__init__
+
+        def recording_init(loader, stream, includes=None):
+            opened.append(os.path.basename(stream.name))
+            loader_init(loader, stream, includes)
+        # When...
+        Loader.__init__ = recording_init
+        try:
+            provider.reload([self._write('redis.yaml', "host: 'other'\n")])
+        finally:
+            Loader.__init__ = loader_init
+        # Then...
+        self.assertEqual(['config.yaml', 'redis.yaml'], opened)
+        self.assertEqual(['low_stock'], provider.get_value('signals'))
+
+
+class ConfigProviderLazyTest(ConfigProviderTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self._write('ops.yaml', "- NOTIFY: 'ops'\n")
+        self.app_conf_path = self._write('config.yaml', APP_CONF + "ops: !include ops.yaml\n")
+
+    def test_sections_are_built_on_first_access(self):
+        # Given...
+        provider = ConfigProvider(app_conf=self.app_conf_path, lazy=True)
+        # When...
+        token = provider.get_value('jwt.token')
+        # Then...
+        self.assertEqual('Bearer abc', token)
+        self.assertIsInstance(provider.settings['jwt'], dict)
+        self.assertIs(LazyNode, type(provider.settings['service']))
+        self.assertIs(LazyNode, type(provider.settings['ops']))
+        self.assertEqual(1, len(provider.conf_files) - 1)
+
+    def test_reload_picks_up_includes_reached_lazily(self):
+        # Given...
+        provider = ConfigProvider(app_conf=self.app_conf_path, lazy=True, reload=3600)
+        self.addCleanup(provider.stop_watching)
+        before = provider.get_value('ops')
+        # When...
+        path = self._write('ops.yaml', "- NOTIFY: 'on-call'\n")
+        changed = provider._watcher.poll()
+        # Then...
+        self.assertEqual([{'NOTIFY': 'ops'}], before)
+        self.assertEqual([path], changed)
+        self.assertEqual([{'NOTIFY': 'on-call'}], provider.get_value('ops'))
+        self.assertIn(path, provider._watcher._stamps)
+
+    def test_returned_subtrees_are_fully_built(self):
+        # Given...
+        provider = ConfigProvider(app_conf=self.app_conf_path, lazy=True)
+        # When/Then...
+        self.assertEqual([{'NOTIFY': 'ops'}], provider.get_value('ops'))
+        self.assertEqual({'host': 'localhost', 'port': 6379}, provider.get_value('service.redis'))
+
+    def test_returned_subtrees_are_built_once_per_version(self):
+        # Given...
+        provider = ConfigProvider(app_conf=self.app_conf_path, lazy=True)
+        # When...
+        first = provider.get_value('service.redis')
+        second = provider.get_value('service.redis')
+        provider.set_value('service.redis.host', 'redis-host')
+        third = provider.get_value('service.redis')
+        # Then...
+        self.assertIs(first, second)
+        self.assertEqual({'host': 'redis-host', 'port': 6379}, third)
+        self.assertIs(provider.app_conf, provider._resolved_conf[0])
+        self.assertEqual({('service', ('redis',)): third}, provider._resolved_conf[1])
+
+    def test_query_builds_lazy_sections(self):
+        # Given...
+        provider = ConfigProvider(app_conf=self.app_conf_path, lazy=True)
+        # When/Then...
+        self.assertEqual(['ops'], provider.query('ops.*.NOTIFY'))
+
+    def test_value_and_set_value(self):
+        # Given...
+        provider = ConfigProvider(app_conf=self.app_conf_path, lazy=True)
+        # When...
+        provider.set_value('service.redis.host', 'redis-host')
+        # Then...
+        self.assertEqual('redis-host', provider.get_value('service.redis.host'))
+        self.assertEqual('ops', provider.value('NOTIFY'))
+        self.assertEqual('redis-host', provider.value('host'))
+
+    def test_prefork_builds_lazy_sections(self):
+        # Given...
+        provider = ConfigProvider(app_conf=self.app_conf_path, lazy=True)
+        # When...
+        try:
+            provider.prefork()
+        finally:
+            gc.unfreeze()
+        # Then...
+        self.assertNotIn(LazyNode, {type(section) for section in provider.settings.values()})
+        self.assertEqual('ops', provider.value('NOTIFY'))
+
+
+class ConfigProviderEnvironmentTest(ConfigProviderTestCase):
+
+    def test_prefixed_variables_override_settings(self):
+        # Given...
+        os.environ['APP__SERVICE__REDIS__PORT'] = '6380'
+        os.environ['APP__Service__Redis__Host'] = 'redis-host'
+        # When...
+        provider = self._provider()
+        # Then...
+        self.assertEqual(6380, provider.get_value('service.redis.port'))
+        self.assertEqual('redis-host', provider.get_value('service.redis.host'))
+        self.assertEqual('redis-host', provider.value('host'))
+
+    def test_refresh_env(self):
+        # Given...
+        provider = self._provider()
+        os.environ['APP__JWT__TOKEN'] = 'Bearer xyz'
+        # When...
+        before = provider.get_value('jwt.token')
+        provider.refresh_env()
+        # Then...
+        self.assertEqual('Bearer abc', before)
+        self.assertEqual('Bearer xyz', provider.get_value('jwt.token'))
+
+    def test_refresh_env_invalidates_affected_services(self):
+        # Given...
+        provider = self._provider()
+        provider.conf({'service.redis': {'class': 'meta.ioc.UndefinedError', 'scope': 'singleton',
+                                         'arguments': ['%service.redis.host%']},
+                       'service.mysql': {'class': 'meta.ioc.UndefinedError', 'scope': 'singleton',
+                                         'arguments': ['%service.mysql.config.host%']}}, provider.app_conf)
+        redis, mysql = provider.get('service.redis'), provider.get('service.mysql')
+        os.environ['APP__SERVICE__REDIS__HOST'] = 'redis-host'
+        # When...
+        services = provider.refresh_env()
+        # Then...
+        self.assertEqual({'service.redis'}, services)
+        self.assertEqual(('redis-host',), provider.get('service.redis').args)
+        self.assertIsNot(redis, provider.get('service.redis'))
+        self.assertIs(mysql, provider.get('service.mysql'))
+
+
+class ConfigProviderSingletonTest(ConfigProviderTestCase):
+
+    def test_reset_stops_watching(self):
+        # Given...
+        provider = ConfigProvider(app_conf=self.app_conf_path, reload=60)
+        watcher = provider._watcher
+        # When...
+        ConfigProvider.reset()
+        # Then...
+        watcher.join(1)
+        self.assertIsNone(provider._watcher)
+        self.assertFalse(watcher.is_alive())
+        self.assertIsNot(provider, self._provider())
+
+    def test_keyed_providers_coexist(self):
+        # Given...
+        other_path = self._write('other.yaml', "jwt:\n  token: 'Bearer other'\n")
+        # When...
+        try:
+            default = KeyedConfigProvider(app_conf=self.app_conf_path)
+            other = KeyedConfigProvider(app_conf=other_path)
+            # Then...
+            self.assertIs(default, KeyedConfigProvider(app_conf=self.app_conf_path))
+            self.assertEqual('Bearer abc', default.get_value('jwt.token'))
+            self.assertEqual('Bearer other', other.get_value('jwt.token'))
+            self.assertEqual({os.path.abspath(self.app_conf_path), os.path.abspath(other_path)},
+                             set(KeyedConfigProvider.instances()))
+        finally:
+            KeyedConfigProvider.reset()
+
+
+if __name__ == '__main__':
+    unittest.main()
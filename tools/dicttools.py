@@ -1,13 +1,21 @@
+import fnmatch
+import re
+from bisect import bisect_left
+from functools import lru_cache
+from hashlib import blake2b
 
 
 def dictpath(dictionary: dict, path: list):
     """
     Find the node within a dictionary described by the path list.
     """
-    if not path or type(dictionary) != dict:
-        return dictionary
-    else:
-        return dictpath(dictionary[path.pop(0)], path)
+    node = dictionary
+    for key in path:
+        if type(node) != dict:
+            break
+        node = node[key]
+
+    return node
 
 
 def dictiter(arg):
@@ -19,27 +27,648 @@ def dictiter(arg):
         raise TypeError("Not iterable as dictionary.")
 
 
-def dictwalk(arg, func: callable, path: tuple = None):
+def dictwalk(arg, func: callable, path: tuple = None, want_path: bool = True):
+    """
+    Replace every leaf of a document, depth first and in order, with
+    func(key, value, path). Without want_path, func gets None for a path, and
+    no path tuple is built at all.
+    """
+    if type(arg) not in (list, dict):
+        raise TypeError("Not walkable as dictionary.")
+
     if path is None:
         path = ()
 
-    if type(arg) in (list, dict):
-        for k, v in dictiter(arg):
-            loop_path = path + (k,)
+    # One (container, items iterator, path) frame per container being walked.
+    stack = [(arg, dictiter(arg), path)]
+    push, pop = stack.append, stack.pop
+
+    if not want_path:
+        while stack:
+            node, items, _ = stack[-1]
+            for k, v in items:
+                if type(v) is dict:
+                    push((v, iter(v.items()), None))
+                    break
+                elif type(v) is list:
+                    push((v, enumerate(v), None))
+                    break
 
-            if type(v) in (list, dict):
-                dictwalk(v, func, loop_path)
+                node[k] = func(k, v, None)
             else:
-                arg[k] = func(k, v, loop_path)
-    else:
+                pop()
+        return
+
+    while stack:
+        node, items, node_path = stack[-1]
+        for k, v in items:
+            if type(v) is dict:
+                push((v, iter(v.items()), node_path + (k,)))
+                break
+            elif type(v) is list:
+                push((v, enumerate(v), node_path + (k,)))
+                break
+
+            node[k] = func(k, v, node_path + (k,))
+        else:
+            pop()
+
+
+def dictleaves(arg, want_path: bool = True, keys: set = None, where: callable = None, descend: callable = None,
+               branches: bool = False):
+    """
+    Lazily yield (path, key, value) for every leaf of a document, depth first
+    and in order, without modifying it.
+
+    Only the given keys are yielded, and of those only what where(key, value,
+    path) accepts; descend(key, value, path) decides whether a nested dict or
+    list is walked into at all. With branches, the dicts and lists themselves
+    are yielded too, before their contents. Without want_path, path is None and
+    no path tuple is built. Stop iterating to stop the walk.
+    """
+    if not isinstance(arg, (dict, list)):
         raise TypeError("Not walkable as dictionary.")
 
+    stack = [(dictiter(arg), () if want_path else None)]
+    while stack:
+        items, node_path = stack[-1]
+        for k, v in items:
+            path = node_path + (k,) if want_path else None
+
+            if isinstance(v, (dict, list)):
+                if branches and (keys is None or k in keys) and (where is None or where(k, v, path)):
+                    yield path, k, v
+                if descend is None or descend(k, v, path):
+                    stack.append((iter(v.items()) if isinstance(v, dict) else enumerate(v), path))
+                    break
+            elif (keys is None or k in keys) and (where is None or where(k, v, path)):
+                yield path, k, v
+        else:
+            stack.pop()
+
+
+ADD, REMOVE, REPLACE = 'add', 'remove', 'replace'
+
+# Marks the operations queued among the subtrees dictdiff() still has to compare.
+_EMIT = object()
+
+
+def dictdiff(a, b) -> list:
+    """
+    The operations turning document a into document b, as (op, path, value)
+    tuples for dictpatch() to apply in order: add (a new key, or an item
+    inserted into a list), remove (value None) and replace.
+
+    Values are compared with ==, as documents are, but subtrees shared by both
+    (a is b) are skipped without a look. List items are matched by their
+    content, so that inserting or removing one does not replace every item
+    after it.
+    """
+    ops = []
+    stack = [(a, b, ())]
+
+    while stack:
+        a, b, path = stack.pop()
+        if a is _EMIT:
+            ops.append(b)
+            continue
+
+        tasks = []
+        if isinstance(a, dict) and isinstance(b, dict):
+            _diff_dict(a, b, path, tasks)
+        elif isinstance(a, list) and isinstance(b, list):
+            _diff_list(a, b, path, tasks)
+        elif a != b:
+            tasks.append((_EMIT, (REPLACE, path, b), None))
+
+        stack.extend(reversed(tasks))
+
+    return ops
+
+
+def _diff_dict(a: dict, b: dict, path: tuple, tasks: list):
+    for k, va in a.items():
+        if k not in b:
+            tasks.append((_EMIT, (REMOVE, path + (k,), None), None))
+            continue
+
+        vb = b[k]
+        if va is vb:
+            continue
+        elif isinstance(va, (dict, list)) or isinstance(vb, (dict, list)):
+            tasks.append((va, vb, path + (k,)))
+        elif va != vb:
+            tasks.append((_EMIT, (REPLACE, path + (k,), vb), None))
+
+    for k, vb in b.items():
+        if k not in a:
+            tasks.append((_EMIT, (ADD, path + (k,), vb), None))
+
+
+def _diff_list(a: list, b: list, path: tuple, tasks: list):
+    # Items left alone at both ends need no hashing.
+    start, a_end, b_end = 0, len(a), len(b)
+    while start < a_end and start < b_end and a[start] is b[start]:
+        start += 1
+    while a_end > start and b_end > start and a[a_end - 1] is b[b_end - 1]:
+        a_end, b_end = a_end - 1, b_end - 1
+
+    # Match the items in between by hash, in order: each item of a takes the
+    # first item of b with the same hash after the last one matched.
+    positions = {}
+    for index in range(start, b_end):
+        positions.setdefault(_hash(b[index]), []).append(index)
+
+    matches, after = [], start
+    for index in range(start, a_end):
+        candidates = positions.get(_hash(a[index]), ())
+        at = bisect_left(candidates, after)
+        if at < len(candidates):
+            matches.append((index, candidates[at]))
+            after = candidates[at] + 1
+    matches.append((a_end, b_end))
+
+    # Ops are applied in turn, so each one's index is where b's item goes once
+    # the items before it are in place.
+    a_index = b_index = start
+    for a_match, b_match in matches:
+        paired = min(a_match - a_index, b_match - b_index)
+        for offset in range(paired):
+            # Changed in place, like a cart item whose quantity changed.
+            tasks.append((a[a_index + offset], b[b_index + offset], path + (b_index + offset,)))
+        for _ in range(a_match - a_index - paired):
+            tasks.append((_EMIT, (REMOVE, path + (b_index + paired,), None), None))
+        for offset in range(paired, b_match - b_index):
+            tasks.append((_EMIT, (ADD, path + (b_index + offset,), b[b_index + offset]), None))
+
+        if a_match < a_end and a[a_match] is not b[b_match] and a[a_match] != b[b_match]:
+            # Same hash, different content deeper down: compare them.
+            tasks.append((a[a_match], b[b_match], path + (b_match,)))
+        a_index, b_index = a_match + 1, b_match + 1
+
+
+def _hash(value) -> int:
+    """
+    A hash of a value's content one level deep, nested dicts and lists counting
+    by their size only: enough to pair list items up, cheap on large items.
+    """
+    if isinstance(value, dict):
+        return hash(frozenset((k, _shallow_hash(v)) for k, v in value.items()))
+    elif isinstance(value, list):
+        return hash(tuple(_shallow_hash(v) for v in value))
+
+    return _shallow_hash(value)
+
+
+def _shallow_hash(value) -> int:
+    if isinstance(value, (dict, list)):
+        return hash((type(value), len(value)))
+
+    try:
+        return hash((type(value), value))
+    except TypeError:
+        return hash((type(value), repr(value)))
+
+
+def dictpatch(document, ops: list):
+    """
+    Apply dictdiff() operations to a document, returning the patched version.
+
+    Only the dicts and lists along the changed paths are copied, once each and
+    keeping their type, frozen ones included; the document is left untouched
+    and shares every other subtree with the result.
+    """
+    # The document sits in a holder so that it is copied like any other node.
+    holder = [document]
+    copies = {id(holder): holder}
+
+    for op, path, value in ops:
+        node, key = holder, 0
+        for part in path:
+            child = node[key]
+            if id(child) not in copies:
+                child = type(child)(child)
+                copies[id(child)] = child
+                (dict if isinstance(node, dict) else list).__setitem__(node, key, child)
+            node, key = child, part
+
+        if isinstance(node, dict):
+            if op == REMOVE:
+                dict.__delitem__(node, key)
+            else:
+                dict.__setitem__(node, key, value)
+        elif op == ADD:
+            list.insert(node, key, value)
+        elif op == REMOVE:
+            list.__delitem__(node, key)
+        else:
+            list.__setitem__(node, key, value)
+
+    return holder[0]
+
+
+DIGEST_SIZE = 16
+UNSTABLE_VALUE_ERRMSG = "Can not digest a {} in a stable way: its repr may change from one process to the next."
+
+
+class UnstableValueError(TypeError):
+    """ A value dicthash() can not digest the same way in every process """
+
 
 def dictsort(arg):
-    def sort_lists(k, v, path):
-        if isinstance(k, list):
-            return sorted(v)
+    """
+    Sort every list of a document in place, innermost first, and return it.
+
+    Lists of comparable values are sorted by value; others, like lists of dicts
+    or of mixed types, by type name and then by the digest dicthash() gives
+    each item, so that equal documents always end up in the same order.
+
+    Frozen documents can not be sorted in place and raise FrozenError: compare
+    them with dicthash(canonical=True) instead, or sort a thawed copy.
+    """
+    _canonical(arg, sort=True)
+    return arg
 
-        return v
 
-    return dictwalk(arg, sort_lists)
+def dicthash(arg, canonical: bool = False) -> str:
+    """
+    A digest of a document's content, stable across processes and runs.
+
+    Key order never matters; list order does, unless canonical, which hashes
+    every list as if sorted first. Values are told apart by their repr, so 1,
+    1.0, True and "1" all differ. Besides dicts and lists, documents may hold
+    strings, bytes, numbers, booleans, None, and tuples, sets and frozensets of
+    those; anything else raises UnstableValueError, as its repr may change from
+    one process to the next.
+
+    Digesting each container on its own is three to four times slower than
+    digesting json.dumps(sort_keys=True), but it keeps memory flat instead of
+    serializing the whole document, and it does not need string keys.
+    """
+    return _canonical(arg, canonical=canonical).hex()
+
+
+def _canonical(arg, sort: bool = False, canonical: bool = False) -> bytes:
+    """
+    Walk a document once, children before their parents, sorting its lists if
+    told to and digesting every dict and list from its items: scalars as they
+    are, nested dicts and lists by their own digest (as bytes).
+    """
+    if not isinstance(arg, (dict, list)):
+        return blake2b(repr(('v', _scalar(arg))).encode(), digest_size=DIGEST_SIZE).digest()
+
+    # One [container, values, positions of nested containers, next one] frame per container being walked.
+    stack = [_frame(arg)]
+    while True:
+        frame = stack[-1]
+        nested, at = frame[2], frame[3]
+        if at < len(nested):
+            frame[3] = at + 1
+            child = _frame(frame[1][nested[at]])
+            if child[2]:
+                stack.append(child)
+            else:
+                frame[1][nested[at]] = _digest(child, sort, canonical)
+            continue
+
+        stack.pop()
+        digest = _digest(frame, sort, canonical)
+        if not stack:
+            return digest
+
+        parent = stack[-1]
+        parent[1][parent[2][parent[3] - 1]] = digest
+
+
+def _frame(node) -> list:
+    values = list(node.values()) if isinstance(node, dict) else list(node)
+    nested = []
+    for i, value in enumerate(values):
+        if isinstance(value, (dict, list)):
+            nested.append(i)
+        elif not isinstance(value, _PLAIN):
+            values[i] = _scalar(value)
+    return [node, values, nested, 0]
+
+
+_PLAIN = (str, bytes, int, float, type(None))  # Their repr is the same in every process.
+
+
+def _scalar(value):
+    """
+    A stand-in for a value, with the same repr in every process: plain values as
+    they are, tuples, sets and frozensets tagged with their type, set items
+    sorted by repr (which depends on PYTHONHASHSEED otherwise).
+    """
+    if isinstance(value, _PLAIN):
+        return value
+    elif isinstance(value, tuple):
+        return 'tuple', tuple(_scalar(item) for item in value)
+    elif isinstance(value, (set, frozenset)):
+        return type(value).__name__, tuple(sorted((_scalar(item) for item in value), key=repr))
+
+    raise UnstableValueError(UNSTABLE_VALUE_ERRMSG.format(type(value).__name__))
+
+
+def _digest(frame: list, sort: bool, canonical: bool) -> bytes:
+    node, values = frame[0], frame[1]
+    if isinstance(node, dict):
+        try:
+            entries = 'd', sorted(zip(node, values))
+        except TypeError:
+            # Keys of different types: order them by repr.
+            entries = 'd', sorted(zip(map(repr, node), values))
+    elif sort:
+        _sort_list(node, values)
+        entries = 'l', values
+    else:
+        entries = 'l', sorted(values, key=repr) if canonical else values
+
+    return blake2b(repr(entries).encode(), digest_size=DIGEST_SIZE).digest()
+
+
+def _sort_list(node: list, digested: list):
+    """
+    Sort a list and the items digested for it alike.
+    """
+    # Sets compare by inclusion, which is no order at all.
+    if not any(isinstance(item, (dict, list, set, frozenset)) for item in node):
+        try:
+            node.sort()
+            digested[:] = [item if isinstance(item, _PLAIN) else _scalar(item) for item in node]
+            return
+        except TypeError:
+            pass
+
+    order = sorted(range(len(node)), key=lambda index: (type(node[index]).__name__, repr(digested[index])))
+    node[:], digested[:] = [node[index] for index in order], [digested[index] for index in order]
+
+
+_DICT_ITEMS = type(iter({}.items()))
+
+
+class BadQueryError(ValueError):
+    """ A path query that cannot be compiled """
+
+
+class PathQuery():
+    """
+    A path query compiled into its steps, matched against documents by find().
+
+    Queries are dotted paths whose parts are matched against keys in turn: a
+    plain key, an index into a list (0 or [0]), * for any one key, ** for any
+    number of them, none included, or a pattern with * and ? wildcards
+    (REDIS_DB_*). Queries given as a list of parts may also use callables,
+    matching the keys they return True for.
+    """
+
+    EMPTY_PART_ERRMSG = "Empty part in path query: {}"
+    BAD_INDEX_ERRMSG = "Bad list index in path query: {}"
+
+    __slots__ = ('query', 'steps', '_cache', '_deep_key')
+
+    # Step kinds, the first two matched by looking keys up rather than iterating.
+    KEY, INDEX, ANY, DEEP, PATTERN, PREDICATE = range(6)
+
+    def __init__(self, query):
+        self.query = query
+        self.steps = tuple(self._compile_part(part) for part in self._split(query))
+        self._cache = {}
+        # **.<key> is common enough to get a walk of its own.
+        deep_key = len(self.steps) == 2 and self.steps[0][0] == self.DEEP and self.steps[1][0] == self.KEY
+        self._deep_key = self.steps[1][1] if deep_key else None
+
+    def find(self, document, want_path: bool = True):
+        """
+        Lazily yield (path, value) for every node matching the query, depth first,
+        only walking into what may still match. Siblings come in document order,
+        except where only exact keys are left to match: those are looked up, and
+        come in the order the query names them. Without want_path, path is None.
+        """
+        if self._deep_key is not None:
+            yield from self._find_deep_key(document, want_path)
+            return
+
+        end = len(self.steps)
+        states = self._expand({0})
+        path = () if want_path else None
+        if end in states:
+            yield path, document
+        if not isinstance(document, (dict, list)):
+            return
+
+        # One (children, path, transitions) frame per container being walked.
+        cache = self._cache
+        stack = [(self._children(document, states), path, self._transitions(states))]
+        push, pop = stack.append, stack.pop
+        while stack:
+            children, node_path, (exact, default, dynamic) = stack[-1]
+            for key, value in children:
+                states = exact.get(key, default)
+                if dynamic:
+                    states = self._advance(dynamic, key, states)
+                if not states:
+                    continue
+
+                path = node_path + (key,) if want_path else None
+                if end in states:
+                    yield path, value
+
+                if isinstance(value, (dict, list)):
+                    transitions = cache.get(states) or self._transitions(states)
+                    if transitions[1] is not None:
+                        push((iter(value.items()) if isinstance(value, dict) else enumerate(value), path, transitions))
+                        break
+                    elif transitions[0]:
+                        push((self._children(value, states), path, transitions))
+                        break
+            else:
+                pop()
+
+    def values(self, document) -> list:
+        if self._deep_key is not None:
+            return self._deep_key_values(document)
+        return [value for _, value in self.find(document, want_path=False)]
+
+    def _find_deep_key(self, document, want_path: bool):
+        """
+        find() for **.<key>: every key is compared with the one wanted and every
+        container walked into, with no steps to keep track of.
+        """
+        if not want_path:
+            yield from ((None, value) for value in self._deep_key_values(document))
+            return
+        if not isinstance(document, (dict, list)):
+            return
+
+        wanted = self._deep_key
+        stack = [(dictiter(document), ())]
+        push, pop = stack.append, stack.pop
+        while stack:
+            children, node_path = stack[-1]
+            for key, value in children:
+                if key == wanted:
+                    yield node_path + (key,), value
+                if isinstance(value, (dict, list)):
+                    push((dictiter(value), node_path + (key,)))
+                    break
+            else:
+                pop()
+
+    def _deep_key_values(self, document) -> list:
+        """
+        The values of **.<key>, walking lists without their indices, which never
+        match a key, and scanning lists of scalars without a frame of their own.
+        """
+        wanted = self._deep_key
+        found = []
+        append = found.append
+        stack = [iter((document,))]
+        push, pop = stack.append, stack.pop
+        while stack:
+            children = stack[-1]
+            if type(children) is not _DICT_ITEMS:
+                for value in children:
+                    if isinstance(value, (dict, list)):
+                        push(iter(value.items()) if isinstance(value, dict) else iter(value))
+                        break
+                else:
+                    pop()
+                continue
+
+            for key, value in children:
+                if key == wanted:
+                    append(value)
+                if isinstance(value, dict):
+                    push(iter(value.items()))
+                    break
+                elif isinstance(value, list):
+                    items = iter(value)
+                    for item in items:
+                        if isinstance(item, (dict, list)):
+                            push(items)
+                            push(iter(item.items()) if isinstance(item, dict) else iter(item))
+                            break
+                    else:
+                        continue
+                    break
+            else:
+                pop()
+
+        return found
+
+    def _children(self, node, states: frozenset):
+        exact, default, _ = self._transitions(states)
+        if default is not None:
+            return dictiter(node)
+
+        # Only exact keys left to match: look them up rather than iterate.
+        if isinstance(node, dict):
+            return ((key, node[key]) for key in exact if key in node)
+
+        return ((key, node[key]) for key in exact if type(key) is int and key < len(node))
+
+    def _transitions(self, states: frozenset) -> tuple:
+        """
+        What matching a key leads to from the given steps: the steps each exact
+        key leads to, those any other key leads to (None when nothing else
+        matches), and the pattern and predicate steps to try on top of them.
+        Computed once per set of steps.
+        """
+        try:
+            return self._cache[states]
+        except KeyError:
+            pass
+
+        default, dynamic, keyed = set(), [], {}
+        for i in states:
+            if i == len(self.steps):
+                continue
+            kind, arg = self.steps[i]
+            if kind == self.DEEP:
+                default.add(i)
+            elif kind == self.ANY:
+                default.add(i + 1)
+            elif kind == self.KEY:
+                keyed.setdefault(arg, set()).add(i + 1)
+            elif kind == self.INDEX:
+                # Indices match list positions and the dict keys spelling them alike.
+                keyed.setdefault(arg, set()).add(i + 1)
+                keyed.setdefault(str(arg), set()).add(i + 1)
+            else:
+                dynamic.append(i)
+
+        exact = {key: self._expand(default | next_states) for key, next_states in keyed.items()}
+        transitions = exact, (self._expand(default) if default or dynamic else None), tuple(dynamic)
+        self._cache[states] = transitions
+        return transitions
+
+    def _advance(self, dynamic: tuple, key, next_states: frozenset) -> frozenset:
+        matched = {i + 1 for i in dynamic
+                   if (self.steps[i][0] == self.PATTERN and type(key) is str and self.steps[i][1].match(key))
+                   or (self.steps[i][0] == self.PREDICATE and self.steps[i][1](key))}
+
+        return self._expand(matched | next_states) if matched else next_states
+
+    def _expand(self, states: set) -> frozenset:
+        """
+        Add the steps reached by matching ** against no key at all.
+        """
+        for i in sorted(states):
+            while i < len(self.steps) and self.steps[i][0] == self.DEEP:
+                i += 1
+                states.add(i)
+
+        return frozenset(states)
+
+    def _split(self, query) -> list:
+        if not isinstance(query, str):
+            return list(query)
+
+        parts = []
+        for part in query.split('.'):
+            # Indices may follow a key: arguments[0][1]
+            key, _, indices = part.partition('[')
+            parts.append(key if key or not indices else None)
+            if indices:
+                parts.extend(f'[{index}' for index in indices.split('['))
+
+        return [part for part in parts if part is not None]
+
+    def _compile_part(self, part) -> tuple:
+        if callable(part):
+            return self.PREDICATE, part
+        elif type(part) is int:
+            return self.INDEX, part
+        elif not isinstance(part, str) or not part:
+            raise BadQueryError(self.EMPTY_PART_ERRMSG.format(self.query))
+        elif part == '**':
+            return self.DEEP, None
+        elif part == '*':
+            return self.ANY, None
+        elif part[:1] == '[':
+            if part[-1:] != ']' or not part[1:-1].isdigit():
+                raise BadQueryError(self.BAD_INDEX_ERRMSG.format(self.query))
+            return self.INDEX, int(part[1:-1])
+        elif part.isdigit():
+            return self.INDEX, int(part)
+        elif '*' in part or '?' in part:
+            return self.PATTERN, re.compile(fnmatch.translate(part))
+
+        return self.KEY, part
+
+
+@lru_cache(maxsize=256)
+def compile_query(query: str) -> PathQuery:
+    """
+    Compile a path query once, handing the same PathQuery to every caller.
+    """
+    return PathQuery(query)
+
+
+def dictquery(document, query, want_path: bool = True):
+    """
+    Lazily yield (path, value) for every node of a document matching a path query.
+    """
+    query = compile_query(query) if isinstance(query, str) else PathQuery(query)
+    return query.find(document, want_path)
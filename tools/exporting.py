@@ -11,19 +11,24 @@ class CsvParser():
     BAD_ROW_ERRMSG = 'All rows need to have the same amount of columns as the headers.'
 
     def dump(self, headers: tuple, rows: tuple, separator: str = SEPARATOR, wrapper: str = None) -> str:
-        if not len(rows):
-            return ''
+        return "\n".join(self.iter_lines(headers, rows, separator, wrapper))
 
+    def iter_lines(self, headers: tuple, rows, separator: str = SEPARATOR, wrapper: str = None):
+        """
+        Yield the lines dump() joins, one row at a time: rows can be any iterable, a generator included.
+        """
         column_count = len(headers)
-        lines = [self._join_row(headers, separator, wrapper)]
+        header = self._join_row(headers, separator, wrapper)
 
         for row in rows:
+            if header is not None:
+                yield header
+                header = None
+
             if len(row) != column_count:
                 raise BadRowError(self.BAD_ROW_ERRMSG)
 
-            lines.append(self._join_row(row, separator, wrapper))
-
-        return "\n".join(lines)
+            yield self._join_row(row, separator, wrapper)
 
     @classmethod
     def _join_row(cls, row: tuple, separator: str, wrapper: str = None):
@@ -0,0 +1,68 @@
+import copy
+import threading
+
+_UNSET = object()
+
+
+class LazyNode():
+    """
+    Placeholder for a subtree of a document that is only built on first access.
+    """
+
+    __slots__ = ('_build', '_value', '_lock')
+
+    def __init__(self, build: callable, lock: threading.RLock = None):
+        self._build = build
+        self._value = _UNSET
+        self._lock = lock or threading.RLock()
+
+    @property
+    def resolved(self) -> bool:
+        return self._value is not _UNSET
+
+    def resolve(self):
+        if self._value is _UNSET:
+            with self._lock:
+                if self._value is _UNSET:
+                    value = self._build()
+                    while type(value) is LazyNode:
+                        value = value.resolve()
+                    self._value = value
+                    self._build = None
+
+        return self._value
+
+    def __deepcopy__(self, memo: dict):
+        return LazyNode(lambda: copy.deepcopy(self.resolve()))
+
+    def __repr__(self):
+        return f'LazyNode({self._value!r})' if self.resolved else 'LazyNode(<unresolved>)'
+
+
+def materialize(arg):
+    """
+    Resolve every LazyNode within a document, replacing them in place.
+    """
+    if type(arg) is LazyNode:
+        arg = arg.resolve()
+
+    stack = [arg]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            items = node.items()
+        elif isinstance(node, list):
+            items = enumerate(node)
+        else:
+            continue
+
+        # Replacing a placeholder by what it stands for is allowed in frozen containers too.
+        setitem = dict.__setitem__ if isinstance(node, dict) else list.__setitem__
+        for k, v in list(items):
+            if type(v) is LazyNode:
+                v = v.resolve()
+                setitem(node, k, v)
+            if isinstance(v, (dict, list)):
+                stack.append(v)
+
+    return arg
@@ -0,0 +1,93 @@
+from tools.lazy import LazyNode
+
+
+class FrozenError(TypeError):
+    pass
+
+
+def _frozen(self, *args, **kwargs):
+    raise FrozenError(f'{type(self).__name__} can not be modified, derive a new version with assoc_in().')
+
+
+class FrozenDict(dict):
+    """
+    A dict that can not be modified once built.
+
+    Being a dict, it is accepted anywhere a document is (json, isinstance checks,
+    dicttools); new versions are derived with assoc_in(), sharing every subtree
+    they do not change.
+    """
+
+    __slots__ = ()
+
+    __setitem__ = __delitem__ = _frozen
+    clear = pop = popitem = setdefault = update = _frozen
+    __ior__ = _frozen
+
+    def __reduce__(self):
+        return self.__class__, (dict(self),)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo: dict):
+        return self
+
+
+class FrozenList(list):
+    """
+    A list that can not be modified once built.
+    """
+
+    __slots__ = ()
+
+    __setitem__ = __delitem__ = _frozen
+    append = extend = insert = pop = remove = reverse = sort = clear = _frozen
+    __iadd__ = __imul__ = _frozen
+
+    def __reduce__(self):
+        return self.__class__, (list(self),)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo: dict):
+        return self
+
+
+def freeze(arg):
+    """
+    Deeply convert dicts and lists into their frozen counterparts. Frozen values
+    are returned as they are, and LazyNodes freeze what they resolve to.
+    """
+    if type(arg) in (FrozenDict, FrozenList):
+        return arg
+    elif isinstance(arg, dict):
+        return FrozenDict((k, freeze(v)) for k, v in arg.items())
+    elif isinstance(arg, list):
+        return FrozenList(freeze(v) for v in arg)
+    elif type(arg) is LazyNode:
+        return LazyNode(lambda: freeze(arg.resolve()))
+
+    return arg
+
+
+def assoc_in(root: dict, path: list, value) -> FrozenDict:
+    """
+    Return a new version of root with value set at path, creating missing levels.
+
+    Only the dicts along the path are copied; every other subtree is shared
+    with root, which is left untouched.
+    """
+    if not path:
+        return freeze(value)
+    elif not isinstance(root, dict):
+        raise TypeError(f'Can not set "{path[0]}" within a {type(root).__name__}.')
+
+    child = root.get(path[0], {})
+    if type(child) is LazyNode:
+        child = child.resolve()
+
+    node = dict(root)
+    node[path[0]] = assoc_in(child, path[1:], value)
+    return FrozenDict(node)
@@ -0,0 +1,87 @@
+"""
+dictdiff and dictpatch on a large document of carts (about 10 MB as JSON)
+against comparing it by hand: a == b, and a recursive diff matching list items
+by position. The edited copy is a deep copy with a few changes, one of them an
+item inserted at the head of a list; the shared one makes the same changes
+copying only what they touch, as assoc_in() does.
+
+    python -m tools.tests.bench_dictdiff [carts]
+"""
+import copy
+import json
+import sys
+import time
+
+from tools.dicttools import dictdiff, dictpatch
+
+
+def positional_diff(a, b, path: tuple = ()) -> list:
+    if isinstance(a, dict) and isinstance(b, dict):
+        ops = []
+        for k in a.keys() | b.keys():
+            if k not in b:
+                ops.append(('remove', path + (k,), None))
+            elif k not in a:
+                ops.append(('add', path + (k,), b[k]))
+            else:
+                ops.extend(positional_diff(a[k], b[k], path + (k,)))
+        return ops
+    elif isinstance(a, list) and isinstance(b, list):
+        ops = []
+        for index in range(max(len(a), len(b))):
+            if index >= len(b):
+                ops.append(('remove', path + (index,), None))
+            elif index >= len(a):
+                ops.append(('add', path + (index,), b[index]))
+            else:
+                ops.extend(positional_diff(a[index], b[index], path + (index,)))
+        return ops
+
+    return [] if a == b else [('replace', path, b)]
+
+
+def carts(count: int) -> dict:
+    return {'carts': [{'id': cart, 'customer': {'name': f'customer {cart}', 'zip': f'{cart % 99999:05}'},
+                       'items': [{'sku': f'sku-{cart}-{item}', 'quantity': item % 3 + 1, 'price': 9.99 + item,
+                                  'tags': ['wine', 'red'] if item % 2 else ['beer']}
+                                 for item in range(10)]}
+                      for cart in range(count)]}
+
+
+def edit(document: dict, shared: bool) -> dict:
+    def cart(index: int) -> dict:
+        edited = dict(document['carts'][index]) if shared else document['carts'][index]
+        edited['items'] = list(edited['items']) if shared else edited['items']
+        document['carts'][index] = edited
+        return edited
+
+    document = dict(document, carts=list(document['carts'])) if shared else copy.deepcopy(document)
+    cart(10)['items'][3] = dict(document['carts'][10]['items'][3], quantity=7)
+    cart(20)['items'].pop(0)
+    document['carts'].insert(0, {'id': -1, 'customer': {'name': 'new', 'zip': '00000'}, 'items': []})
+    return document
+
+
+def measure(run: callable) -> tuple:
+    started = time.perf_counter()
+    result = run()
+    return time.perf_counter() - started, result
+
+
+def main(argv: list):
+    document = carts(int(argv[0]) if argv else 12000)
+    print(f'{len(json.dumps(document)) / 1e6:.1f} MB, seconds (operations)')
+    print(f"{'':<10}{'a == b':>10}{'positional':>20}{'dictdiff':>20}{'dictpatch':>12}")
+    for name, shared in (('edited', False), ('shared', True)):
+        edited = edit(document, shared)
+        equal, _ = measure(lambda: document == edited)
+        positional, positional_ops = measure(lambda: positional_diff(document, edited))
+        diffed, ops = measure(lambda: dictdiff(document, edited))
+        patched, result = measure(lambda: dictpatch(document, ops))
+        assert result == edited
+        print(f'{name:<10}{equal:>10.3f}{positional:>10.3f} ({len(positional_ops):>6})'
+              f'{diffed:>10.3f} ({len(ops):>6}){patched:>12.4f}')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
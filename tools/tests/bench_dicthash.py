@@ -0,0 +1,47 @@
+"""
+dicthash against digesting the canonical JSON of a document (json.dumps with
+sorted keys), in time and peak memory, and dictsort, on a large document of
+carts (about 10 MB as JSON).
+
+    python -m tools.tests.bench_dicthash [carts]
+"""
+import json
+import sys
+import time
+import tracemalloc
+from hashlib import blake2b
+
+from tools.dicttools import dicthash, dictsort
+from tools.tests.bench_dictdiff import carts
+
+
+def json_hash(document) -> str:
+    return blake2b(json.dumps(document, sort_keys=True).encode(), digest_size=16).hexdigest()
+
+
+def measure(run: callable) -> str:
+    started = time.perf_counter()
+    run()
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return f'{elapsed:>10.3f}{peak / 1e6:>10.1f}'
+
+
+def main(argv: list):
+    document = carts(int(argv[0]) if argv else 12000)
+    print(f'{len(json.dumps(document)) / 1e6:.1f} MB, seconds and peak MB')
+    print(f"{'':<24}{'seconds':>10}{'peak MB':>10}")
+    for name, run in (('json + blake2b', lambda: json_hash(document)),
+                      ('dicthash', lambda: dicthash(document)),
+                      ('dicthash canonical', lambda: dicthash(document, canonical=True)),
+                      ('dictsort', lambda: dictsort(document))):
+        print(f'{name:<24}{measure(run)}')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,59 @@
+"""
+Path queries against the recursive key search of ConfigProvider.locate_value(),
+on a configuration of many sections: a pruned query (service.*.host), an exact
+one (section_0.key_0.name) and one over the whole tree (**.port). The last one
+visits every node, as locate_value() does, so it can not win by pruning: a
+speedup below 1 is a slowdown.
+
+    python -m tools.tests.bench_dictquery [sections] [keys_per_section]
+"""
+import sys
+import timeit
+
+from tools.dicttools import compile_query
+
+
+def locate_value(search_dict, field):
+    fields_found = []
+
+    for key, value in search_dict.items():
+        if key == field:
+            fields_found.append(value)
+        elif isinstance(value, dict):
+            fields_found.extend(locate_value(value, field))
+        elif isinstance(value, list):
+            for item in value:
+                if isinstance(item, dict):
+                    fields_found.extend(locate_value(item, field))
+
+    return fields_found
+
+
+def config(sections: int, keys: int) -> dict:
+    document = {f'section_{section}': {f'key_{key}': {'name': f'value {key}', 'port': key, 'limits': [1, 2, 3]}
+                                       for key in range(keys)}
+                for section in range(sections)}
+    document['service'] = {'mysql': {'host': 'db', 'port': 3306}, 'redis': {'host': 'localhost', 'port': 6379}}
+    return document
+
+
+def measure(run: callable, number: int) -> float:
+    return timeit.timeit(run, number=number) / number * 1000
+
+
+def main(argv: list):
+    sections = int(argv[0]) if argv else 100
+    keys = int(argv[1]) if len(argv) > 1 else 1000
+    document = config(sections, keys)
+
+    print(f'{sections} sections of {keys} keys, milliseconds per search')
+    print(f"{'query':<24}{'locate_value':>14}{'query':>14}{'speedup':>10}")
+    for query, field in (('service.*.host', 'host'), ('section_0.key_0.name', 'name'), ('**.port', 'port')):
+        compiled = compile_query(query)
+        located = measure(lambda: locate_value(document, field), 5)
+        queried = measure(lambda: compiled.values(document), 5)
+        print(f'{query:<24}{located:>14.3f}{queried:>14.3f}{located / queried:>9.2f}x')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
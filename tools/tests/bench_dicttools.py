@@ -0,0 +1,80 @@
+"""
+dictpath and dictwalk against their former recursive versions, on a wide
+document (one dict of many keys) and a deep one (nested dicts).
+
+    python -m tools.tests.bench_dicttools [wide_keys] [deep_levels]
+"""
+import sys
+import timeit
+
+from tools.dicttools import dictiter, dictpath, dictwalk
+
+
+def recursive_dictpath(dictionary: dict, path: list):
+    if not path or type(dictionary) != dict:
+        return dictionary
+    else:
+        return recursive_dictpath(dictionary[path.pop(0)], path)
+
+
+def recursive_dictwalk(arg, func: callable, path: tuple = None):
+    if path is None:
+        path = ()
+
+    if type(arg) in (list, dict):
+        for k, v in dictiter(arg):
+            loop_path = path + (k,)
+
+            if type(v) in (list, dict):
+                recursive_dictwalk(v, func, loop_path)
+            else:
+                arg[k] = func(k, v, loop_path)
+    else:
+        raise TypeError("Not walkable as dictionary.")
+
+
+def wide(keys: int) -> dict:
+    return {f'key_{key}': {'name': 'value', 'limits': [1, 2, 3]} for key in range(keys)}
+
+
+def deep(levels: int) -> dict:
+    document = leaf = {}
+    for _ in range(levels):
+        leaf['next'] = {'value': 1}
+        leaf = leaf['next']
+    return document
+
+
+def measure(run: callable, number: int) -> str:
+    try:
+        return f'{timeit.timeit(run, number=number) / number * 1000:12.2f} ms'
+    except RecursionError:
+        return f'{"RecursionError":>15}'
+
+
+def identity(k, v, path):
+    return v
+
+
+def main(argv: list):
+    keys = int(argv[0]) if argv else 100000
+    levels = int(argv[1]) if len(argv) > 1 else 1000
+
+    documents = {f'wide ({keys} keys)': (lambda: wide(keys), ['key_0', 'limits']),
+                 f'deep ({levels} levels)': (lambda: deep(levels), ['next'] * levels + ['value'])}
+
+    print(f"{'':<30}{'recursive':>15}{'iterative':>15}{'no paths':>15}")
+    for name, (build, path) in documents.items():
+        document = build()
+        walked = [build() for _ in range(3)]
+        print(f'{"dictwalk " + name:<30}'
+              f'{measure(lambda: recursive_dictwalk(walked[0], identity), 3)}'
+              f'{measure(lambda: dictwalk(walked[1], identity), 3)}'
+              f'{measure(lambda: dictwalk(walked[2], identity, want_path=False), 3)}')
+        print(f'{"dictpath " + name:<30}'
+              f'{measure(lambda: recursive_dictpath(document, list(path)), 100)}'
+              f'{measure(lambda: dictpath(document, path), 100)}')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
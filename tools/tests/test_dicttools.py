@@ -1,6 +1,11 @@
+import os
+import subprocess
+import sys
 import unittest
 
-from tools.dicttools import dictiter, dictpath, dictwalk
+from tools.dicttools import (BadQueryError, UnstableValueError, compile_query, dictdiff, dicthash, dictiter, dictleaves,
+                             dictpatch, dictpath, dictquery, dictsort, dictwalk)
+from tools.persistent import FrozenDict, FrozenError, assoc_in, freeze
 
 
 class DictToolsTest(unittest.TestCase):
@@ -59,6 +64,259 @@ class DictToolsTest(unittest.TestCase):
                           "This one we won't"],
                          v)
 
+    def test_dictpath_keeps_the_path(self):
+        # Given...
+        d = {"wee": {"key": {"deeper": 1}}}
+        path = ["wee", "key", "deeper"]
+        # When...
+        v = dictpath(d, path)
+        # Then...
+        self.assertEqual(1, v)
+        self.assertEqual(["wee", "key", "deeper"], path)
+        self.assertEqual([1], dictpath({"wee": [1]}, ("wee", 0, "beyond")))
+
+    def test_dictwalk_paths_and_order(self):
+        # Given...
+        d = {"a": 1, "b": {"c": [2, {"d": 3}], "e": 4}, "f": 5}
+        visited = []
+        # When...
+        dictwalk(d, lambda k, v, path: visited.append(path) or v * 10)
+        # Then...
+        self.assertEqual([("a",), ("b", "c", 0), ("b", "c", 1, "d"), ("b", "e"), ("f",)], visited)
+        self.assertEqual({"a": 10, "b": {"c": [20, {"d": 30}], "e": 40}, "f": 50}, d)
+
+    def test_dictwalk_without_paths(self):
+        # Given...
+        d = [{"a": 1}, [2, [3]]]
+        paths = []
+        # When...
+        dictwalk(d, lambda k, v, path: paths.append(path) or v + 1, want_path=False)
+        # Then...
+        self.assertEqual([None, None, None], paths)
+        self.assertEqual([{"a": 2}, [3, [4]]], d)
+
+    def test_dictwalk_deep_documents(self):
+        # Given...
+        d = leaf = {}
+        for _ in range(5000):
+            leaf["next"] = {}
+            leaf = leaf["next"]
+        leaf["value"] = 1
+        depths = []
+        # When...
+        dictwalk(d, lambda k, v, path: depths.append(len(path)) or v)
+        # Then...
+        self.assertEqual([5001], depths)
+        self.assertEqual(1, dictpath(d, ["next"] * 5000 + ["value"]))
+
+    def test_dictwalk_leaves(self):
+        # When/Then...
+        with self.assertRaises(TypeError):
+            dictwalk("leaf", lambda k, v, path: v)
+
+    def test_dictleaves(self):
+        # Given...
+        d = {"a": 1, "b": {"c": [2, {"d": 3}]}, "e": 4}
+        # When...
+        leaves = list(dictleaves(d))
+        # Then...
+        self.assertEqual([(("a",), "a", 1), (("b", "c", 0), 0, 2), (("b", "c", 1, "d"), "d", 3), (("e",), "e", 4)],
+                         leaves)
+        self.assertEqual({"a": 1, "b": {"c": [2, {"d": 3}]}, "e": 4}, d)
+
+    def test_dictleaves_pushdown(self):
+        # Given...
+        d = {"a": 1, "b": {"a": 2, "c": {"a": 3}}, "c": {"a": 4}}
+        # When...
+        keyed = [v for _, _, v in dictleaves(d, want_path=False, keys={"a"})]
+        filtered = [v for _, _, v in dictleaves(d, where=lambda k, v, path: len(path) == 2)]
+        pruned = [v for _, _, v in dictleaves(d, descend=lambda k, v, path: k != "c")]
+        # Then...
+        self.assertEqual([1, 2, 3, 4], keyed)
+        self.assertEqual([2, 4], filtered)
+        self.assertEqual([1, 2], pruned)
+
+    def test_dictleaves_branches(self):
+        # Given...
+        d = {"a": {"b": 1}, "c": [2]}
+        # When...
+        keys = [k for k, _, _ in dictleaves(d, branches=True)]
+        # Then...
+        self.assertEqual([("a",), ("a", "b"), ("c",), ("c", 0)], keys)
+
+    def test_dictleaves_is_lazy(self):
+        # Given...
+        d = {"a": 1, "b": "nope"}
+        seen = []
+        # When...
+        leaves = dictleaves(d, want_path=False, where=lambda k, v, path: seen.append(k) or True)
+        first = next(leaves)
+        # Then...
+        self.assertEqual((None, "a", 1), first)
+        self.assertEqual(["a"], seen)
+        with self.assertRaises(TypeError):
+            next(dictleaves("leaf"))
+
+    def test_dictquery(self):
+        # Given...
+        d = {"service": {"a": {"host": "h1", "port": 1}, "b": {"host": "h2", "x": [{"port": 2}, {"port": 3}]}},
+             "port": 0, "REDIS_DB": 4, "REDIS_HOST": "r", "n": {"0": "zero"}}
+        # When/Then...
+        self.assertEqual([(("service", "a", "host"), "h1"), (("service", "b", "host"), "h2")],
+                         list(dictquery(d, "service.*.host")))
+        self.assertEqual([1, 2, 3, 0], [v for _, v in dictquery(d, "**.port")])
+        self.assertEqual([3], [v for _, v in dictquery(d, "service.b.x[1].port")])
+        self.assertEqual([2], [v for _, v in dictquery(d, "service.b.x.0.port")])
+        self.assertEqual(["zero"], [v for _, v in dictquery(d, "n.0")])
+        self.assertEqual([4, "r"], [v for _, v in dictquery(d, "REDIS_*")])
+        self.assertEqual([], list(dictquery(d, "service.c.host")))
+
+    def test_dictquery_predicates(self):
+        # Given...
+        d = {"a": {"x": 1, "y": 2}, "b": {"x": 3}}
+        # When...
+        matches = list(dictquery(d, ["*", lambda key: key != "y"], want_path=False))
+        # Then...
+        self.assertEqual([(None, 1), (None, 3)], matches)
+
+    def test_dictquery_prunes(self):
+        # Given...
+        d = {"a": {"host": 1}, "b": 2}
+        visited = []
+        # When...
+        values = list(dictquery(d, ["*", lambda key: visited.append(key) or key == "host"]))
+        # Then...
+        self.assertEqual([(("a", "host"), 1)], values)
+        self.assertEqual(["host"], visited)
+
+    def test_deep_key_queries_match_the_general_walk(self):
+        # Given...
+        d = {"port": {"port": 1, "x": [[{"port": 2}], 3, {"y": {"port": [4]}}]}, "z": [5, {"port": 6}],
+             0: {"port": 7}}
+        general = ["**", lambda key: key == "port"]
+        # When/Then...
+        self.assertEqual(list(dictquery(d, general)), list(dictquery(d, "**.port")))
+        self.assertEqual(list(dictquery(d, general, want_path=False)), list(dictquery(d, "**.port", want_path=False)))
+        self.assertEqual([v for _, v in dictquery(d, general)], compile_query("**.port").values(d))
+        self.assertEqual([1], compile_query("**.port").values([[{"port": 1}]]))
+        self.assertEqual([], compile_query("**.port").values("port"))
+
+    def test_compile_query(self):
+        # When/Then...
+        self.assertIs(compile_query("**.port"), compile_query("**.port"))
+        self.assertEqual([1], compile_query("a.b").values({"a": {"b": 1}}))
+        with self.assertRaises(BadQueryError):
+            compile_query("a..b")
+        with self.assertRaises(BadQueryError):
+            compile_query("a[b]")
+
+    def test_dictdiff(self):
+        # Given...
+        a = {"x": 1, "y": {"z": 2}, "gone": 3}
+        b = {"x": 1, "y": {"z": 4}, "new": [5]}
+        # When...
+        ops = dictdiff(a, b)
+        # Then...
+        self.assertEqual([("replace", ("y", "z"), 4), ("remove", ("gone",), None), ("add", ("new",), [5])], ops)
+        self.assertEqual([], dictdiff(a, dict(a)))
+        self.assertEqual([("replace", (), 2)], dictdiff(1, 2))
+
+    def test_dictdiff_lists(self):
+        # Given...
+        a = {"items": [{"sku": 1, "qty": 1}, {"sku": 2, "qty": 1}, {"sku": 3, "qty": 1}]}
+        b = {"items": [{"sku": 0, "qty": 1}, {"sku": 1, "qty": 1}, {"sku": 2, "qty": 2}]}
+        # When...
+        ops = dictdiff(a, b)
+        # Then...
+        self.assertEqual([("add", ("items", 0), {"sku": 0, "qty": 1}),
+                          ("replace", ("items", 2, "qty"), 2),
+                          ("remove", ("items", 3), None)], ops)
+        self.assertEqual(b, dictpatch(a, ops))
+
+    def test_dictdiff_skips_shared_subtrees(self):
+        # Given...
+        class Unequal():
+            def __eq__(self, other):
+                raise AssertionError("Compared a shared subtree.")
+        a = freeze({"shared": {"value": Unequal()}, "changed": {"value": 1}})
+        b = assoc_in(a, ["changed", "value"], 2)
+        # When...
+        ops = dictdiff(a, b)
+        # Then...
+        self.assertEqual([("replace", ("changed", "value"), 2)], ops)
+
+    def test_dictpatch(self):
+        # Given...
+        a = {"x": [1, 2, 3], "y": {"z": 2}, "kept": {"k": 1}, "gone": 3}
+        b = {"x": [0, 1, 3, 4], "y": {"z": 4}, "kept": {"k": 1}, "new": {"n": 5}}
+        # When...
+        patched = dictpatch(a, dictdiff(a, b))
+        # Then...
+        self.assertEqual(b, patched)
+        self.assertEqual({"x": [1, 2, 3], "y": {"z": 2}, "kept": {"k": 1}, "gone": 3}, a)
+        self.assertIs(a["kept"], patched["kept"])
+        self.assertEqual([2], dictpatch(1, dictdiff(1, [2])))
+
+    def test_dictpatch_frozen(self):
+        # Given...
+        a = freeze({"x": {"y": [1, 2]}, "z": {}})
+        # When...
+        patched = dictpatch(a, [("add", ("x", "y", 0), 0), ("remove", ("z",), None)])
+        # Then...
+        self.assertEqual({"x": {"y": [0, 1, 2]}}, patched)
+        self.assertIsInstance(patched["x"], FrozenDict)
+        self.assertEqual([1, 2], a["x"]["y"])
+
+    def test_dictsort(self):
+        # Given...
+        d = {"a": [3, 1, 2], "b": {"c": [[2, 1], "x", None]}, "d": [{"k": [2, 1]}, {"k": [1]}]}
+        # When...
+        actual = dictsort(d)
+        # Then...
+        self.assertIs(d, actual)
+        self.assertEqual({"a": [1, 2, 3], "b": {"c": [None, [1, 2], "x"]}, "d": [{"k": [1, 2]}, {"k": [1]}]}, actual)
+        self.assertEqual(actual, dictsort({"d": [{"k": [1]}, {"k": [1, 2]}], "b": {"c": ["x", None, [1, 2]]},
+                                           "a": [2, 3, 1]}))
+
+    def test_dicthash(self):
+        # Given...
+        d = {"a": [1, {"b": 2}], "c": "x"}
+        # When/Then...
+        self.assertEqual(dicthash(d), dicthash({"c": "x", "a": [1, {"b": 2}]}))
+        self.assertNotEqual(dicthash(d), dicthash({"a": [{"b": 2}, 1], "c": "x"}))
+        self.assertEqual(dicthash(d, canonical=True), dicthash({"a": [{"b": 2}, 1], "c": "x"}, canonical=True))
+        self.assertNotEqual(dicthash({"a": 1}), dicthash({"a": 1.0}))
+        self.assertNotEqual(dicthash({"a": 1}), dicthash({"a": "1"}))
+        self.assertNotEqual(dicthash({"a": []}), dicthash({"a": {}}))
+        self.assertEqual(dicthash(dictsort({"a": [3, [2, 1]]})), dicthash(dictsort({"a": [[1, 2], 3]})))
+        # Stable across runs, unlike hash().
+        self.assertEqual("8ce065177d18d2e501600b4b4fae5029", dicthash({"a": [1, 2.5, None, True], "b": {"c": "d"}}))
+
+    def test_dicthash_sets_and_tuples(self):
+        # Given...
+        script = 'from tools.dicttools import dicthash; print(dicthash({"a": [{"x", "y", "z", ("t", 1)}]}))'
+        # When...
+        digests = {subprocess.run([sys.executable, '-c', script], env=dict(os.environ, PYTHONHASHSEED=seed),
+                                  capture_output=True, text=True, check=True).stdout for seed in ('1', '2', '3')}
+        # Then...
+        self.assertEqual(1, len(digests))
+        self.assertNotEqual(dicthash({"a": [1, 2]}), dicthash({"a": [(1, 2)]}))
+        self.assertNotEqual(dicthash({"a": {1, 2}}), dicthash({"a": frozenset({1, 2})}))
+        self.assertEqual({"a": [{1}, {2, 3}]}, dictsort({"a": [{2, 3}, {1}]}))
+
+    def test_dicthash_rejects_unstable_values(self):
+        # When...
+        with self.assertRaises(UnstableValueError) as context:
+            dicthash({"a": [object()]})
+        # Then...
+        self.assertEqual("Can not digest a object in a stable way: its repr may change from one process to the next.",
+                         str(context.exception))
+
+    def test_dictsort_refuses_frozen_documents(self):
+        # When/Then...
+        with self.assertRaises(FrozenError):
+            dictsort(freeze({"a": [2, 1]}))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -65,3 +65,13 @@ class CsvParserTest(unittest.TestCase):
         expected = GOT_CSV_NULLS
 
         self.assertEqual(expected, actual)
+
+    def test_streaming_csv(self):
+        # Given...
+        rows = (row for row in (('Robert', 'Baratheon', 'Very'), ('Tyrion', 'Lannister', 'Doubtful')))
+        # When...
+        lines = CsvParser().iter_lines(('name', 'house', 'demise'), rows)
+        # Then...
+        self.assertEqual('name,house,demise', next(lines))
+        self.assertEqual('Robert,Baratheon,Very', next(lines))
+        self.assertEqual(['Tyrion,Lannister,Doubtful'], list(lines))
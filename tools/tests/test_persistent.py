@@ -0,0 +1,71 @@
+import copy
+import pickle
+import unittest
+
+from tools.persistent import FrozenDict, FrozenError, FrozenList, assoc_in, freeze
+
+
+class PersistentTest(unittest.TestCase):
+
+    maxDiff = None
+
+    def test_freeze(self):
+        # Given...
+        d = {"wee": {"key": ["phrase", {"deep": 1}]}, "nah": 2}
+        # When...
+        frozen = freeze(d)
+        # Then...
+        self.assertEqual(d, frozen)
+        self.assertIsInstance(frozen, FrozenDict)
+        self.assertIsInstance(frozen["wee"]["key"], FrozenList)
+        self.assertIsInstance(frozen["wee"]["key"][1], FrozenDict)
+        self.assertIs(frozen, freeze(frozen))
+
+    def test_frozen_containers_reject_changes(self):
+        # Given...
+        frozen = freeze({"wee": {"key": [1, 2]}})
+        # When/Then...
+        with self.assertRaises(FrozenError):
+            frozen["nah"] = 1
+        with self.assertRaises(FrozenError):
+            frozen["wee"].update({"key": 3})
+        with self.assertRaises(FrozenError):
+            frozen["wee"]["key"].append(3)
+        with self.assertRaises(TypeError):
+            del frozen["wee"]
+
+    def test_assoc_in_shares_untouched_subtrees(self):
+        # Given...
+        v1 = freeze({"wee": {"key": 1, "other": {"deep": [1]}}, "nah": {"big": [2]}})
+        # When...
+        v2 = assoc_in(v1, ["wee", "key"], {"new": [3]})
+        v3 = assoc_in(v2, ["yeah", "created"], 4)
+        # Then...
+        self.assertEqual(1, v1["wee"]["key"])
+        self.assertEqual({"new": [3]}, v2["wee"]["key"])
+        self.assertIsInstance(v2["wee"]["key"]["new"], FrozenList)
+        self.assertIs(v1["nah"], v2["nah"])
+        self.assertIs(v1["wee"]["other"], v2["wee"]["other"])
+        self.assertIs(v2["wee"], v3["wee"])
+        self.assertEqual({"created": 4}, v3["yeah"])
+
+    def test_assoc_in_below_a_leaf(self):
+        # Given...
+        v1 = freeze({"wee": "leaf"})
+        # When/Then...
+        with self.assertRaises(TypeError):
+            assoc_in(v1, ["wee", "key"], 1)
+
+    def test_copy_and_pickle(self):
+        # Given...
+        frozen = freeze({"wee": {"key": [1, 2]}})
+        # When...
+        unpickled = pickle.loads(pickle.dumps(frozen))
+        # Then...
+        self.assertIs(frozen, copy.deepcopy(frozen))
+        self.assertEqual(frozen, unpickled)
+        self.assertIsInstance(unpickled["wee"]["key"], FrozenList)
+
+
+if __name__ == '__main__':
+    unittest.main()
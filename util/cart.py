@@ -13,6 +13,10 @@ from util.provider import ConfigProvider
 
 # Get the configuration provider
 provider = ConfigProvider(app_conf=getattr(options, 'config', None))
+# Legacy API client settings, resolved together and again only when the configuration changes
+legacy_api = provider.view({'base_url': 'service.thirstie_legacy.base_url',
+                            'token_basic': 'jwt.token_basic',
+                            'token': 'jwt.token'})
 # Round dollars and cents up when period used
 D = decimal.Decimal
 cent = D('0.01')
@@ -126,9 +130,10 @@ def next_order(*args, **kw):
     customer_id = kw['customer_id']
     logistic_order_id = kw['logistic_order_id']
     payload = kw['payload']
-    base = provider.get_value('service.thirstie_legacy.base_url')
+    legacy = legacy_api.values
+    base = legacy.base_url
     version = 'v0'
-    token = provider.get_value('jwt.token_basic')
+    token = legacy.token_basic
     headers = {
         "Content-Type": "application/json",
         "Authorization": token
@@ -273,7 +278,8 @@ def create_legacy_crt(*args, **kwargs):
     """ This is used with celery, but same as create_legacy_cart """
     customer_id = kwargs['customer_id']
     payload = kwargs.get('payload', {})
-    token = provider.get_value('jwt.token_basic')
+    legacy = legacy_api.values
+    token = legacy.token_basic
 
     headers = {
         "Content-Type": "application/json",
@@ -281,7 +287,7 @@ def create_legacy_crt(*args, **kwargs):
     }
 
     client = HTTPClient()
-    base = provider.get_value('service.thirstie_legacy.base_url')
+    base = legacy.base_url
     version = 'v0'
 
     cart_url = '{}/{}/payments/user/{}/carts/'.format(base, version, customer_id)
@@ -322,13 +328,14 @@ def create_legacy_crt(*args, **kwargs):
 def read_braintree_token(*args, **kwargs):
     """ Read Braintree Token """
     th_customer_id = kwargs['th_customer_id']
-    base = provider.get_value('service.thirstie_legacy.base_url')
+    legacy = legacy_api.values
+    base = legacy.base_url
     version = 'v0'
     token_url = '{}/{}/payments/token/braintree/{}'.format(base, version, th_customer_id)
 
     client = HTTPClient()
     response = None
-    token = provider.get_value('jwt.token')
+    token = legacy.token
 
     headers = {
         "Content-Type": "application/x-www-form-urlencoded",
@@ -362,12 +369,13 @@ def read_bearer_token(*args, **kwargs):
 
     client = HTTPClient()
     response = None
-    token = provider.get_value('jwt.token_basic')
-    base = provider.get_value('service.thirstie_legacy.base_url')
+    legacy = legacy_api.values
+    token = legacy.token_basic
+    base = legacy.base_url
     version = 'v0'
     token_url = '{}/{}/payments/user/{}'.format(base, version, customer_id)
     # Read the token from configuration
-    token = provider.get_value('jwt.token_basic')
+    token = legacy.token_basic
 
     # Set the headers to communicate
     headers = {
@@ -449,12 +457,13 @@ def merge_item(logistic_order, item):
 @gen.coroutine
 def read_legacy_cart(th_customer_id, logistic_order_id):
     client = HTTPClient()
-    base = provider.get_value('service.thirstie_legacy.base_url')
+    legacy = legacy_api.values
+    base = legacy.base_url
     version = 'v0'
     cart_url = '{}/{}/payments/user/{}/carts/{}'.format(base, version, th_customer_id, logistic_order_id)
 
     # Read the token from configuration
-    token = provider.get_value('jwt.token_basic')
+    token = legacy.token_basic
 
     # Set the headers to communicate
     headers = {
@@ -485,12 +494,13 @@ def read_token(customer_id):
     client = AsyncHTTPClient()
     response = None
 
-    token = provider.get_value('jwt.token')
-    base = provider.get_value('service.thirstie_legacy.base_url')
+    legacy = legacy_api.values
+    token = legacy.token
+    base = legacy.base_url
     version = 'v0'
     payment_user_url = '{}/{}/payments/user/{}'.format(base, version, customer_id)
     # Read the token from configuration
-    token = provider.get_value('jwt.token_basic')
+    token = legacy.token_basic
 
     # Set the headers to communicate
     headers = {
@@ -1,5 +1,16 @@
+import copy
+import io
 import yaml
 import os.path
+import threading
+from functools import partial
+
+from tools.lazy import LazyNode
+
+try:
+    from yaml import CLoader as BaseLoader
+except ImportError:  # PyYAML built without libyaml
+    from yaml import Loader as BaseLoader
 
 
 class LoaderMeta(type):
@@ -15,18 +26,146 @@ class LoaderMeta(type):
         return cls
 
 
-class Loader(yaml.Loader, metaclass=LoaderMeta):
-    """ Yaml Loader """
-    def __init__(self, stream):
+class IncludeCycleError(yaml.YAMLError):
+    """ A file ends up including itself """
+    def __init__(self, chain: list):
+        self.chain = chain
+        super().__init__('Include cycle: ' + ' -> '.join(chain))
+
+
+class IncludeGraph():
+    """
+    The files read during one load, parsed at most once each.
+
+    edges maps every file, by absolute path and in the order they were first
+    reached, to the files it includes. A file included again gets a deep copy
+    of its first parse, so no two places in the result share mutable state.
+
+    With retain, the graph is meant to outlive the load: every include gets a
+    copy and the parses are kept pristine, so that after invalidate() a new
+    load only re-parses the files that changed and the files including them.
+
+    Lazy sections load their includes whenever they are first accessed, from
+    whichever thread does so: loads hold a lock, reentrant for nested includes.
+    listeners are called with the path of every file first reached, so that
+    whoever watches the files hears of those.
+    """
+    def __init__(self, retain: bool = False):
+        self.edges = {}
+        self.retain = retain
+        self.listeners = []
+        self._parsed = {}
+        self._chain = []
+        self._lock = threading.RLock()
+
+    @property
+    def files(self) -> list:
+        return list(self.edges)
+
+    def load(self, path: str, loader: type, parent: str = None):
+        with self._lock:
+            return self._load(os.path.abspath(path), loader, parent)
+
+    def _load(self, path: str, loader: type, parent: str = None):
+        if parent is not None and path not in self.edges[parent]:
+            self.edges[parent].append(path)
+
+        if path in self._chain:
+            raise IncludeCycleError(self._chain[self._chain.index(path):] + [path])
+        elif path in self._parsed:
+            return copy.deepcopy(self._parsed[path])
+
+        reached = path not in self.edges
+        self.edges[path] = []
+        if reached:
+            for listener in self.listeners:
+                listener(path)
+
+        self._chain.append(path)
+        try:
+            with open(path, 'r') as fp:
+                instance = loader(fp, self)
+                try:
+                    data = instance.get_single_data()
+                finally:
+                    instance.dispose()
+        finally:
+            self._chain.pop()
+
+        # Roots are not cached: they are only parsed again when something under them changed.
+        if parent is None:
+            return data
+
+        self._parsed[path] = data
+        return copy.deepcopy(data) if self.retain else data
+
+    def invalidate(self, paths: list) -> set:
+        """
+        Forget the parses of the given files and of every file including them, returning all of those.
+        """
+        with self._lock:
+            return self._invalidate(paths)
+
+    def _invalidate(self, paths: list) -> set:
+        includers = {}
+        for path, included in self.edges.items():
+            for child in included:
+                includers.setdefault(child, set()).add(path)
+
+        stale = set()
+        pending = [os.path.abspath(path) for path in paths]
+        while pending:
+            path = pending.pop()
+            if path not in stale:
+                stale.add(path)
+                pending.extend(includers.get(path, ()))
+
+        for path in stale:
+            self._parsed.pop(path, None)
+
+        return stale
+
+    def prune(self, roots: list):
+        """
+        Drop the files no longer reachable from the roots.
+        """
+        with self._lock:
+            self._prune(roots)
+
+    def after_fork(self):
+        """
+        Replace the lock, which another thread may have held when the process forked.
+        """
+        self._lock = threading.RLock()
+
+    def _prune(self, roots: list):
+        reachable = set()
+        pending = [os.path.abspath(root) for root in roots]
+        while pending:
+            path = pending.pop()
+            if path not in reachable and path in self.edges:
+                reachable.add(path)
+                pending.extend(self.edges[path])
+
+        for path in set(self.edges) - reachable:
+            del self.edges[path]
+            self._parsed.pop(path, None)
+
+
+class IncludeConstructor():
+    """ !include support, shared by the libyaml and the pure Python loaders """
+    def __init__(self, stream, includes: IncludeGraph = None):
 
         try:
             self._root = os.path.split(stream.name)[0]
+            self._path = os.path.abspath(stream.name)
         except AttributeError:
             self._root = os.path.curdir
+            self._path = None
+
+        self.includes = includes if includes is not None else IncludeGraph()
 
-        super(Loader, self).__init__(stream)
-        Loader.add_constructor('!include', Loader.include)
-        Loader.add_constructor('!import',  Loader.include)
+        super().__init__(stream)
 
     def include(self, node):
         if isinstance(node, yaml.ScalarNode):
@@ -36,18 +175,154 @@ class Loader(yaml.Loader, metaclass=LoaderMeta):
             for filename in self.construct_sequence(node):
                 result += self.extractFile(filename)
             return result
- 
+
         elif isinstance(node, yaml.MappingNode):
             result = {}
-            for k, v in self.construct_mapping(node).iteritems():
+            for k, v in self.construct_mapping(node).items():
                 result[k] = self.extractFile(v)
             return result
- 
+
         else:
             print("Error:: unrecognised node type in !include statement")
             raise yaml.constructor.ConstructorError
- 
+
     def extractFile(self, filename):
-        filepath = "."+os.path.join(self._root, filename)
-        with open(filepath, 'r') as f:
-            return yaml.load(f, Loader)
+        """
+        Load an included file, resolved relative to the file including it.
+        """
+        parent = self._path if self._path in self.includes.edges else None
+        return self.includes.load(os.path.join(self._root, filename), self.__class__, parent)
+
+
+class Loader(IncludeConstructor, BaseLoader, metaclass=LoaderMeta):
+    """ Yaml Loader, backed by libyaml when PyYAML was built with it """
+
+
+class PyLoader(IncludeConstructor, yaml.Loader, metaclass=LoaderMeta):
+    """ Pure Python Yaml Loader """
+
+
+class LazyLoader(Loader):
+    """
+    Yaml Loader leaving the top-level sections of a mapping document and every
+    !include target as LazyNode placeholders, built on first access.
+
+    Sections only keep their span of the source text: the document is scanned
+    for events once, without building nodes, and a section is parsed from its
+    span when needed. Documents whose sections could depend on each other
+    (anchors, merge keys) are loaded eagerly instead.
+    """
+    lazy_sections = True
+
+    def __init__(self, stream, includes: IncludeGraph = None):
+        self._text = stream if isinstance(stream, str) else stream.read()
+        named = io.StringIO(self._text)
+        if hasattr(stream, 'name'):
+            named.name = stream.name
+
+        super().__init__(named, includes)
+
+    def include(self, node):
+        # File names are read right away, while the node still belongs to this document.
+        if isinstance(node, yaml.ScalarNode):
+            filename = self.construct_scalar(node)
+            return LazyNode(lambda: self.extractFile(filename))
+        elif isinstance(node, yaml.SequenceNode):
+            filenames = self.construct_sequence(node)
+            return LazyNode(lambda: [item for filename in filenames for item in self.extractFile(filename)])
+        elif isinstance(node, yaml.MappingNode):
+            filenames = self.construct_mapping(node)
+            return LazyNode(lambda: {k: self.extractFile(v) for k, v in filenames.items()})
+
+        return super().include(node)
+
+    def extractFile(self, filename):
+        # Included documents are built whole, their own !include targets aside.
+        parent = self._path if self._path in self.includes.edges else None
+        return self.includes.load(os.path.join(self._root, filename), _EagerSectionLoader, parent)
+
+    def get_single_data(self):
+        spans = self._section_spans() if self.lazy_sections else None
+        if spans is None:
+            loader = _EagerSectionLoader(self._named(self._text), self.includes)
+            try:
+                return loader.get_single_data()
+            finally:
+                loader.dispose()
+
+        return {key: LazyNode(partial(self._construct_section, start, end)) for key, (start, end) in spans.items()}
+
+    def _section_spans(self):
+        """
+        Map each top-level key to the (start, end) span of its value in the
+        source text, or return None when the document does not allow it.
+        """
+        self.get_event()  # StreamStart
+        if not self.check_event(yaml.DocumentStartEvent):
+            return None
+        self.get_event()
+        if not self.check_event(yaml.MappingStartEvent) or self.peek_event().anchor is not None:
+            return None
+        self.get_event()
+
+        spans = {}
+        while not self.check_event(yaml.MappingEndEvent):
+            key_event = self.get_event()
+            if not isinstance(key_event, yaml.ScalarEvent) or key_event.anchor or key_event.value == '<<':
+                return None
+            key = self.construct_object(yaml.ScalarNode(self.resolve(yaml.ScalarNode, key_event.value, key_event.implicit)
+                                                        if key_event.tag in (None, '!') else key_event.tag,
+                                                        key_event.value, style=key_event.style))
+
+            start = end = None
+            depth = 0
+            while start is None or depth:
+                event = self.get_event()
+                if isinstance(event, yaml.AliasEvent) or getattr(event, 'anchor', None):
+                    return None
+                if start is None:
+                    start = event.start_mark.index
+                if isinstance(event, (yaml.MappingStartEvent, yaml.SequenceStartEvent)):
+                    depth += 1
+                elif isinstance(event, (yaml.MappingEndEvent, yaml.SequenceEndEvent)):
+                    depth -= 1
+                end = event.end_mark.index
+
+            # Block collections start on their own line: keep their indentation.
+            line_start = self._text.rfind('\n', 0, start) + 1
+            if not self._text[line_start:start].strip():
+                start = line_start
+            spans[key] = (start, end)
+
+        self.get_event()
+        self.get_event()  # DocumentEnd
+        return spans if self.check_event(yaml.StreamEndEvent) else None
+
+    def _construct_section(self, start: int, end: int):
+        loader = _EagerSectionLoader(self._named(self._text[start:end]), self.includes)
+        try:
+            return loader.get_single_data()
+        finally:
+            loader.dispose()
+
+    def _named(self, text: str) -> io.StringIO:
+        stream = io.StringIO(text)
+        if self._path is not None:
+            stream.name = self._path
+        return stream
+
+
+class _EagerSectionLoader(LazyLoader):
+    """ LazyLoader building its whole document, !include targets aside """
+    lazy_sections = False
+
+    def get_single_data(self):
+        return super(LazyLoader, self).get_single_data()
+
+
+def load_file(path: str, loader: type = Loader):
+    """
+    Load a YAML file, returning its data and the IncludeGraph of the files it was built from.
+    """
+    includes = IncludeGraph()
+    return includes.load(path, loader), includes
@@ -0,0 +1,136 @@
+"""
+Binary snapshots of parsed configuration
+@author dmitry
+
+A snapshot holds the already parsed service and app configuration together
+with a fingerprint of every file they were built from (roots and transitive
+includes), so a process can skip YAML parsing when nothing changed on disk.
+Snapshots are pickles: only point CONFIG_SNAPSHOT_PATH at a location the
+application itself controls.
+
+Prebuild one at deploy time with:
+
+    python -m util.snapshot --app-conf config.yaml --service-conf configs/service_conf.yaml snapshot.pickle
+"""
+import argparse
+import hashlib
+import logging
+import os
+import pickle
+import sys
+
+import yaml
+
+from util.loader import IncludeGraph, Loader, load_file
+
+SNAPSHOT_VERSION = 2
+
+logger = logging.getLogger(__name__)
+
+
+def fingerprint(files: list) -> str:
+    """
+    Hash the path, modification time and contents of every file.
+    """
+    digest = hashlib.sha256()
+
+    for path in files:
+        stat = os.stat(path)
+        digest.update(os.path.abspath(path).encode('utf-8'))
+        digest.update(f'{stat.st_mtime_ns}:{stat.st_size}'.encode('ascii'))
+        with open(path, 'rb') as fp:
+            digest.update(fp.read())
+
+    return digest.hexdigest()
+
+
+def parse(service_conf_path: str, app_conf_path: str, includes: IncludeGraph = None) -> dict:
+    """
+    Parse both configuration roots into an (unsaved) snapshot.
+
+    Pass a retaining IncludeGraph to reuse the parses of files it still holds.
+    """
+    if includes is None:
+        service_conf, service_includes = load_file(service_conf_path)
+        settings, app_includes = load_file(app_conf_path)
+        graph = {**service_includes.edges, **app_includes.edges}
+    else:
+        service_conf = includes.load(service_conf_path, Loader)
+        settings = includes.load(app_conf_path, Loader)
+        graph = dict(includes.edges)
+    files = list(graph)
+
+    return {'version': SNAPSHOT_VERSION,
+            'roots': _roots(service_conf_path, app_conf_path),
+            'files': files,
+            'graph': graph,
+            'fingerprint': fingerprint(files),
+            'service_conf': service_conf,
+            'settings': settings}
+
+
+def load(snapshot_path: str, service_conf_path: str, app_conf_path: str):
+    """
+    Return the snapshot stored at snapshot_path, or None when it is missing,
+    unreadable, or was built from different or since modified files.
+    """
+    try:
+        with open(snapshot_path, 'rb') as fp:
+            snapshot = pickle.load(fp)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning('Ignoring unreadable config snapshot %s: %s', snapshot_path, e)
+        return None
+
+    try:
+        if (snapshot['version'] != SNAPSHOT_VERSION
+                or snapshot['roots'] != _roots(service_conf_path, app_conf_path)
+                or snapshot['fingerprint'] != fingerprint(snapshot['files'])):
+            return None
+    except (KeyError, TypeError, OSError):
+        return None
+
+    return snapshot
+
+
+def dump(snapshot_path: str, snapshot: dict):
+    """
+    Write a snapshot atomically, so concurrently starting workers never read half of it.
+    """
+    tmp_path = f'{snapshot_path}.{os.getpid()}.tmp'
+    try:
+        with open(tmp_path, 'wb') as fp:
+            pickle.dump(snapshot, fp, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, snapshot_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _roots(service_conf_path: str, app_conf_path: str) -> tuple:
+    return os.path.abspath(service_conf_path), os.path.abspath(app_conf_path)
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description='Prebuild a parsed configuration snapshot.')
+    parser.add_argument('snapshot', help='Where to write the snapshot.')
+    parser.add_argument('--app-conf', default=os.environ.get('APP_CONFIG_PATH', '../config.yaml'))
+    parser.add_argument('--service-conf',
+                        default=os.environ.get('SERVICE_CONFIG_PATH', '../configs/service_conf.yaml'))
+    args = parser.parse_args(argv)
+
+    try:
+        snapshot = parse(args.service_conf, args.app_conf)
+        dump(args.snapshot, snapshot)
+    except (OSError, yaml.YAMLError) as e:
+        print(f'Could not build the snapshot: {e}', file=sys.stderr)
+        return 1
+
+    print(f'Wrote {args.snapshot} from {len(snapshot["files"])} files.')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
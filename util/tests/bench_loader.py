@@ -0,0 +1,37 @@
+"""
+Parse time of the configs directory with the pure Python and the libyaml loaders.
+
+    python -m util.tests.bench_loader [configs_dir] [rounds]
+"""
+import glob
+import os
+import sys
+import timeit
+
+from util.loader import Loader, PyLoader, load_file
+
+
+def bench(configs_dir: str, rounds: int = 200):
+    paths = sorted(glob.glob(os.path.join(configs_dir, '*.yaml')))
+    results = {}
+
+    for loader in (PyLoader, Loader):
+        seconds = timeit.timeit(lambda: [load_file(path, loader) for path in paths], number=rounds)
+        results[loader.__name__] = seconds / rounds
+
+    return paths, results
+
+
+def main(argv: list):
+    configs_dir = argv[0] if argv else os.path.join(os.path.dirname(__file__), '..', '..', 'configs')
+    rounds = int(argv[1]) if len(argv) > 1 else 200
+    paths, results = bench(configs_dir, rounds)
+
+    print(f'{len(paths)} files, {rounds} rounds')
+    for name, seconds in results.items():
+        print(f'{name:>10}: {seconds * 1000:8.3f} ms per pass')
+    print(f'{"speedup":>10}: {results["PyLoader"] / results["Loader"]:8.2f}x')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
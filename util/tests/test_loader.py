@@ -0,0 +1,116 @@
+import os
+import tempfile
+import threading
+import unittest
+
+import yaml
+
+from tools.lazy import materialize
+from util.loader import IncludeCycleError, LazyLoader, Loader, PyLoader, load_file
+
+
+class LoaderTest(unittest.TestCase):
+
+    maxDiff = None
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self._write('one.yaml', "- low_stock\n- out_of_stock\n")
+        self._write('two.yaml', "- submit_cart\n")
+        self._write('sub/nested.yaml', "inner: !include ../one.yaml\n")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _write(self, name, content):
+        path = os.path.join(self.tmp.name, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as fp:
+            fp.write(content)
+        return path
+
+    def test_include_node_types(self):
+        # Given...
+        root = self._write('root.yaml', "scalar: !include one.yaml\n"
+                                        "sequence: !include [one.yaml, two.yaml]\n"
+                                        "mapping: !include {a: one.yaml, b: two.yaml}\n"
+                                        "nested: !import sub/nested.yaml\n")
+        expected = {'scalar': ['low_stock', 'out_of_stock'],
+                    'sequence': ['low_stock', 'out_of_stock', 'submit_cart'],
+                    'mapping': {'a': ['low_stock', 'out_of_stock'], 'b': ['submit_cart']},
+                    'nested': {'inner': ['low_stock', 'out_of_stock']}}
+        # When/Then...
+        for loader in (Loader, PyLoader):
+            data, includes = load_file(root, loader)
+            self.assertEqual(expected, data)
+
+    def test_include_graph(self):
+        # Given...
+        root = self._write('root.yaml', "a: !include one.yaml\n"
+                                        "b: !include [two.yaml, one.yaml]\n"
+                                        "c: !include sub/nested.yaml\n")
+        path = lambda name: os.path.join(self.tmp.name, name)
+        # When...
+        data, includes = load_file(root)
+        # Then...
+        self.assertEqual({path('root.yaml'): [path('one.yaml'), path('two.yaml'), path('sub/nested.yaml')],
+                          path('one.yaml'): [],
+                          path('two.yaml'): [],
+                          path('sub/nested.yaml'): [path('one.yaml')]},
+                         includes.edges)
+        self.assertEqual(data['a'], data['c']['inner'])
+        self.assertIsNot(data['a'], data['c']['inner'])
+
+    def test_include_cycle(self):
+        # Given...
+        self._write('cycle_a.yaml', "b: !include cycle_b.yaml\n")
+        self._write('cycle_b.yaml', "a: !include cycle_a.yaml\n")
+        root = self._write('root.yaml', "a: !include cycle_a.yaml\n")
+        # When...
+        with self.assertRaises(IncludeCycleError) as context:
+            load_file(root)
+        # Then...
+        self.assertEqual(['cycle_a.yaml', 'cycle_b.yaml', 'cycle_a.yaml'],
+                         [os.path.basename(path) for path in context.exception.chain])
+
+    def test_constructors_are_registered_on_the_class(self):
+        # Then...
+        for loader in (Loader, PyLoader):
+            self.assertIn('!include', loader.__dict__['yaml_constructors'])
+            self.assertIn('!import', loader.__dict__['yaml_constructors'])
+        self.assertNotIn('!include', yaml.Loader.yaml_constructors)
+
+    def test_libyaml_is_used_when_available(self):
+        # Then...
+        if yaml.__with_libyaml__:
+            self.assertTrue(issubclass(Loader, yaml.CLoader))
+
+    def test_lazy_includes_resolved_concurrently(self):
+        # Given...
+        for index in range(16):
+            self._write(f'section_{index}.yaml', f"inner: !include sub/nested.yaml\nindex: {index}\n")
+        root = self._write('root.yaml', ''.join(f"s{index}: !include section_{index}.yaml\n" for index in range(16)))
+        data, includes = load_file(root, LazyLoader)
+        barrier = threading.Barrier(16)
+        errors = []
+
+        def resolve(name):
+            barrier.wait()
+            try:
+                materialize(data[name])
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=resolve, args=(f's{index}',)) for index in range(16)]
+        # When...
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # Then...
+        self.assertEqual([], errors)
+        self.assertEqual({'inner': {'inner': ['low_stock', 'out_of_stock']}, 'index': 3}, materialize(data['s3']))
+
+
+if __name__ == '__main__':
+    unittest.main()
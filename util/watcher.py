@@ -0,0 +1,66 @@
+"""
+File watching for configuration reloads
+@author dmitry
+"""
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class FileWatcher(threading.Thread):
+    """
+    Polls a set of files and calls back with the ones whose modification time
+    or size changed. A callback that raises leaves the files marked as changed,
+    so a file caught half-written is picked up again on the next poll.
+    """
+    def __init__(self, files: list, callback: callable, interval: float = 1.0):
+        super().__init__(name='config-watcher', daemon=True)
+        self.callback = callback
+        self.interval = interval
+        self._stamps = {}
+        self._stop_event = threading.Event()
+        self.watch(files)
+
+    def watch(self, files: list):
+        """
+        Replace the watched files, keeping what is known of the ones already watched.
+        """
+        self._stamps = {path: self._stamps[path] if path in self._stamps else self._stamp(path)
+                        for path in files}
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.poll()
+
+    def poll(self) -> list:
+        # watch() may replace the files from another thread meanwhile.
+        known = self._stamps
+        stamps = {path: self._stamp(path) for path in known}
+        changed = [path for path, stamp in stamps.items() if stamp != known[path]]
+
+        if changed:
+            try:
+                self.callback(changed)
+            except Exception:
+                logger.exception('Could not handle changes to %s', ', '.join(changed))
+                return []
+
+            for path in changed:
+                if path in self._stamps:
+                    self._stamps[path] = stamps[path]
+
+        return changed
+
+    def stop(self):
+        self._stop_event.set()
+
+    @staticmethod
+    def _stamp(path: str):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+
+        return stat.st_mtime_ns, stat.st_size